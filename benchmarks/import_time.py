@@ -0,0 +1,67 @@
+"""
+Measures how long it takes a fresh interpreter to import pieces of pymaestro and how many modules
+each import drags in. Each statement runs in its own subprocess so caches from earlier imports do not
+hide the cost.
+
+    python benchmarks/import_time.py [--repeat N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENTS = [
+    ('interpreter', 'pass'),
+    ('import maestro', 'import maestro'),
+    ('import maestro.usc', 'import maestro.usc'),
+    ('from maestro.usc import Usc', 'from maestro.usc import Usc'),
+    ('from maestro.bytecode import BytecodeReader', 'from maestro.bytecode import BytecodeReader'),
+    ('from maestro.usc import ConfigurationFile', 'from maestro.usc import ConfigurationFile'),
+    ('import usb.core', 'import usb.core'),
+]
+
+PROBE = '''
+import sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(elapsed, len(set(sys.modules) - before), int('usb' in sys.modules))
+'''
+
+
+def measure(statement, repeat):
+    times = []
+    modules = usb = 0
+
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', PROBE.format(statement=statement)], cwd=ROOT,
+                                         env=dict(os.environ, PYTHONPATH=ROOT))
+        elapsed, modules, usb = output.split()
+        times.append(float(elapsed))
+
+    times.sort()
+    return times[len(times) // 2], int(modules), bool(int(usb))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=15, help='Fresh interpreters per statement.')
+    args = parser.parse_args()
+
+    print('{:<46} {:>10} {:>8} {:>6}'.format('Statement', 'Median ms', 'Modules', 'pyusb'))
+
+    for name, statement in STATEMENTS:
+        try:
+            median, modules, usb = measure(statement, args.repeat)
+        except subprocess.CalledProcessError:
+            print('{:<46} {:>10}'.format(name, 'failed'))
+            continue
+        print('{:<46} {:>10.2f} {:>8d} {:>6}'.format(name, median * 1000, modules, 'yes' if usb else 'no'))
+
+
+if __name__ == '__main__':
+    main()
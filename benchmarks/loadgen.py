@@ -0,0 +1,229 @@
+"""
+End-to-end I/O load generator. Drives one or more Maestros (or VirtualMaestros) from several threads with
+a configurable mix of requests and reports sustained throughput, latency percentiles and errors per
+request type.
+
+    python benchmarks/loadgen.py --virtual 2 --threads 4 --duration 5 \\
+        --mix setTarget=70,getServos=20,setSpeed=4,setAcceleration=3,getParameter=3
+
+Without --virtual every connected Maestro is used.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+from maestro.usc.protocol import uscParameter
+
+
+def _setTarget(usc, channel, rng):
+    usc.setTarget(channel, rng.randint(3968, 8000))
+
+
+def _setSpeed(usc, channel, rng):
+    usc.setSpeed(channel, rng.randint(0, 100))
+
+
+def _setAcceleration(usc, channel, rng):
+    usc.setAcceleration(channel, rng.randint(0, 50))
+
+
+def _getServos(usc, channel, rng):
+    usc.getVariables('servos')
+
+
+def _getParameter(usc, channel, rng):
+    usc._getRawParameter(usc.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, channel))
+
+
+OPERATIONS = {
+    'setTarget': _setTarget,
+    'setSpeed': _setSpeed,
+    'setAcceleration': _setAcceleration,
+    'getServos': _getServos,
+    'getParameter': _getParameter,
+}
+
+DEFAULT_MIX = 'setTarget=70,getServos=20,setSpeed=4,setAcceleration=3,getParameter=3'
+
+
+def parseMix(text):
+    mix = {}
+
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError('Unknown operation {!r}; choose from {}.'.format(name, ', '.join(sorted(OPERATIONS))))
+        mix[name] = float(weight or 1)
+
+    return mix
+
+
+class Worker(threading.Thread):
+    def __init__(self, usc, mix, channels, rate, deadline, seed):
+        threading.Thread.__init__(self, daemon=True)
+        self.usc = usc
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.channels = channels
+        self.interval = 1.0 / rate if rate else 0.0
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.latencies = dict((name, []) for name in self.names)
+        self.errors = dict((name, 0) for name in self.names)
+
+    def run(self):
+        clock = time.perf_counter
+        nextStart = clock()
+
+        while True:
+            if self.interval:
+                delay = nextStart - clock()
+                if delay > 0:
+                    time.sleep(delay)
+                nextStart += self.interval
+
+            start = clock()
+            if start >= self.deadline:
+                break
+
+            name = self.rng.choices(self.names, self.weights)[0]
+            channel = self.rng.randrange(self.channels)
+
+            try:
+                OPERATIONS[name](self.usc, channel, self.rng)
+            except Exception:
+                self.errors[name] += 1
+                continue
+
+            self.latencies[name].append(clock() - start)
+
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return float('nan')
+    return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+
+def runLoad(uscs, mix, threads, duration, channels=None, rate=None, seed=0):
+    """
+    Runs the load and returns a report dictionary.
+    :param uscs: Usc objects to drive. Threads are assigned to them round robin.
+    :param mix: Operation name -> relative weight.
+    :param threads: Number of worker threads.
+    :param duration: Seconds to run.
+    :param channels: Channels to address, defaults to all channels of each device.
+    :param rate: Optional operations per second per thread; unlimited if None.
+    """
+
+    deadline = time.perf_counter() + duration
+    workers = []
+
+    for i in range(threads):
+        usc = uscs[i % len(uscs)]
+        workers.append(Worker(usc, mix, min(channels or usc.servoCount, usc.servoCount), rate, deadline, seed + i))
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    operations = {}
+    total = 0
+
+    for name in mix:
+        latencies = sorted(l for worker in workers for l in worker.latencies[name])
+        errors = sum(worker.errors[name] for worker in workers)
+        total += len(latencies)
+        operations[name] = {
+            'count': len(latencies),
+            'errors': errors,
+            'opsPerSecond': len(latencies) / elapsed,
+            'p50': percentile(latencies, 0.50),
+            'p99': percentile(latencies, 0.99),
+            'p999': percentile(latencies, 0.999),
+            'max': latencies[-1] if latencies else float('nan'),
+        }
+
+    return {'devices': len(uscs), 'threads': threads, 'elapsed': elapsed, 'count': total,
+            'opsPerSecond': total / elapsed, 'errors': sum(op['errors'] for op in operations.values()),
+            'operations': operations}
+
+
+def printReport(report):
+    print('{} device(s), {} thread(s), {:.2f} s: {} ops, {:.0f} ops/s, {} errors'.format(
+        report['devices'], report['threads'], report['elapsed'], report['count'], report['opsPerSecond'],
+        report['errors']))
+    print('{:<16} {:>9} {:>10} {:>10} {:>10} {:>10} {:>7}'.format('Operation', 'Count', 'ops/s', 'p50 us',
+                                                                 'p99 us', 'p999 us', 'Errors'))
+
+    for name, op in sorted(report['operations'].items()):
+        print('{:<16} {:>9d} {:>10.0f} {:>10.1f} {:>10.1f} {:>10.1f} {:>7d}'.format(
+            name, op['count'], op['opsPerSecond'], op['p50'] * 1e6, op['p99'] * 1e6, op['p999'] * 1e6,
+            op['errors']))
+
+
+class LatentVirtualMaestro(VirtualMaestro):
+    """
+    A VirtualMaestro that adds a fixed delay to every transfer to approximate USB round trips.
+    """
+
+    def __init__(self, latency, *args, **kwargs):
+        VirtualMaestro.__init__(self, *args, **kwargs)
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    def ctrl_transfer(self, *args, **kwargs):
+        with self.lock:
+            if self.latency:
+                time.sleep(self.latency)
+            return VirtualMaestro.ctrl_transfer(self, *args, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--virtual', type=int, default=0, help='Use this many VirtualMaestros instead of USB.')
+    parser.add_argument('--servos', type=int, default=24, help='Channels per VirtualMaestro.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to each virtual transfer.')
+    parser.add_argument('--threads', type=int, default=None, help='Worker threads (default: one per device).')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds to run.')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Comma separated operation=weight list.')
+    parser.add_argument('--channels', type=int, default=None, help='Number of channels to address.')
+    parser.add_argument('--rate', type=float, default=None, help='Target ops/s per thread (default: unlimited).')
+    parser.add_argument('--json', help='Also write the report to this file.')
+    args = parser.parse_args(argv)
+
+    if args.virtual:
+        devices = [LatentVirtualMaestro(args.latency, args.servos, '{:08d}'.format(i)) for i in range(args.virtual)]
+    else:
+        devices = Usc.getConnectedDevices()
+
+    if not devices:
+        print('No devices found.')
+        return 1
+
+    uscs = [Usc(device) for device in devices]
+    report = runLoad(uscs, parseMix(args.mix), args.threads or len(uscs), args.duration, args.channels, args.rate)
+    printReport(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
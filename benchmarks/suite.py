@@ -0,0 +1,304 @@
+"""
+Offline micro-benchmarks for the compiler, codecs and settings paths. No hardware is needed: device
+benchmarks run against an in-process VirtualMaestro.
+
+    python benchmarks/suite.py run [-o results.json] [-k SUBSTRING]
+    python benchmarks/suite.py compare baseline.json results.json [--threshold 0.10]
+
+Results are JSON. compare exits with status 1 when any benchmark got slower than the threshold.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from maestro.bytecode.reader import BytecodeReader
+from maestro.usc.configuration import ConfigurationFile
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+from maestro.usc.protocol import ServoStatus
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function does the setup and returns a callable that performs one
+    operation.
+    """
+
+    def register(function):
+        BENCHMARKS.append((name, function))
+        return function
+
+    return register
+
+
+def makeScript(subroutines):
+    lines = ['begin']
+    lines.extend('  s{}'.format(i) for i in range(subroutines))
+    lines.append('repeat')
+
+    for i in range(subroutines):
+        lines.extend(['sub s{}'.format(i),
+                      '  {} {} servo 100 delay 1 2 plus 3 times drop # move channel {}'.format(4000 + i, i % 12, i % 12),
+                      '  begin dup while 1 minus repeat drop',
+                      '  get_moving_state if 0 else 1 endif drop',
+                      '  return'])
+
+    return '\n'.join(lines) + '\n'
+
+
+SMALL_SCRIPT = makeScript(4)
+LARGE_SCRIPT = makeScript(200)
+
+
+def makeConfiguration(channels, script):
+    lines = ['<!--Pololu Maestro servo controller settings file, http://www.pololu.com/catalog/product/1350-->',
+             '<UscSettings version="1">',
+             '  <NeverSuspend>false</NeverSuspend>',
+             '  <SerialMode>UART_DETECT_BAUD_RATE</SerialMode>',
+             '  <FixedBaudRate>9600</FixedBaudRate>',
+             '  <SerialTimeout>0</SerialTimeout>',
+             '  <EnableCrc>false</EnableCrc>',
+             '  <SerialDeviceNumber>12</SerialDeviceNumber>',
+             '  <SerialMiniSscOffset>0</SerialMiniSscOffset>',
+             '  <EnablePullups>true</EnablePullups>',
+             '  <MiniMaestroServoPeriod>80000</MiniMaestroServoPeriod>',
+             '  <ServoMultiplier>1</ServoMultiplier>',
+             '  <Channels ServosAvailable="6" ServoPeriod="156">']
+
+    for i in range(channels):
+        lines.append('    <!--Channel {}-->'.format(i))
+        lines.append('    <Channel name="" mode="Servo" min="3968" max="8000" homemode="Goto" home="6000" speed="20" '
+                     'acceleration="3" neutral="6000" range="1905" />')
+
+    lines.extend(['  </Channels>',
+                  '  <Sequences />',
+                  '  <Script ScriptDone="false">{}</Script>'.format(script),
+                  '</UscSettings>'])
+
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+@benchmark('compile.read.small')
+def benchCompileSmall():
+    return lambda: BytecodeReader().read(SMALL_SCRIPT, True)
+
+
+@benchmark('compile.read.large')
+def benchCompileLarge():
+    return lambda: BytecodeReader().read(LARGE_SCRIPT, True)
+
+
+@benchmark('compile.getByteList.large')
+def benchGetByteList():
+    program = BytecodeReader().read(LARGE_SCRIPT, True)
+    return program.getByteList
+
+
+@benchmark('compile.completeJumps.large')
+def benchCompleteJumps():
+    program = BytecodeReader().read(LARGE_SCRIPT, True)
+    jumps = [instruction for instruction in program.instructionList if instruction.isJumpToLabel]
+
+    def run():
+        # completeJumps appends the resolved address, so reset it to keep every run identical.
+        for instruction in jumps:
+            del instruction.literalArguments[:]
+        program.completeJumps()
+
+    return run
+
+
+@benchmark('compile.getCRC.large')
+def benchGetCRC():
+    program = BytecodeReader().read(LARGE_SCRIPT, True)
+    return program.getCRC
+
+
+@benchmark('codec.ServoStatus.decode24')
+def benchServoStatus():
+    packed = bytes(range(7)) * 24
+    size = ServoStatus.struct.size
+
+    def run():
+        return [ServoStatus(packed[i * size:(i + 1) * size]) for i in range(24)]
+
+    return run
+
+
+@benchmark('settings.ConfigurationFile.load')
+def benchConfigurationLoad():
+    data = makeConfiguration(24, SMALL_SCRIPT)
+    return lambda: ConfigurationFile.load(io.BytesIO(data))
+
+
+@benchmark('settings.ConfigurationFile.load.largeScript')
+def benchConfigurationLoadLarge():
+    data = makeConfiguration(24, LARGE_SCRIPT)
+    return lambda: ConfigurationFile.load(io.BytesIO(data))
+
+
+@benchmark('settings.ConfigurationFile.loadNoScript')
+def benchConfigurationLoadNoScript():
+    data = makeConfiguration(24, '')
+    return lambda: ConfigurationFile.load(io.BytesIO(data))
+
+
+@benchmark('settings.ConfigurationFile.save')
+def benchConfigurationSave():
+    settings = ConfigurationFile.load(io.BytesIO(makeConfiguration(24, SMALL_SCRIPT)))
+    return lambda: ConfigurationFile.save(settings, io.BytesIO())
+
+
+@benchmark('device.getUscSettings.mini24')
+def benchGetUscSettings():
+    usc = Usc(VirtualMaestro(24))
+    return usc.getUscSettings
+
+
+@benchmark('device.setUscSettings.mini24')
+def benchSetUscSettings():
+    usc = Usc(VirtualMaestro(24))
+    settings = usc.getUscSettings()
+    return lambda: usc.setUscSettings(settings, False)
+
+
+@benchmark('device.getUscSettings.micro6')
+def benchGetUscSettingsMicro():
+    usc = Usc(VirtualMaestro(6))
+    return usc.getUscSettings
+
+
+@benchmark('device.loadProgram.large.mini24')
+def benchLoadProgram():
+    usc = Usc(VirtualMaestro(24))
+    # LARGE_SCRIPT does not fit in 8 KB of script memory.
+    program = BytecodeReader().read(makeScript(150), True)
+    return lambda: usc.loadProgram(program)
+
+
+@benchmark('device.getVariables.servos.mini24')
+def benchGetServos():
+    usc = Usc(VirtualMaestro(24))
+    return lambda: usc.getVariables('servos')
+
+
+def measure(function, repeat, minTime):
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+
+    if elapsed < minTime:
+        number = max(1, int(number * minTime / max(elapsed, 1e-9)))
+
+    times = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    return {'min': times[0], 'median': times[len(times) // 2], 'max': times[-1], 'number': number,
+            'repeat': repeat}
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = {}
+
+    for name, setup in BENCHMARKS:
+        if args.k and args.k not in name:
+            continue
+
+        results[name] = measure(setup(), args.repeat, args.min_time)
+        print('{:<48} {:>12.2f} us  (min {:.2f} us)'.format(name, results[name]['median'] * 1e6,
+                                                             results[name]['min'] * 1e6))
+
+    document = {
+        'version': 1,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'benchmarks': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)['benchmarks']
+
+    with open(args.current) as f:
+        current = json.load(f)['benchmarks']
+
+    regressions = 0
+    print('{:<48} {:>12} {:>12} {:>8}'.format('Benchmark', 'Baseline us', 'Current us', 'Ratio'))
+
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline or name not in current:
+            print('{:<48} {:>12} {:>12}'.format(name, 'missing' if name not in baseline else '',
+                                                'missing' if name not in current else ''))
+            continue
+
+        before = baseline[name][args.statistic]
+        after = current[name][args.statistic]
+        ratio = after / before if before else float('inf')
+
+        if ratio > 1 + args.threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            flag = 'faster'
+        else:
+            flag = ''
+
+        print('{:<48} {:>12.2f} {:>12.2f} {:>7.2f}x {}'.format(name, before * 1e6, after * 1e6, ratio, flag))
+
+    print('{} regression(s) above {:.0f}%'.format(regressions, args.threshold * 100))
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    runParser = commands.add_parser('run', help='Run the benchmarks.')
+    runParser.add_argument('-o', '--output', help='Write results to this JSON file.')
+    runParser.add_argument('-k', help='Only run benchmarks whose name contains this string.')
+    runParser.add_argument('--repeat', type=int, default=5, help='Timing repeats per benchmark.')
+    runParser.add_argument('--min-time', type=float, default=0.2, help='Minimum seconds per repeat.')
+    runParser.set_defaults(handler=run)
+
+    compareParser = commands.add_parser('compare', help='Compare two result files.')
+    compareParser.add_argument('baseline')
+    compareParser.add_argument('current')
+    compareParser.add_argument('--threshold', type=float, default=0.10,
+                               help='Relative slowdown reported as a regression (default 0.10).')
+    compareParser.add_argument('--statistic', choices=['min', 'median'], default='min')
+    compareParser.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
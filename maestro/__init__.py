@@ -1,4 +1,10 @@
-import maestro.bytecode
-import maestro.usc
+import importlib
 
 __all__ = ['usc', 'bytecode']
+
+
+def __getattr__(name):
+    if name not in __all__:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    return importlib.import_module('maestro.' + name)
@@ -1,3 +1,35 @@
-from maestro.bytecode.reader import BytecodeReader
+import importlib
 
-__all__ = ['BytecodeReader']
\ No newline at end of file
+# Public names and the module that defines them, imported on first access.
+_exports = {
+    'BytecodeReader': 'maestro.bytecode.reader',
+    'BytecodeProgram': 'maestro.bytecode.program',
+    'CallAllocation': 'maestro.bytecode.program',
+    'BytecodeInstruction': 'maestro.bytecode.instruction',
+    'ScriptImage': 'maestro.bytecode.image',
+    'compileMany': 'maestro.bytecode.batch',
+    'compileFile': 'maestro.bytecode.batch',
+    'InlineReport': 'maestro.bytecode.inline',
+    'SubroutineInliner': 'maestro.bytecode.inline',
+    'CompiledUnit': 'maestro.bytecode.modules',
+    'ModuleCompiler': 'maestro.bytecode.modules',
+    'link': 'maestro.bytecode.modules',
+    'Frame': 'maestro.bytecode.sequence',
+    'SequenceCompiler': 'maestro.bytecode.sequence',
+    'compileSequence': 'maestro.bytecode.sequence',
+}
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
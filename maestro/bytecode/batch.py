@@ -0,0 +1,193 @@
+import argparse
+import concurrent.futures
+import fnmatch
+import os
+import sys
+import time
+
+from maestro.bytecode.inline import SubroutineInliner
+from maestro.bytecode.reader import BytecodeReader
+
+# Target name -> isMiniMaestro.
+TARGETS = {'micro': False, 'mini': True}
+
+
+class CompileResult:
+    def __init__(self, filename, isMiniMaestro):
+        self.filename = filename
+        self.isMiniMaestro = isMiniMaestro
+        self.byteList = None
+        self.crc = None
+        self.subroutineCount = 0
+        self.callAllocation = None
+        self.inlineReport = None
+        self.outputs = []
+        self.error = None
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def target(self):
+        return 'mini' if self.isMiniMaestro else 'micro'
+
+
+class CompileReport:
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def errors(self):
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def compileFile(filename, isMiniMaestro, outputDirectory=None, listing=True, allocation=None, loopWeight=None,
+                inliner=None):
+    """
+    Compiles a single script. Errors are recorded on the result instead of being raised.
+    :param filename: Path of the script source.
+    :param isMiniMaestro: Compile for the Mini Maestro instead of the Micro Maestro.
+    :param outputDirectory: If given, write <name>.<target>.bin (and .lst) there.
+    :param listing: Also write a listing when writing outputs.
+    :param allocation: Subroutine command allocation, see BytecodeProgram.completeCalls.
+    :param loopWeight: Loop weighting for frequency allocation.
+    :param inliner: Optional SubroutineInliner.
+    """
+
+    result = CompileResult(filename, isMiniMaestro)
+    start = time.perf_counter()
+
+    try:
+        with open(filename) as f:
+            source = f.read()
+
+        program = BytecodeReader().read(source, isMiniMaestro, allocation, loopWeight, inliner)
+
+        result.byteList = bytes(program.getByteList())
+        result.crc = program.getCRC()
+        result.subroutineCount = len(program.subroutineAddresses)
+        result.callAllocation = program.callAllocation
+        result.inlineReport = program.inlineReport
+
+        if outputDirectory is not None:
+            stem = os.path.join(outputDirectory, '{}.{}'.format(
+                os.path.splitext(os.path.basename(filename))[0], result.target))
+
+            with open(stem + '.bin', 'wb') as f:
+                f.write(result.byteList)
+            result.outputs.append(stem + '.bin')
+
+            if listing:
+                BytecodeReader.writeListing(program, stem + '.lst')
+                result.outputs.append(stem + '.lst')
+    except Exception as e:
+        result.error = e
+
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def findScripts(paths, pattern='*.txt'):
+    """
+    Expands directories in paths to the scripts they contain.
+    """
+
+    filenames = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if fnmatch.fnmatch(name, pattern):
+                    filenames.append(os.path.join(path, name))
+        else:
+            filenames.append(path)
+
+    return filenames
+
+
+def compileMany(paths, targets=(False, True), outputDirectory=None, processes=None, listing=True, pattern='*.txt',
+                allocation=None, loopWeight=None, inliner=None):
+    """
+    Compiles many scripts for one or more targets across a process pool.
+    :param paths: Script files and/or directories of scripts.
+    :param targets: isMiniMaestro values to compile each script for.
+    :param outputDirectory: If given, byte files and listings are written there.
+    :param processes: Size of the process pool. 0 compiles in the calling process, None uses one process per CPU.
+    :param listing: Write listings next to the byte files.
+    :param pattern: Filename pattern used when a path is a directory.
+    :param allocation: Subroutine command allocation, see BytecodeProgram.completeCalls.
+    :param loopWeight: Loop weighting for frequency allocation.
+    :param inliner: Optional SubroutineInliner.
+    :return: A CompileReport with one CompileResult per (script, target), in input order.
+    """
+
+    start = time.perf_counter()
+    jobs = [(filename, isMiniMaestro, outputDirectory, listing, allocation, loopWeight, inliner)
+            for filename in findScripts(paths, pattern) for isMiniMaestro in targets]
+
+    if outputDirectory is not None and not os.path.isdir(outputDirectory):
+        os.makedirs(outputDirectory)
+
+    if processes == 0 or len(jobs) <= 1:
+        results = [compileFile(*job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(compileFile, *zip(*jobs), chunksize=max(1, len(jobs) // 64)))
+
+    return CompileReport(results, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='maestro-compile', description='Compile Maestro scripts.')
+    parser.add_argument('paths', nargs='+', help='Script files or directories of scripts.')
+    parser.add_argument('-t', '--target', choices=['micro', 'mini', 'both'], default='both',
+                        help='Device family to compile for (default: both).')
+    parser.add_argument('-o', '--output', help='Directory to write byte files and listings to.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes.')
+    parser.add_argument('--pattern', default='*.txt', help='Script filename pattern inside directories.')
+    parser.add_argument('--no-listing', action='store_true', help='Do not write listings.')
+    parser.add_argument('--allocation', choices=['definition', 'frequency'], default='definition',
+                        help='Give the one-byte subroutine commands to the first subroutines defined (default) or '
+                             'to the most called ones.')
+    parser.add_argument('--loop-weight', type=int, default=None,
+                        help='With frequency allocation, count a call inside n loops LOOP_WEIGHT**n times.')
+    parser.add_argument('--inline', type=int, default=0, metavar='BYTES',
+                        help='Inline subroutines with bodies of at most BYTES bytes at their call sites.')
+    parser.add_argument('--inline-budget', type=int, default=None, metavar='BYTES',
+                        help='Let inlining grow each script by at most BYTES bytes.')
+    args = parser.parse_args(argv)
+
+    targets = tuple(TARGETS.values()) if args.target == 'both' else (TARGETS[args.target],)
+    report = compileMany(args.paths, targets, args.output, args.jobs, not args.no_listing, args.pattern,
+                         args.allocation, args.loop_weight,
+                         SubroutineInliner(args.inline, args.inline_budget) if args.inline else None)
+
+    for result in report.results:
+        if result.ok:
+            saved = result.callAllocation.bytesSaved
+            print('ok     {:<5}  {:5d} bytes  CRC {:04X}  {}{}'.format(
+                result.target, len(result.byteList), result.crc, result.filename,
+                '  ({} bytes saved by allocation)'.format(saved) if saved else ''))
+
+            if result.inlineReport is not None and result.inlineReport.inlined:
+                print('       {} subroutines inlined at {} call sites: {:+d} bytes, {} cycles saved'.format(
+                    len(result.inlineReport.inlined), result.inlineReport.callSites, result.inlineReport.bytesAdded,
+                    result.inlineReport.cyclesSaved))
+        else:
+            print('error  {:<5}  {}: {}'.format(result.target, result.filename, result.error))
+
+    print('{} compiled, {} failed in {:.3f} s'.format(len(report.results) - len(report.errors), len(report.errors),
+                                                     report.elapsed))
+
+    return 0 if report.ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+from maestro.bytecode.program import BytecodeProgram
+
+
+class ScriptImage:
+    """
+    An already compiled script: the bytecode plus the subroutine table needed to load it onto a device.
+    It can be passed to Usc.loadProgram in place of a BytecodeProgram when the source does not need to be
+    compiled again.
+    """
+
+    def __init__(self, byteList, subroutineAddresses, subroutineCommands, crc=None):
+        """
+        :param byteList: The bytecode. Any buffer (bytes, bytearray, memoryview) is accepted and is not copied.
+        :param subroutineAddresses: Subroutine name -> address.
+        :param subroutineCommands: Subroutine name -> opcode used to call it (128-255 or CALL).
+        :param crc: The program CRC. Computed on demand if not given.
+        """
+
+        self.byteList = byteList
+        self.subroutineAddresses = subroutineAddresses
+        self.subroutineCommands = subroutineCommands
+        self.crc = crc
+
+    @staticmethod
+    def fromProgram(program):
+        return ScriptImage(bytes(program.getByteList()), dict(program.subroutineAddresses),
+                           dict(program.subroutineCommands), program.getCRC())
+
+    def __len__(self):
+        return len(self.byteList)
+
+    def getByteList(self):
+        return bytearray(self.byteList)
+
+    def getSubroutineTable(self):
+        """
+        Returns the 256 byte subroutine address table as it is stored on the device.
+        """
+
+        from maestro.usc.main import Usc
+
+        return Usc.subroutineTable(self.subroutineAddresses, self.subroutineCommands)
+
+    def getCRC(self):
+        if self.crc is None:
+            self.crc = BytecodeProgram.scriptCRC(self.subroutineAddresses, self.subroutineCommands, self.byteList)
+
+        return self.crc
@@ -0,0 +1,240 @@
+import copy
+
+from maestro.bytecode.instruction import BytecodeInstruction
+from maestro.bytecode.program import BytecodeProgram
+from maestro.bytecode.protocol import Opcode
+
+
+def _clone(instruction):
+    clone = copy.copy(instruction)
+    clone.literalArguments = list(instruction.literalArguments)
+    return clone
+
+
+def _size(instruction):
+    # Unresolved calls are counted as three-byte CALLs.
+    return 3 if instruction.isCall else len(instruction.toByteList())
+
+
+class InlineReport:
+    """
+    What SubroutineInliner did. Cycles are script instructions executed: every inlined call saves the CALL
+    and the RETURN. cyclesSaved counts each inlined call site once, weighted by loopWeight to the power of
+    its loop depth when one was given, so it compares hot loops rather than measuring a run.
+    """
+
+    def __init__(self):
+        # Subroutine name -> number of call sites replaced by its body.
+        self.inlined = {}
+        # Inlined subroutines whose definition is no longer needed and was left out.
+        self.removed = []
+        # Subroutine name -> why it was not inlined.
+        self.skipped = {}
+        self.bytesBefore = 0
+        self.bytesAfter = 0
+        self.cyclesSaved = 0
+
+    @property
+    def bytesAdded(self):
+        return self.bytesAfter - self.bytesBefore
+
+    @property
+    def callSites(self):
+        return sum(self.inlined.values())
+
+    def __repr__(self):
+        return '<InlineReport {} subroutines at {} call sites, {} removed, {:+d} bytes, {} cycles saved>'.format(
+            len(self.inlined), self.callSites, len(self.removed), self.bytesAdded, self.cyclesSaved)
+
+
+class SubroutineInliner:
+    """
+    Replaces calls to small subroutines with a copy of their body, saving the CALL/RETURN round trip and a
+    call stack entry at the cost of script space. A subroutine is inlined at all of its call sites or not
+    at all, hottest first (by loop-weighted call sites), as long as the script grows by at most budget
+    bytes and still fits in maxScriptLength. Runs on a parsed program, before completeCalls/completeJumps.
+
+    Only subroutines that end with RETURN, do not call themselves (directly or not) and do not jump to
+    labels outside their body are inlined. Labels and BEGIN/IF block labels in the body are renamed in
+    every copy, and a RETURN before the end becomes a jump to the end of the copy.
+    """
+
+    def __init__(self, maxSize=8, budget=None, maxScriptLength=None):
+        """
+        :param maxSize: Largest body, in bytes, that is inlined.
+        :param budget: Most bytes the script may grow by; None for no limit besides maxScriptLength.
+        :param maxScriptLength: Script memory size; defaults to the device's.
+        """
+
+        self.maxSize = maxSize
+        self.budget = budget
+        self.maxScriptLength = maxScriptLength
+        self._copies = 0
+
+    def apply(self, program, isMiniMaestro, allocation=None, loopWeight=None):
+        """
+        Inlines subroutines in place and stores an InlineReport in program.inlineReport.
+        :param allocation: The subroutine command allocation that completeCalls will use, to measure sizes.
+        :param loopWeight: Weights call sites in loops when ranking subroutines and counting cycles.
+        """
+
+        report = InlineReport()
+        instructions = program.instructionList
+        report.bytesBefore = report.bytesAfter = self._resolvedLength(instructions, isMiniMaestro, allocation)
+        limit = self.maxScriptLength or (8192 if isMiniMaestro else 1024)
+
+        if self.budget is not None:
+            limit = min(limit, report.bytesBefore + self.budget)
+
+        weights = program.callSiteWeights(loopWeight)
+        names = [instruction.labelName for instruction in instructions if instruction.isSubroutine]
+        # Stable, so equally hot subroutines are tried in definition order.
+        names.sort(key=lambda name: -weights.get(name, 0))
+
+        regions = self._regions(instructions)
+
+        for name in names:
+            if not weights.get(name):
+                continue
+
+            reason = self._check(instructions, regions, name)
+
+            if reason is not None:
+                report.skipped[name] = reason
+                continue
+
+            candidate, sites, removed = self._inline(instructions, regions, name)
+            length = self._resolvedLength(candidate, isMiniMaestro, allocation)
+
+            if length > limit:
+                report.skipped[name] = 'would make the script {} bytes, over the limit of {}'.format(length, limit)
+                continue
+
+            instructions = candidate
+            regions = self._regions(instructions)
+            report.bytesAfter = length
+            report.inlined[name] = sites
+            report.cyclesSaved += 2 * weights[name]
+
+            if removed:
+                report.removed.append(name)
+
+        program.instructionList = instructions
+        program.inlineReport = report
+        return report
+
+    @staticmethod
+    def _resolvedLength(instructions, isMiniMaestro, allocation):
+        trial = BytecodeProgram()
+        trial.instructionList = [_clone(instruction) for instruction in instructions]
+        trial.completeCalls(isMiniMaestro, allocation)
+        return len(trial.getByteList())
+
+    @staticmethod
+    def _regions(instructions):
+        """
+        Returns subroutine name -> (index of its 'sub', index of the next one or the end).
+        """
+
+        starts = [(index, instruction.labelName) for index, instruction in enumerate(instructions)
+                  if instruction.isSubroutine]
+        ends = [index for index, _ in starts[1:]] + [len(instructions)]
+        return dict((name, (start, end)) for (start, name), end in zip(starts, ends))
+
+    def _check(self, instructions, regions, name):
+        """
+        Returns why a subroutine cannot be inlined, or None.
+        """
+
+        start, end = regions[name]
+        body = instructions[start + 1:end]
+
+        if not body or body[-1].opcode != Opcode.RETURN or body[-1].isLabel or body[-1].isCall:
+            return 'does not end with RETURN'
+
+        size = sum(3 if instruction.opcode == Opcode.RETURN and not instruction.isCall else _size(instruction)
+                   for instruction in body[:-1])
+
+        if size > self.maxSize:
+            return 'body is {} bytes, over the limit of {}'.format(size, self.maxSize)
+
+        labels = set(instruction.labelName for instruction in body if instruction.isLabel)
+
+        for index, instruction in enumerate(instructions):
+            inside = start < index < end
+
+            if instruction.isJumpToLabel and (instruction.labelName in labels) != inside:
+                return 'jumps into or out of its body'
+
+        # Recursion: can the body reach a call to this subroutine?
+        seen = set()
+        pending = [name]
+
+        while pending:
+            caller = pending.pop()
+
+            if caller in seen:
+                continue
+
+            seen.add(caller)
+            callerStart, callerEnd = regions[caller]
+
+            for instruction in instructions[callerStart + 1:callerEnd]:
+                if instruction.isCall:
+                    if instruction.labelName == name:
+                        return 'is recursive'
+                    if instruction.labelName in regions:
+                        pending.append(instruction.labelName)
+
+        return None
+
+    def _inline(self, instructions, regions, name):
+        """
+        Returns (new instruction list, call sites replaced, whether the definition was left out).
+        """
+
+        start, end = regions[name]
+        body = instructions[start + 1:end - 1]
+        result = []
+        sites = 0
+
+        for index, instruction in enumerate(instructions):
+            if not (instruction.isCall and instruction.labelName == name):
+                result.append(instruction)
+                continue
+
+            sites += 1
+            self._copies += 1
+            prefix = 'inline_{}_'.format(self._copies)
+            endLabel = None
+
+            for original in body:
+                clone = _clone(original)
+                # Listings and profiles attribute the copy to the call site.
+                clone.filename, clone.lineNumber, clone.columnNumber = (instruction.filename, instruction.lineNumber,
+                                                                        instruction.columnNumber)
+
+                if clone.isLabel or clone.isJumpToLabel:
+                    clone.labelName = prefix + clone.labelName
+                elif clone.opcode == Opcode.RETURN and not clone.isCall:
+                    endLabel = prefix + 'return'
+                    clone = BytecodeInstruction.newJumpToLabel(endLabel, instruction.filename,
+                                                              instruction.lineNumber, instruction.columnNumber)
+
+                result.append(clone)
+
+            if endLabel is not None:
+                result.append(BytecodeInstruction.newLabel(endLabel, instruction.filename, instruction.lineNumber,
+                                                           instruction.columnNumber))
+
+        # The definition can go once nothing calls it and nothing falls through into it.
+        before = instructions[start - 1] if start > 0 else None
+        fallsThrough = before is None or before.isLabel or before.isSubroutine or before.isCall or \
+            before.opcode not in (Opcode.RETURN, Opcode.JUMP, Opcode.QUIT)
+        removed = not fallsThrough and not any(i.isCall and i.labelName == name for i in result)
+
+        if removed:
+            definition = set(id(instruction) for instruction in instructions[start:end])
+            result = [instruction for instruction in result if id(instruction) not in definition]
+
+        return result, sites, removed
@@ -0,0 +1,315 @@
+import copy
+import hashlib
+import os
+import pickle
+import re
+import time
+
+from maestro.bytecode.program import BytecodeProgram
+from maestro.bytecode.protocol import Opcode
+from maestro.bytecode.reader import BytecodeReader
+
+# '#include other.txt' pulls in the subroutines of another file. It is a comment to the Control Center.
+INCLUDE_PATTERN = re.compile(r'^\s*#\s*include\s+"?([^"\s]+)"?', re.MULTILINE)
+
+# Bumped whenever CompiledUnit changes, so that stale cache files are ignored.
+UNIT_FORMAT = 1
+
+
+class CompiledUnit:
+    """
+    One script file parsed into relocatable form: its instructions with calls and jumps still unresolved,
+    the subroutines it defines, and the files it includes. Labels are local to the unit; the linker renames
+    them so that units can be combined.
+    """
+
+    def __init__(self, filename, digest, isMiniMaestro, program, includes):
+        self.filename = filename
+        self.digest = digest
+        self.isMiniMaestro = isMiniMaestro
+        self.instructions = program.instructionList
+        self.sourceLines = program.sourceLines
+        self.includes = includes
+
+        # Regions: the top-level code (name None), then one per subroutine, running up to the next 'sub'.
+        self.regions = []
+        start = 0
+        name = None
+
+        for index, instruction in enumerate(self.instructions):
+            if instruction.isSubroutine:
+                self.regions.append((name, start, index))
+                name, start = instruction.labelName, index
+
+        self.regions.append((name, start, len(self.instructions)))
+
+        self.subroutines = [name for name, _, _ in self.regions if name is not None]
+        self.calls = set(instruction.labelName for instruction in self.instructions if instruction.isCall)
+        self.undefined = self.calls - set(self.subroutines)
+
+    def __repr__(self):
+        return '<CompiledUnit {} {} subroutines, {} includes>'.format(self.filename, len(self.subroutines),
+                                                                     len(self.includes))
+
+
+class BuildReport:
+    def __init__(self):
+        self.units = []
+        self.compiled = []
+        self.reused = []
+        self.keptSubroutines = []
+        self.droppedSubroutines = []
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return '<BuildReport {} units ({} compiled, {} reused), {} subroutines kept, {} dropped, {:.3f}s>'.format(
+            len(self.units), len(self.compiled), len(self.reused), len(self.keptSubroutines),
+            len(self.droppedSubroutines), self.elapsed)
+
+
+def _fallsThrough(instruction):
+    return instruction.isLabel or instruction.isSubroutine or instruction.isCall or \
+        instruction.opcode not in (Opcode.RETURN, Opcode.JUMP, Opcode.QUIT)
+
+
+def link(units, isMiniMaestro, allocation=None, loopWeight=None, report=None, inliner=None):
+    """
+    Combines compiled units into one program. The first unit is the main file: its top-level code comes
+    first and is where execution starts. Subroutines that cannot be reached from it, through calls or
+    jumps, are left out. Addresses are then resolved by completeCalls and completeJumps as for a single file.
+    :param units: CompiledUnit objects, main file first.
+    :param allocation: Subroutine command allocation, see BytecodeProgram.completeCalls.
+    :param loopWeight: Loop weighting for frequency allocation.
+    :param report: Optional BuildReport to record kept and dropped subroutines in.
+    :param inliner: Optional SubroutineInliner applied to the linked program.
+    """
+
+    # (unit index, region index) of every subroutine and label.
+    subroutines = {}
+    labels = []
+
+    for unitIndex, unit in enumerate(units):
+        unitLabels = {}
+
+        for regionIndex, (name, start, end) in enumerate(unit.regions):
+            if name is None and unitIndex > 0 and start != end:
+                unit.instructions[start].error('Included files may only contain subroutines.')
+
+            if name is not None:
+                if name in subroutines:
+                    unit.instructions[start].error('The subroutine %s has already been defined.' % name)
+                subroutines[name] = (unitIndex, regionIndex)
+
+            for instruction in unit.instructions[start:end]:
+                if instruction.isLabel:
+                    unitLabels[instruction.labelName] = regionIndex
+
+        labels.append(unitLabels)
+
+    # Everything reachable from the top-level code of the main file.
+    kept = set()
+    pending = [(0, 0)]
+
+    while pending:
+        region = pending.pop()
+
+        if region in kept:
+            continue
+
+        kept.add(region)
+        unitIndex, regionIndex = region
+        unit = units[unitIndex]
+        _, start, end = unit.regions[regionIndex]
+
+        for instruction in unit.instructions[start:end]:
+            if instruction.isCall and instruction.labelName in subroutines:
+                pending.append(subroutines[instruction.labelName])
+            elif instruction.isJumpToLabel and instruction.labelName in labels[unitIndex]:
+                pending.append((unitIndex, labels[unitIndex][instruction.labelName]))
+
+        # Code can run off the end of a region into the next 'sub' of the same file.
+        if regionIndex + 1 < len(unit.regions) and (start == end or _fallsThrough(unit.instructions[end - 1])):
+            pending.append((unitIndex, regionIndex + 1))
+
+    program = BytecodeProgram()
+    program.sourceLines = list(units[0].sourceLines)
+    # Instructions are attributed to their unit's full filename, so that files with the same name in
+    # different directories stay apart in listings and error messages.
+    program.sourceFiles = dict((unit.filename, list(unit.sourceLines)) for unit in units)
+
+    for unitIndex, unit in enumerate(units):
+        for regionIndex, (name, start, end) in enumerate(unit.regions):
+            if (unitIndex, regionIndex) not in kept:
+                if report is not None and name is not None:
+                    report.droppedSubroutines.append(name)
+                continue
+
+            if report is not None and name is not None:
+                report.keptSubroutines.append(name)
+
+            for instruction in unit.instructions[start:end]:
+                clone = copy.copy(instruction)
+                clone.literalArguments = list(instruction.literalArguments)
+                clone.filename = unit.filename
+
+                if instruction.isLabel or instruction.isJumpToLabel:
+                    # Labels (including BEGIN/IF block labels) are numbered per file.
+                    clone.labelName = '{}:{}'.format(unitIndex, instruction.labelName)
+
+                program.addInstruction(clone)
+
+    if inliner is not None:
+        inliner.apply(program, isMiniMaestro, allocation, loopWeight)
+
+    program.completeCalls(isMiniMaestro, allocation, loopWeight)
+    program.completeJumps()
+    return program
+
+
+class ModuleCompiler:
+    """
+    Builds scripts split over several files. Each file is compiled on its own into a CompiledUnit that is
+    kept, in memory and optionally in cacheDirectory, until the file changes, so a rebuild only parses the
+    files that were edited. The units are then linked, dropping library subroutines the program never uses.
+
+    A file includes another with a '#include name' line, resolved relative to the including file and then
+    along includePath. Included files may only define subroutines.
+    """
+
+    def __init__(self, isMiniMaestro, includePath=(), cacheDirectory=None, allocation=None, loopWeight=None,
+                 inliner=None):
+        """
+        :param isMiniMaestro: Compile for the Mini Maestro instead of the Micro Maestro.
+        :param includePath: Directories searched for included files.
+        :param cacheDirectory: If given, units are also cached there across processes.
+        :param allocation: Subroutine command allocation, see BytecodeProgram.completeCalls.
+        :param loopWeight: Loop weighting for frequency allocation.
+        :param inliner: Optional SubroutineInliner applied to every linked program.
+        """
+
+        self.isMiniMaestro = isMiniMaestro
+        self.includePath = list(includePath)
+        self.cacheDirectory = cacheDirectory
+        self.allocation = allocation
+        self.loopWeight = loopWeight
+        self.inliner = inliner
+        self.lastBuild = None
+        # Absolute filename -> (mtime_ns, size, CompiledUnit).
+        self._units = {}
+
+        if cacheDirectory is not None and not os.path.isdir(cacheDirectory):
+            os.makedirs(cacheDirectory)
+
+    def _resolve(self, name, includer):
+        for directory in [os.path.dirname(includer)] + self.includePath:
+            candidate = os.path.abspath(os.path.join(directory, name))
+
+            if os.path.isfile(candidate):
+                return candidate
+
+        raise Exception('{}: cannot find included file {}.'.format(includer, name))
+
+    def _cacheFile(self, filename):
+        key = hashlib.sha1('{}\0{}'.format(filename, self.isMiniMaestro).encode('utf-8')).hexdigest()
+        return os.path.join(self.cacheDirectory, key + '.unit')
+
+    def compileUnit(self, filename, report=None):
+        """
+        Returns the CompiledUnit of a file, parsing it only if it changed since it was last compiled.
+        """
+
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        cached = self._units.get(filename)
+
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            unit = cached[2]
+        else:
+            with open(filename, 'rb') as f:
+                data = f.read()
+
+            digest = hashlib.sha1(data).hexdigest()
+            unit = cached[2] if cached is not None and cached[2].digest == digest else None
+
+            if unit is None:
+                unit = self._loadCached(filename, digest)
+
+            if unit is None:
+                source = data.decode('utf-8')
+                includes = [self._resolve(name, filename) for name in INCLUDE_PATTERN.findall(source)]
+                program = BytecodeReader().parse(source, self.isMiniMaestro, os.path.basename(filename))
+                unit = CompiledUnit(filename, digest, self.isMiniMaestro, program, includes)
+                self._storeCached(unit)
+
+                if report is not None:
+                    report.compiled.append(filename)
+
+            self._units[filename] = (stat.st_mtime_ns, stat.st_size, unit)
+
+        if report is not None and filename not in report.compiled:
+            report.reused.append(filename)
+
+        return unit
+
+    def _loadCached(self, filename, digest):
+        if self.cacheDirectory is None:
+            return None
+
+        try:
+            with open(self._cacheFile(filename), 'rb') as f:
+                version, unit = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if version != UNIT_FORMAT or unit.digest != digest or unit.isMiniMaestro != self.isMiniMaestro:
+            return None
+
+        return unit
+
+    def _storeCached(self, unit):
+        if self.cacheDirectory is None:
+            return
+
+        path = self._cacheFile(unit.filename)
+
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((UNIT_FORMAT, unit), f, pickle.HIGHEST_PROTOCOL)
+
+        os.replace(path + '.tmp', path)
+
+    def units(self, filename, report=None):
+        """
+        Returns the units of a file and everything it includes, directly or not, the file itself first.
+        """
+
+        units = []
+        seen = set()
+        pending = [os.path.abspath(filename)]
+
+        while pending:
+            name = pending.pop(0)
+
+            if name in seen:
+                continue
+
+            seen.add(name)
+            unit = self.compileUnit(name, report)
+            units.append(unit)
+            pending.extend(unit.includes)
+
+        return units
+
+    def build(self, filename):
+        """
+        Compiles (or reuses) the units of a program and links them.
+        :return: A BytecodeProgram; what was compiled, reused and dropped is in lastBuild.
+        """
+
+        start = time.perf_counter()
+        report = BuildReport()
+        units = self.units(filename, report)
+        report.units = [unit.filename for unit in units]
+        program = link(units, self.isMiniMaestro, self.allocation, self.loopWeight, report, self.inliner)
+        report.elapsed = time.perf_counter() - start
+        self.lastBuild = report
+        return program
@@ -2,16 +2,42 @@ from maestro.bytecode.instruction import BytecodeInstruction
 from maestro.bytecode.protocol import Opcode
 
 
+class CallAllocation:
+    """
+    How completeCalls handed out the one-byte subroutine commands.
+    """
+
+    def __init__(self, mode, subroutines, shortCalls, longCalls, bytesSaved):
+        self.mode = mode
+        self.subroutines = subroutines
+        # Static call sites using a one-byte command and the three-byte CALL.
+        self.shortCalls = shortCalls
+        self.longCalls = longCalls
+        # Bytes saved compared to allocating in definition order.
+        self.bytesSaved = bytesSaved
+
+    def __repr__(self):
+        return '<CallAllocation {}: {} subroutines, {} short and {} long call sites, {} bytes saved>'.format(
+            self.mode, self.subroutines, self.shortCalls, self.longCalls, self.bytesSaved)
+
+
 class BytecodeProgram:
+    # Subroutine command allocation modes for completeCalls.
+    ALLOCATE_DEFINITION = 'definition'
+    ALLOCATE_FREQUENCY = 'frequency'
+
     def __init__(self):
         self.sourceLines = []
+        # Filename -> source lines, in order, for programs linked from several files (see modules.link).
+        self.sourceFiles = {}
         self.instructionList = []
         self.openBlocks = []
         self.openBlockTypes = []
         self.subroutineAddresses = {}
         self.subroutineCommands = {}
-        self.CRC7_TABLE = tuple(BytecodeProgram.oneByteCRC(i) for i in range(256))
         self.maxBlock = 0
+        self.callAllocation = None
+        self.inlineReport = None
 
     def __getitem__(self, item):
         return self.instructionList[item]
@@ -22,8 +48,8 @@ class BytecodeProgram:
     def blockIsOpen(self):
         return len(self.openBlocks) > 0
 
-    def getSourceLine(self, line):
-        return self.sourceLines[line - 1]
+    def getSourceLine(self, line, filename=None):
+        return self.sourceFiles.get(filename, self.sourceLines)[line - 1]
 
     def addSourceLine(self, line):
         self.sourceLines.append(line)
@@ -98,19 +124,42 @@ class BytecodeProgram:
             except KeyError:
                 bytecodeInstruction.error('The label %s was not found.' % bytecodeInstruction.labelName)
 
-    def completeCalls(self, isMiniMaestro):
-        num1 = 128
+    def completeCalls(self, isMiniMaestro, allocation=None, loopWeight=None):
+        """
+        Assigns subroutine commands and resolves calls. The 128 one-byte commands (128-255) go to the first
+        128 subroutines in definition order, or with allocation=ALLOCATE_FREQUENCY to the subroutines with
+        the most call sites; the others are called with the three-byte CALL. The outcome is in
+        callAllocation.
+        :param loopWeight: With ALLOCATE_FREQUENCY, weight every call site by loopWeight to the power of the
+                           number of loops around it.
+        """
+
+        order = []
+        defined = set(self.subroutineCommands)
 
         for bytecodeInstruction in self.instructionList:
             if bytecodeInstruction.isSubroutine:
-                if bytecodeInstruction.labelName in self.subroutineCommands:
+                if bytecodeInstruction.labelName in defined:
                     bytecodeInstruction.error('The subroutine %s has already been defined.'
                                               % bytecodeInstruction.labelName)
-                self.subroutineCommands[bytecodeInstruction.labelName] = num1 if num1 < 256 else 54
-                num1 += 1
-                if num1 > 255 and not isMiniMaestro:
+                defined.add(bytecodeInstruction.labelName)
+                order.append(bytecodeInstruction.labelName)
+                if len(order) > 127 and not isMiniMaestro:
                     bytecodeInstruction.error('Too many subroutines.  The limit for the Micro Maestro is 128.')
 
+        ranked = list(range(len(order)))
+        callSites = self.callSiteWeights()
+
+        if allocation == BytecodeProgram.ALLOCATE_FREQUENCY:
+            weights = self.callSiteWeights(loopWeight) if loopWeight else callSites
+            # Stable, so equally called subroutines keep definition order.
+            ranked.sort(key=lambda index: -weights.get(order[index], 0))
+        elif allocation not in (None, BytecodeProgram.ALLOCATE_DEFINITION):
+            raise Exception('Unknown subroutine command allocation {}.'.format(allocation))
+
+        for rank, index in enumerate(ranked):
+            self.subroutineCommands[order[index]] = 128 + rank if rank < 128 else Opcode.CALL
+
         for bytecodeInstruction in self.instructionList:
             try:
                 if bytecodeInstruction.isCall:
@@ -118,6 +167,12 @@ class BytecodeProgram:
             except KeyError:
                 bytecodeInstruction.error("Did not understand '%s'." % bytecodeInstruction.labelName)
 
+        shortCalls = sum(callSites.get(name, 0) for name in order if self.subroutineCommands[name] != Opcode.CALL)
+        definitionShortCalls = sum(callSites.get(name, 0) for name in order[:128])
+        self.callAllocation = CallAllocation(allocation or BytecodeProgram.ALLOCATE_DEFINITION, len(order), shortCalls,
+                                             sum(callSites.values()) - shortCalls,
+                                             2 * (shortCalls - definitionShortCalls))
+
         num2 = 0
 
         for bytecodeInstruction in self.instructionList:
@@ -129,6 +184,53 @@ class BytecodeProgram:
             if bytecodeInstruction.opcode == Opcode.CALL:
                 bytecodeInstruction.literalArguments.append(self.subroutineAddresses[bytecodeInstruction.labelName])
 
+    def loopDepths(self):
+        """
+        Returns the number of loops around every instruction. Any backward jump (REPEAT, or a GOTO to an
+        earlier label) closes a loop that starts at its label.
+        """
+
+        labels = {}
+
+        for index, bytecodeInstruction in enumerate(self.instructionList):
+            if bytecodeInstruction.isLabel:
+                labels.setdefault(bytecodeInstruction.labelName, index)
+
+        changes = [0] * (len(self.instructionList) + 1)
+
+        for index, bytecodeInstruction in enumerate(self.instructionList):
+            if bytecodeInstruction.isJumpToLabel:
+                target = labels.get(bytecodeInstruction.labelName)
+
+                if target is not None and target < index:
+                    changes[target] += 1
+                    changes[index + 1] -= 1
+
+        depths = []
+        depth = 0
+
+        for change in changes[:-1]:
+            depth += change
+            depths.append(depth)
+
+        return depths
+
+    def callSiteWeights(self, loopWeight=None):
+        """
+        Returns subroutine name -> number of static call sites, each counted as loopWeight to the power of
+        its loop depth when loopWeight is given.
+        """
+
+        depths = self.loopDepths() if loopWeight else None
+        weights = {}
+
+        for index, bytecodeInstruction in enumerate(self.instructionList):
+            if bytecodeInstruction.isCall:
+                weight = loopWeight ** depths[index] if loopWeight else 1
+                weights[bytecodeInstruction.labelName] = weights.get(bytecodeInstruction.labelName, 0) + weight
+
+        return weights
+
     def completeLiterals(self):
         for bytecodeInstruction in self.instructionList:
             bytecodeInstruction.completeLiterals()
@@ -137,26 +239,50 @@ class BytecodeProgram:
         num = 0
 
         for bytecodeInstruction in self.instructionList:
-            byteList = bytecodeInstruction.toByteList()
-            if num >= program_counter and len(byteList) != 0:
+            num += len(bytecodeInstruction.toByteList())
+            if num > program_counter:
                 return bytecodeInstruction
 
         return None
 
+    def getInstructionAddresses(self):
+        """
+        Returns a list of (address, instruction) pairs for every instruction that emits bytes, in address order.
+        """
+
+        addresses = []
+        num = 0
+
+        for bytecodeInstruction in self.instructionList:
+            length = len(bytecodeInstruction.toByteList())
+            if length != 0:
+                addresses.append((num, bytecodeInstruction))
+            num += length
+
+        return addresses
+
     def getCRC(self):
+        return BytecodeProgram.scriptCRC(self.subroutineAddresses, self.subroutineCommands, self.getByteList())
+
+    @staticmethod
+    def scriptCRC(subroutineAddresses, subroutineCommands, byteList):
+        """
+        Computes the CRC stored in PARAMETER_SCRIPT_CRC over the subroutine table and the bytecode.
+        """
+
         message = bytearray()
         numArray = [0] * 128
 
-        for index in range(len(self.subroutineCommands)):
-            if self.subroutineCommands[index] != 54:
-                numArray[self.subroutineCommands[index] - 128] = self.subroutineAddresses[index]
+        for name, command in subroutineCommands.items():
+            if command != Opcode.CALL:
+                numArray[command - 128] = subroutineAddresses[name]
 
         for num in numArray:
             message.extend((num & 255, num >> 8))
 
-        message.extend(self.getByteList())
+        message.extend(byteList)
 
-        return self.CRC(message)
+        return BytecodeProgram.CRC(message)
 
     @staticmethod
     def oneByteCRC(v):
@@ -170,10 +296,15 @@ class BytecodeProgram:
 
         return num
 
-    def CRC(self, message):
+    @staticmethod
+    def CRC(message):
         num = 0
+        table = BytecodeProgram.CRC7_TABLE
 
         for byte in message:
-            num = (num >> 8 ^ self.CRC7_TABLE[num ^ byte])
+            num = (num >> 8 ^ table[(num ^ byte) & 0xFF])
 
         return num
+
+
+BytecodeProgram.CRC7_TABLE = tuple(BytecodeProgram.oneByteCRC(i) for i in range(256))
@@ -20,23 +20,34 @@ class BytecodeReader:
         if len(program) != 0:
             bytecodeInstruction = program[index1]
 
-        for line in range(1, program.getSourceLineCount() + 1):
-            num2 = 0
-            streamWriter.write('%04X: ' % num1)
+        # A linked program lists every file it was built from, in link order, each under its name.
+        sourceFiles = list(program.sourceFiles.items()) or [(None, program.sourceLines)]
 
-            while bytecodeInstruction is not None and bytecodeInstruction.lineNumber == line:
-                for num3 in bytecodeInstruction.toByteList():
-                    streamWriter.write('%02X' % num3)
-                    num1 += 1
-                    num2 += 2
-                index1 += 1
-                bytecodeInstruction = program[index1] if index1 < len(program) else None
+        for sourceFile, sourceLines in sourceFiles:
+            if sourceFile is not None:
+                streamWriter.write('%s:\n' % sourceFile)
 
-            for index2 in range(20 - num2):
-                streamWriter.write(' ')
+            for line in range(1, len(sourceLines) + 1):
+                num2 = 0
+                streamWriter.write('%04X: ' % num1)
 
-            streamWriter.write(' -- ')
-            streamWriter.write('%s\n' % program.getSourceLine(line))
+                while bytecodeInstruction is not None and bytecodeInstruction.lineNumber == line and \
+                        (sourceFile is None or bytecodeInstruction.filename == sourceFile):
+                    for num3 in bytecodeInstruction.toByteList():
+                        streamWriter.write('%02X' % num3)
+                        num1 += 1
+                        num2 += 2
+                    index1 += 1
+                    bytecodeInstruction = program[index1] if index1 < len(program) else None
+
+                for index2 in range(20 - num2):
+                    streamWriter.write(' ')
+
+                streamWriter.write(' -- ')
+                streamWriter.write('%s\n' % sourceLines[line - 1])
+
+            if sourceFile is not None:
+                streamWriter.write('\n')
 
         streamWriter.write('\n')
         streamWriter.write('Subroutines:\n')
@@ -55,11 +66,34 @@ class BytecodeReader:
 
         for key, num2 in program.subroutineAddresses.items():
             if program.subroutineCommands[key] == 54:
-                streamWriter.write('--  ---     %0x4X    %s\n' % (num2, key))
+                streamWriter.write('--  ---     %04X    %s\n' % (num2, key))
 
         streamWriter.close()
 
-    def read(self, program, isMiniMaestro):
+    def read(self, program, isMiniMaestro, allocation=None, loopWeight=None, inliner=None):
+        """
+        Compiles a script.
+        :param allocation: How one-byte subroutine commands are allocated, see BytecodeProgram.completeCalls.
+        :param loopWeight: Loop weighting for BytecodeProgram.ALLOCATE_FREQUENCY.
+        :param inliner: Optional SubroutineInliner applied before calls are resolved.
+        """
+
+        bytecode_program = self.parse(program, isMiniMaestro)
+
+        if inliner is not None:
+            inliner.apply(bytecode_program, isMiniMaestro, allocation, loopWeight)
+
+        bytecode_program.completeCalls(isMiniMaestro, allocation, loopWeight)
+        bytecode_program.completeJumps()
+
+        return bytecode_program
+
+    def parse(self, program, isMiniMaestro, filename='script'):
+        """
+        Parses a script without resolving calls and jumps, so that it can still be linked with others.
+        :param filename: Name used in error messages.
+        """
+
         bytecode_program = BytecodeProgram()
         self.mode = Mode.NORMAL
 
@@ -83,11 +117,11 @@ class BytecodeReader:
                 else:
                     s = str3.upper()
                     if self.mode == Mode.NORMAL:
-                        self.parseString(s, bytecode_program, 'script', line_number, column_number, isMiniMaestro)
+                        self.parseString(s, bytecode_program, filename, line_number, column_number, isMiniMaestro)
                     elif self.mode == Mode.GOTO:
-                        self.parseGoto(s, bytecode_program, 'script', line_number, column_number)
+                        self.parseGoto(s, bytecode_program, filename, line_number, column_number)
                     elif self.mode == Mode.SUBROUTINE:
-                        self.parseSubroutine(s, bytecode_program, 'script', line_number, column_number)
+                        self.parseSubroutine(s, bytecode_program, filename, line_number, column_number)
                     column_number += len(s) + 1
             line_number += 1
 
@@ -95,8 +129,6 @@ class BytecodeReader:
             currentBlockStartLabel = bytecode_program.getCurrentBlockStartLabel()
             bytecode_program.findLabelInstruction(currentBlockStartLabel).error('BEGIN block was never closed.')
         bytecode_program.completeLiterals()
-        bytecode_program.completeCalls(isMiniMaestro)
-        bytecode_program.completeJumps()
 
         return bytecode_program
 
@@ -210,6 +242,6 @@ class BytecodeReader:
                             raise Exception('%s:%s:%s: is only available on the Mini Maestro 12, 18, and 24.'
                                             % (filename, line_number, column_number))
                         bytecode_program.addInstruction(BytecodeInstruction(op, filename, line_number, column_number))
-                except KeyError:
+                except AttributeError:
                     bytecode_program.addInstruction(
                         BytecodeInstruction.newCall(s, filename, line_number, column_number))
@@ -0,0 +1,260 @@
+import re
+
+from maestro.bytecode.protocol import Opcode
+from maestro.bytecode.reader import BytecodeReader
+
+# Stack values are signed 16-bit, so longer delays are split.
+MAX_DELAY = 32767
+
+# Bytes of the BEGIN/REPEAT frame body for a contiguous run of channels starting at 0 (and elsewhere), and
+# of one unrolled "channel servo".
+LOOP_BYTES = 17
+LOOP_BYTES_OFFSET = 20
+UNROLLED_BYTES = 3
+
+
+class Frame:
+    """
+    One step of a sequence: move channels to targets, then wait duration milliseconds. Channels not listed
+    keep their previous target.
+    """
+
+    def __init__(self, targets, duration, speeds=None, accelerations=None):
+        """
+        :param targets: Dict of channel -> target in quarter-microseconds, or a list indexed by channel.
+        :param duration: Milliseconds to wait after setting the targets.
+        :param speeds: Optional dict/list of channel -> speed applied before the targets.
+        :param accelerations: Optional dict/list of channel -> acceleration applied before the targets.
+        """
+
+        self.targets = Frame._toDict(targets)
+        self.duration = duration
+        self.speeds = Frame._toDict(speeds)
+        self.accelerations = Frame._toDict(accelerations)
+
+    @staticmethod
+    def _toDict(values):
+        if values is None:
+            return {}
+        if isinstance(values, dict):
+            return dict(values)
+        return dict((channel, value) for channel, value in enumerate(values) if value is not None)
+
+
+class SequenceCompiler:
+    """
+    Compiles lists of Frames into a BytecodeProgram that plays them on the device without the host.
+
+    Each sequence becomes an entry subroutine named after it, which scripts can call, plus a PLAY_ stub that
+    calls it and quits, for starting it with restartScriptAtSubroutine. A frame is one literal push of its delay and
+    the targets that changed since the previous frame (packed into LITERAL_N/LITERAL8_N by the compiler)
+    followed by a call to a shared subroutine for that set of channels. Contiguous channel runs are set with
+    a small BEGIN/REPEAT loop when that is shorter than one "channel servo" per channel. Speeds and
+    accelerations are only emitted when they change.
+
+    To play a sequence: usc.loadProgram(program), then play(usc, program, name).
+    """
+
+    def __init__(self, isMiniMaestro=True, maxScriptLength=None):
+        """
+        :param isMiniMaestro: Compile for the Mini Maestro instead of the Micro Maestro.
+        :param maxScriptLength: Raise if the compiled script is longer; defaults to the device's limit.
+        """
+
+        self.isMiniMaestro = isMiniMaestro
+        self.maxScriptLength = maxScriptLength or (8192 if isMiniMaestro else 1024)
+        self.sequences = []
+
+    @staticmethod
+    def subroutineName(name):
+        return 'SEQUENCE_' + re.sub(r'\W', '_', name).upper()
+
+    @staticmethod
+    def playSubroutineName(name):
+        return 'PLAY_' + re.sub(r'\W', '_', name).upper()
+
+    def addSequence(self, name, frames, count=1):
+        """
+        :param name: Sequence name. The entry subroutine is subroutineName(name).
+        :param frames: List of Frame objects.
+        :param count: Number of times to play the frames, or 0 to loop forever.
+        """
+
+        if not frames:
+            raise Exception('The sequence {} has no frames.'.format(name))
+
+        if count < 0 or count > MAX_DELAY:
+            raise Exception('The repeat count must be between 0 and {}.'.format(MAX_DELAY))
+
+        self.sequences.append((name, list(frames), count))
+
+    @staticmethod
+    def _frameSubroutineName(channels):
+        return 'FRAME_' + '_'.join(str(channel) for channel in channels)
+
+    @staticmethod
+    def _isContiguous(channels):
+        return channels[-1] - channels[0] == len(channels) - 1
+
+    def _frameBody(self, channels):
+        # Expects the delay and then the channel targets in ascending channel order on the stack.
+        first, last = channels[0], channels[-1]
+        loopBytes = LOOP_BYTES if first == 0 else LOOP_BYTES_OFFSET
+
+        if self._isContiguous(channels) and len(channels) * UNROLLED_BYTES + 1 > loopBytes:
+            condition = 'dup' if first == 0 else 'dup {} greater_than'.format(first)
+            return ['  {}'.format(last),
+                    '  begin',
+                    '    swap over servo',
+                    '    {}'.format(condition),
+                    '  while',
+                    '    1 minus',
+                    '  repeat',
+                    '  drop delay']
+
+        return ['  ' + ' '.join('{} servo'.format(channel) for channel in reversed(channels)), '  delay']
+
+    def _settingLines(self, values, command):
+        if not values:
+            return []
+
+        pushes = ' '.join('{} {}'.format(values[channel], channel) for channel in sorted(values))
+        return ['  {} {}'.format(pushes, ' '.join([command] * len(values)))]
+
+    def _steps(self, frames):
+        # Yields (index, frame, changed channels, changed speeds, changed accelerations) for each frame.
+        targets = {}
+        speeds = {}
+        accelerations = {}
+
+        for index, frame in enumerate(frames):
+            changedSpeeds = dict((c, v) for c, v in frame.speeds.items() if speeds.get(c) != v)
+            changedAccelerations = dict((c, v) for c, v in frame.accelerations.items() if accelerations.get(c) != v)
+            changed = tuple(sorted(c for c, v in frame.targets.items() if targets.get(c) != v or index == 0))
+
+            speeds.update(changedSpeeds)
+            accelerations.update(changedAccelerations)
+            targets.update(frame.targets)
+
+            yield index, frame, changed, changedSpeeds, changedAccelerations
+
+    @staticmethod
+    def _keyframe(frame, changed):
+        return min(frame.duration, MAX_DELAY), tuple(frame.targets[c] for c in changed), changed
+
+    def source(self):
+        """
+        Returns the generated script source.
+        """
+
+        framesUsed = {}
+        keyframesUsed = {}
+
+        for name, frames, count in self.sequences:
+            for index, frame, changed, speeds, accelerations in self._steps(frames):
+                if changed:
+                    framesUsed[changed] = framesUsed.get(changed, 0) + 1
+                    key = self._keyframe(frame, changed)
+                    keyframesUsed[key] = keyframesUsed.get(key, 0) + 1
+
+        # A channel set used by a single frame is cheaper inline than as a subroutine, and a frame that
+        # recurs is cheaper as a subroutine of its own.
+        shared = sorted(channels for channels, uses in framesUsed.items() if uses > 1)
+        keyframes = sorted((key for key, uses in keyframesUsed.items() if uses > 1 and framesUsed[key[2]] > 1),
+                           key=lambda key: -keyframesUsed[key] * len(key[1]))
+        keyframeNames = dict((key, 'KEYFRAME_{}'.format(i)) for i, key in enumerate(keyframes))
+        lines = ['# Generated by maestro.bytecode.sequence.', 'quit']
+
+        # Declared first so that they get one-byte subroutine numbers.
+        for name, frames, count in self.sequences:
+            lines.extend(['sub {}'.format(self.playSubroutineName(name)),
+                          '  {} quit'.format(self.subroutineName(name))])
+
+        for name, frames, count in self.sequences:
+            lines.append('sub {}'.format(self.subroutineName(name)))
+
+            if count == 0:
+                lines.append('  begin')
+            elif count > 1:
+                lines.extend(['  {}'.format(count), '  begin', '  dup while'])
+
+            for index, frame, changed, speeds, accelerations in self._steps(frames):
+                lines.extend(self._settingLines(speeds, 'speed'))
+                lines.extend(self._settingLines(accelerations, 'acceleration'))
+
+                delay = frame.duration
+                first = min(delay, MAX_DELAY)
+
+                if not changed:
+                    lines.append('  {} delay # frame {}'.format(first, index))
+                elif self._keyframe(frame, changed) in keyframeNames:
+                    lines.append('  {} # frame {}'.format(keyframeNames[self._keyframe(frame, changed)], index))
+                elif framesUsed[changed] > 1:
+                    lines.append('  {} {} {} # frame {}'.format(
+                        first, ' '.join(str(frame.targets[c]) for c in changed), self._frameSubroutineName(changed),
+                        index))
+                else:
+                    lines.append('  {} {} # frame {}'.format(
+                        first, ' '.join(str(frame.targets[c]) for c in changed), index))
+                    lines.extend(self._frameBody(list(changed)))
+
+                delay -= first
+
+                while delay > 0:
+                    lines.append('  {} delay'.format(min(delay, MAX_DELAY)))
+                    delay -= MAX_DELAY
+
+            if count == 0:
+                lines.append('  repeat')
+            elif count > 1:
+                lines.extend(['  1 minus', '  repeat', '  drop'])
+
+            lines.append('  return')
+
+        for channels in shared:
+            lines.append('sub {}'.format(self._frameSubroutineName(channels)))
+            lines.extend(self._frameBody(list(channels)))
+            lines.append('  return')
+
+        for key in keyframes:
+            delay, targets, channels = key
+            lines.extend(['sub {}'.format(keyframeNames[key]),
+                          '  {} {} {}'.format(delay, ' '.join(str(t) for t in targets),
+                                              self._frameSubroutineName(channels)),
+                          '  return'])
+
+        return '\n'.join(lines) + '\n'
+
+    def compile(self):
+        """
+        Returns the compiled BytecodeProgram. Raises if it does not fit in maxScriptLength.
+        """
+
+        program = BytecodeReader().read(self.source(), self.isMiniMaestro)
+        length = len(program.getByteList())
+
+        if length > self.maxScriptLength:
+            raise Exception('The sequences compile to {} bytes, which is more than the {} bytes available.'
+                            .format(length, self.maxScriptLength))
+
+        return program
+
+
+def compileSequence(name, frames, count=1, isMiniMaestro=True, maxScriptLength=None):
+    compiler = SequenceCompiler(isMiniMaestro, maxScriptLength)
+    compiler.addSequence(name, frames, count)
+    return compiler.compile()
+
+
+def play(usc, program, name):
+    """
+    Starts the named sequence of a program already loaded on the device.
+    """
+
+    command = program.subroutineCommands[SequenceCompiler.playSubroutineName(name)]
+
+    if command == Opcode.CALL:
+        raise Exception('The sequence {} cannot be started directly: it has no subroutine number.'.format(name))
+
+    usc.restartScriptAtSubroutine(command)
+    usc.setScriptDone(0)
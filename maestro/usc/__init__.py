@@ -1,17 +1,56 @@
-import inspect
-import pkgutil
+import importlib
 
-_all = set()
+# Public names and the module that defines them. Modules are only imported the first time one of
+# their names is accessed, so importing maestro.usc does not pull in pyusb or unused tooling.
+_exports = {
+    'Usc': 'maestro.usc.main',
+    'Range': 'maestro.usc.schema',
+    'ParameterSpec': 'maestro.usc.schema',
+    'UscSettings': 'maestro.usc.settings',
+    'ChannelSetting': 'maestro.usc.settings',
+    'ChannelColumns': 'maestro.usc.columns',
+    'ConfigurationFile': 'maestro.usc.configuration',
+    'FileLayout': 'maestro.usc.configuration',
+    'Calibration': 'maestro.usc.units',
+    'FlashReport': 'maestro.usc.flash',
+    'MotionPredictor': 'maestro.usc.predictor',
+    'RequestScheduler': 'maestro.usc.scheduler',
+    'SettingsBundle': 'maestro.usc.bundle',
+    'TelemetryRecorder': 'maestro.usc.recorder',
+    'TelemetryRecording': 'maestro.usc.recorder',
+    'ShadowRegisters': 'maestro.usc.shadow',
+    'VirtualMaestro': 'maestro.usc.emulator',
+    'WriteBehindQueue': 'maestro.usc.writebehind',
+    'ScriptProfiler': 'maestro.usc.profiler',
+    'Tracer': 'maestro.usc.tracing',
+    'DeviceRegistry': 'maestro.usc.registry',
+    'FleetProvisioner': 'maestro.usc.provisioning',
+    'ProvisioningResult': 'maestro.usc.provisioning',
+    'uscRequest': 'maestro.usc.protocol',
+    'uscParameter': 'maestro.usc.protocol',
+    'uscSerialMode': 'maestro.usc.protocol',
+    'uscError': 'maestro.usc.protocol',
+    'performanceFlag': 'maestro.usc.protocol',
+    'ChannelMode': 'maestro.usc.protocol',
+    'HomeMode': 'maestro.usc.protocol',
+    'ServoStatus': 'maestro.usc.protocol',
+    'MaestroVariables': 'maestro.usc.protocol',
+    'MicroMaestroVariables': 'maestro.usc.protocol',
+    'MiniMaestroVariables': 'maestro.usc.protocol',
+    'BytecodeReader': 'maestro.bytecode.reader',
+}
 
-for loader, name, is_pkg in pkgutil.walk_packages(__path__):
-    module = loader.find_module(name).load_module(name)
+__all__ = sorted(_exports)
 
-    for name, value in inspect.getmembers(module):
-        if name.startswith('__'):
-            continue
 
-        if name not in _all:
-            globals()[name] = value
-            _all.add(name)
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
-__all__ = list(_all)
\ No newline at end of file
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,271 @@
+import mmap
+import struct
+import zlib
+
+from maestro.bytecode.image import ScriptImage
+from maestro.usc.protocol import uscSerialMode, ChannelMode, HomeMode
+from maestro.usc.settings import UscSettings, ChannelSetting
+
+
+# Enum members indexed by value, cheaper than calling the enum for every channel.
+_channelModes = tuple(sorted(ChannelMode, key=int))
+_homeModes = tuple(sorted(HomeMode, key=int))
+
+
+class SettingsBundle:
+    """
+    Compact, versioned binary form of a UscSettings together with its compiled script, subroutine table
+    and script CRC. Loading a bundle does not parse XML or compile anything, and the script bytes are
+    referenced straight from the (optionally memory-mapped) buffer instead of being copied.
+
+    Layout (little endian): header, channel records, subroutine records, bytecode, channel and subroutine
+    names (UTF-8), script source (UTF-8), sequences. The header holds a CRC-32 of everything that follows it.
+    """
+
+    MAGIC = b'MSTB'
+    VERSION = 2
+
+    FLAG_ENABLE_CRC = 0x01
+    FLAG_NEVER_SUSPEND = 0x02
+    FLAG_SCRIPT_DONE = 0x04
+    FLAG_ENABLE_PULLUPS = 0x08
+    FLAG_SCRIPT_INCONSISTENT = 0x10
+    FLAG_HAS_PROGRAM = 0x20
+    FLAG_HAS_SOURCE = 0x40
+
+    header = struct.Struct('<4sHHIBBBBBxHHHIIHHIII')
+    channel = struct.Struct('<BBHHHHHHHH')
+    subroutine = struct.Struct('<HHH')
+    # Sequences: a count, then per sequence its name length and frame count, the name, and its frames.
+    sequence = struct.Struct('<HH')
+    # Per frame: name length, duration in ms and target count, then the name and the targets.
+    frame = struct.Struct('<HHH')
+
+    @staticmethod
+    def dumps(settings):
+        """
+        Serialises the settings and their compiled script.
+        :return: The bundle as bytes.
+        """
+
+        program = settings.bytecodeProgram
+
+        flags = 0
+        flags |= SettingsBundle.FLAG_ENABLE_CRC if settings.enableCrc else 0
+        flags |= SettingsBundle.FLAG_NEVER_SUSPEND if settings.neverSuspend else 0
+        flags |= SettingsBundle.FLAG_SCRIPT_DONE if settings.scriptDone else 0
+        flags |= SettingsBundle.FLAG_ENABLE_PULLUPS if settings.enablePullups else 0
+        flags |= SettingsBundle.FLAG_SCRIPT_INCONSISTENT if settings.scriptInconsistent else 0
+        flags |= SettingsBundle.FLAG_HAS_PROGRAM if program is not None else 0
+        flags |= SettingsBundle.FLAG_HAS_SOURCE if settings.script is not None else 0
+
+        body = bytearray()
+        names = bytearray()
+
+        for cs in settings.channelSettings:
+            name = cs.name.encode('utf-8')
+            names.extend(name)
+            body.extend(SettingsBundle.channel.pack(cs.mode, cs.homeMode, cs.home, cs.minimum, cs.maximum, cs.neutral,
+                                                    cs.range, cs.speed, cs.acceleration, len(name)))
+
+        if program is not None:
+            byteList = bytes(program.getByteList())
+            scriptCrc = program.getCRC()
+            subroutines = sorted(program.subroutineAddresses.items(), key=lambda item: item[1])
+
+            for name, address in subroutines:
+                encoded = name.encode('utf-8')
+                names.extend(encoded)
+                body.extend(SettingsBundle.subroutine.pack(address, program.subroutineCommands[name], len(encoded)))
+        else:
+            byteList = b''
+            scriptCrc = 0
+            subroutines = []
+
+        source = settings.script.encode('utf-8') if settings.script is not None else b''
+        sequences = SettingsBundle._packSequences(settings.sequences)
+
+        body.extend(byteList)
+        body.extend(names)
+        body.extend(source)
+        body.extend(sequences)
+
+        header = SettingsBundle.header.pack(
+            SettingsBundle.MAGIC, SettingsBundle.VERSION, flags, zlib.crc32(body) & 0xFFFFFFFF,
+            settings.servosAvailable, settings.servoPeriod, settings.serialMode, settings.serialDeviceNumber,
+            settings.miniSscOffset, settings.servoMultiplier, settings.serialTimeout, scriptCrc,
+            settings.miniMaestroServoPeriod, settings.fixedBaudRate, len(settings.channelSettings), len(subroutines),
+            len(byteList), len(source), len(sequences))
+
+        return header + bytes(body)
+
+    @staticmethod
+    def _packSequences(sequences):
+        data = bytearray(struct.pack('<H', len(sequences)))
+
+        for name, frames in sequences:
+            encoded = name.encode('utf-8')
+            data.extend(SettingsBundle.sequence.pack(len(encoded), len(frames)))
+            data.extend(encoded)
+
+            for frameName, duration, targets in frames:
+                encoded = frameName.encode('utf-8')
+                data.extend(SettingsBundle.frame.pack(len(encoded), duration, len(targets)))
+                data.extend(encoded)
+                data.extend(struct.pack('<%dH' % len(targets), *targets))
+
+        return data
+
+    @staticmethod
+    def _unpackSequences(view):
+        sequences = []
+        count, = struct.unpack_from('<H', view)
+        offset = 2
+
+        for _ in range(count):
+            nameLength, frameCount = SettingsBundle.sequence.unpack_from(view, offset)
+            offset += SettingsBundle.sequence.size
+            name = bytes(view[offset:offset + nameLength]).decode('utf-8')
+            offset += nameLength
+            frames = []
+
+            for _ in range(frameCount):
+                nameLength, duration, targetCount = SettingsBundle.frame.unpack_from(view, offset)
+                offset += SettingsBundle.frame.size
+                frameName = bytes(view[offset:offset + nameLength]).decode('utf-8')
+                offset += nameLength
+                targets = list(struct.unpack_from('<%dH' % targetCount, view, offset))
+                offset += 2 * targetCount
+                frames.append((frameName, duration, targets))
+
+            sequences.append((name, frames))
+
+        return sequences
+
+    @staticmethod
+    def loads(buffer, verify=True):
+        """
+        Rebuilds UscSettings from a bundle. The bytecode of the returned settings is a ScriptImage that
+        references the buffer rather than a copy of it.
+        :param buffer: Any object supporting the buffer protocol (bytes, bytearray, mmap).
+        :param verify: Check the CRC-32 of the bundle before decoding it.
+        """
+
+        view = memoryview(buffer)
+
+        if len(view) < SettingsBundle.header.size:
+            raise Exception('The bundle is truncated.')
+
+        (magic, version, flags, checksum, servosAvailable, servoPeriod, serialMode, serialDeviceNumber,
+         miniSscOffset, servoMultiplier, serialTimeout, scriptCrc, miniMaestroServoPeriod, fixedBaudRate,
+         channelCount, subroutineCount, scriptLength, sourceLength,
+         sequencesLength) = SettingsBundle.header.unpack_from(view)
+
+        if magic != SettingsBundle.MAGIC:
+            raise Exception('Not a settings bundle.')
+
+        if version != SettingsBundle.VERSION:
+            raise Exception('Unsupported settings bundle version {}.'.format(version))
+
+        if verify and zlib.crc32(view[SettingsBundle.header.size:]) & 0xFFFFFFFF != checksum:
+            raise Exception('The settings bundle is corrupt (checksum mismatch).')
+
+        settings = UscSettings()
+        settings.servosAvailable = servosAvailable
+        settings.servoPeriod = servoPeriod
+        settings.miniMaestroServoPeriod = miniMaestroServoPeriod
+        settings.servoMultiplier = servoMultiplier
+        settings.serialMode = uscSerialMode(serialMode)
+        settings.fixedBaudRate = fixedBaudRate
+        settings.enableCrc = bool(flags & SettingsBundle.FLAG_ENABLE_CRC)
+        settings.neverSuspend = bool(flags & SettingsBundle.FLAG_NEVER_SUSPEND)
+        settings.serialDeviceNumber = serialDeviceNumber
+        settings.miniSscOffset = miniSscOffset
+        settings.serialTimeout = serialTimeout
+        settings.scriptDone = bool(flags & SettingsBundle.FLAG_SCRIPT_DONE)
+        settings.enablePullups = bool(flags & SettingsBundle.FLAG_ENABLE_PULLUPS)
+        settings.scriptInconsistent = bool(flags & SettingsBundle.FLAG_SCRIPT_INCONSISTENT)
+
+        offset = SettingsBundle.header.size
+        end = offset + channelCount * SettingsBundle.channel.size
+        nameLengths = []
+
+        for (mode, homeMode, home, minimum, maximum, neutral, rangeValue, speed, acceleration,
+             nameLength) in SettingsBundle.channel.iter_unpack(view[offset:end]):
+            cs = ChannelSetting()
+            cs.mode = _channelModes[mode]
+            cs.homeMode = _homeModes[homeMode]
+            cs.home = home
+            cs.minimum = minimum
+            cs.maximum = maximum
+            cs.neutral = neutral
+            cs.range = rangeValue
+            cs.speed = speed
+            cs.acceleration = acceleration
+            settings.channelSettings.append(cs)
+            nameLengths.append(nameLength)
+
+        offset = end
+        end = offset + subroutineCount * SettingsBundle.subroutine.size
+        subroutines = list(SettingsBundle.subroutine.iter_unpack(view[offset:end]))
+        offset = end
+
+        byteList = view[offset:offset + scriptLength]
+        offset += scriptLength
+
+        for cs, nameLength in zip(settings.channelSettings, nameLengths):
+            cs.name = bytes(view[offset:offset + nameLength]).decode('utf-8')
+            offset += nameLength
+
+        subroutineAddresses = {}
+        subroutineCommands = {}
+
+        for address, command, nameLength in subroutines:
+            name = bytes(view[offset:offset + nameLength]).decode('utf-8')
+            offset += nameLength
+            subroutineAddresses[name] = address
+            subroutineCommands[name] = command
+
+        if flags & SettingsBundle.FLAG_HAS_SOURCE:
+            settings.script = bytes(view[offset:offset + sourceLength]).decode('utf-8')
+
+        offset += sourceLength
+        settings.sequences = SettingsBundle._unpackSequences(view[offset:offset + sequencesLength])
+
+        if flags & SettingsBundle.FLAG_HAS_PROGRAM:
+            settings.bytecodeProgram = ScriptImage(byteList, subroutineAddresses, subroutineCommands, scriptCrc)
+
+        return settings
+
+    @staticmethod
+    def save(settings, file):
+        """
+        Writes a bundle to a filename or binary file object.
+        """
+
+        data = SettingsBundle.dumps(settings)
+
+        if hasattr(file, 'write'):
+            file.write(data)
+        else:
+            with open(file, 'wb') as f:
+                f.write(data)
+
+    @staticmethod
+    def load(file, useMmap=True, verify=True):
+        """
+        Reads a bundle from a filename or binary file object.
+        :param useMmap: Memory-map the file so the script bytes stay in the page cache, shared between
+                        processes, instead of being read into private memory.
+        :param verify: Check the CRC-32 of the bundle before decoding it.
+        """
+
+        if hasattr(file, 'read'):
+            if useMmap and hasattr(file, 'fileno'):
+                return SettingsBundle.loads(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), verify)
+            return SettingsBundle.loads(file.read(), verify)
+
+        with open(file, 'rb') as f:
+            if useMmap:
+                return SettingsBundle.loads(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), verify)
+            return SettingsBundle.loads(f.read(), verify)
@@ -0,0 +1,297 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from maestro.usc.protocol import ChannelMode, HomeMode
+from maestro.usc.settings import ChannelSetting, MODE_DEFAULTS
+
+# Enum members indexed by value.
+_channelModes = tuple(sorted(ChannelMode, key=int))
+_homeModes = tuple(sorted(HomeMode, key=int))
+
+
+def _requireNumpy():
+    if numpy is None:
+        raise ImportError('Columnar channel settings require numpy (pip install pymaestro[numpy]).')
+
+
+class ChannelColumns:
+    """
+    Channel settings stored column-wise: one small integer array per ChannelSetting field, and names as
+    indices into a table of distinct names. A channel takes 19 bytes instead of a ChannelSetting and its
+    dict, and the channels of many devices can be kept in one set of columns (see concatenate), so that
+    normalization and comparisons over a whole fleet are a few NumPy operations.
+    """
+
+    # ChannelSetting field -> dtype. Every value the parameter schema allows fits.
+    fields = (
+        ('mode', 'u1'),
+        ('homeMode', 'u1'),
+        ('home', 'u2'),
+        ('minimum', 'u2'),
+        ('maximum', 'u2'),
+        ('neutral', 'u2'),
+        ('range', 'u2'),
+        ('speed', 'u2'),
+        ('acceleration', 'u1'),
+    )
+
+    def __init__(self, count=0, columns=None, names=None, nameIndex=None, offsets=None):
+        """
+        :param count: Number of channels, all with default settings, when no columns are given.
+        :param columns: Optional dict of field -> array.
+        :param names: Table of distinct channel names; index 0 is always ''.
+        :param nameIndex: Per-channel index into names.
+        :param offsets: Optional start of every device in the columns, plus the total length.
+        """
+
+        _requireNumpy()
+
+        if columns is None:
+            default = ChannelSetting()
+            columns = dict((field, numpy.full(count, int(getattr(default, field)), dtype))
+                           for field, dtype in self.fields)
+
+        self.columns = columns
+        self.names = names if names is not None else ['']
+        self.nameIndex = nameIndex if nameIndex is not None else numpy.zeros(count, numpy.uint32)
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.nameIndex)
+
+    def __getattr__(self, field):
+        # columns.speed etc. are the arrays themselves.
+        try:
+            return self.__dict__['columns'][field]
+        except KeyError:
+            raise AttributeError(field)
+
+    @staticmethod
+    def fromChannelSettings(channelSettings):
+        """
+        :param channelSettings: A list of ChannelSetting, or a UscSettings.
+        """
+
+        _requireNumpy()
+
+        if hasattr(channelSettings, 'channelSettings'):
+            channelSettings = channelSettings.channelSettings
+
+        names = ['']
+        nameIds = {'': 0}
+        nameIndex = numpy.empty(len(channelSettings), numpy.uint32)
+
+        for i, cs in enumerate(channelSettings):
+            index = nameIds.get(cs.name)
+
+            if index is None:
+                index = nameIds[cs.name] = len(names)
+                names.append(cs.name)
+
+            nameIndex[i] = index
+
+        columns = dict((field, numpy.fromiter((getattr(cs, field) for cs in channelSettings), dtype,
+                                              len(channelSettings)))
+                       for field, dtype in ChannelColumns.fields)
+
+        return ChannelColumns(columns=columns, names=names, nameIndex=nameIndex)
+
+    def toChannelSettings(self):
+        """
+        :return: A list of new ChannelSetting objects.
+        """
+
+        lists = [self.columns[field].tolist() for field, _ in self.fields]
+        names = [self.names[index] for index in self.nameIndex.tolist()]
+        settings = []
+
+        for name, mode, homeMode, home, minimum, maximum, neutral, range, speed, acceleration in zip(names, *lists):
+            cs = ChannelSetting.__new__(ChannelSetting)
+            cs.__dict__.update(name=name, mode=_channelModes[mode], homeMode=_homeModes[homeMode], home=home,
+                               minimum=minimum, maximum=maximum, neutral=neutral, range=range, speed=speed,
+                               acceleration=acceleration)
+            settings.append(cs)
+
+        return settings
+
+    def apply(self, settings):
+        """
+        Replaces the channel settings of a UscSettings with these.
+        """
+
+        settings.channelSettings = self.toChannelSettings()
+
+    def copy(self):
+        return ChannelColumns(columns=dict((field, column.copy()) for field, column in self.columns.items()),
+                              names=list(self.names), nameIndex=self.nameIndex.copy(),
+                              offsets=None if self.offsets is None else self.offsets.copy())
+
+    def __getitem__(self, index):
+        """
+        columns[i] is a ChannelSetting; a slice, mask or index array gives a ChannelColumns sharing the name
+        table.
+        """
+
+        if isinstance(index, (int, numpy.integer)):
+            return self[[index]].toChannelSettings()[0]
+
+        return ChannelColumns(columns=dict((field, column[index]) for field, column in self.columns.items()),
+                              names=self.names, nameIndex=self.nameIndex[index])
+
+    def name(self, channel):
+        return self.names[self.nameIndex[channel]]
+
+    @staticmethod
+    def concatenate(parts):
+        """
+        Joins the channels of several devices, merging their name tables. offsets of the result holds the
+        start of every part and the total length, so part i is columns[offsets[i]:offsets[i + 1]].
+        :param parts: ChannelColumns, lists of ChannelSetting or UscSettings.
+        """
+
+        _requireNumpy()
+        parts = [part if isinstance(part, ChannelColumns) else ChannelColumns.fromChannelSettings(part)
+                 for part in parts]
+
+        names = ['']
+        nameIds = {'': 0}
+        nameIndexes = []
+
+        for part in parts:
+            remap = numpy.empty(len(part.names), numpy.uint32)
+
+            for i, name in enumerate(part.names):
+                index = nameIds.get(name)
+
+                if index is None:
+                    index = nameIds[name] = len(names)
+                    names.append(name)
+
+                remap[i] = index
+
+            nameIndexes.append(remap[part.nameIndex])
+
+        columns = dict((field, numpy.concatenate([part.columns[field] for part in parts]).astype(dtype))
+                       for field, dtype in ChannelColumns.fields)
+        offsets = numpy.concatenate(([0], numpy.cumsum([len(part) for part in parts]))).astype(numpy.int64)
+        return ChannelColumns(columns=columns, names=names,
+                              nameIndex=numpy.concatenate(nameIndexes).astype(numpy.uint32), offsets=offsets)
+
+    def parts(self):
+        """
+        Yields the ChannelColumns of every device joined by concatenate.
+        """
+
+        offsets = self.offsets if self.offsets is not None else (0, len(self))
+
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield self[int(start):int(end)]
+
+    def deviceOf(self, channels):
+        """
+        Maps indices into these columns to (part, channel within the part) arrays.
+        """
+
+        channels = numpy.asarray(channels, numpy.int64)
+
+        if self.offsets is None:
+            return numpy.zeros_like(channels), channels
+
+        parts = numpy.searchsorted(self.offsets, channels, 'right') - 1
+        return parts, channels - self.offsets[parts]
+
+    def normalize(self):
+        """
+        Applies the per-channel part of Usc.fixSettings to every channel at once: Input and Output channels
+        get the fixed limits, speed and acceleration their mode requires.
+        :return: Boolean array of the channels that changed.
+        """
+
+        changed = numpy.zeros(len(self), bool)
+
+        for mode, defaults in MODE_DEFAULTS.items():
+            mask = self.columns['mode'] == int(mode)
+
+            if not mask.any():
+                continue
+
+            for field, value in defaults:
+                column = self.columns[field]
+                changed |= mask & (column != int(value))
+                column[mask] = int(value)
+
+        return changed
+
+    def fix(self, servoCount, microMaestro=False, servosAvailable=6):
+        """
+        Columnar version of the channel part of Usc.fixSettings: truncates or pads to servoCount channels
+        (padding Micro Maestro channels past servosAvailable as inputs), then normalizes.
+        :return: (fixed ChannelColumns, list of warnings).
+        """
+
+        warnings = []
+        fixed = self
+
+        if len(self) > servoCount:
+            warnings.append('The settings loaded include settings for {} channels, '
+                            'but this device has only {} channels. The extra channel settings will be ignored.'
+                            .format(len(self), servoCount))
+            fixed = self[:servoCount]
+
+        elif len(self) < servoCount:
+            warnings.append('The settings loaded include settings for only {} channels, '
+                            'but this device has {} channels. '
+                            'The other channels will be initialized with default settings.'
+                            .format(len(self), servoCount))
+            padding = ChannelColumns(servoCount - len(self))
+
+            if microMaestro:
+                padding.columns['mode'][numpy.arange(len(self), servoCount) >= servosAvailable] = ChannelMode.Input
+
+            fixed = ChannelColumns.concatenate([self, padding])
+            fixed.offsets = None
+
+        fixed = fixed.copy()
+        fixed.normalize()
+        return fixed, warnings
+
+    def diff(self, other):
+        """
+        Compares two column sets of the same length channel by channel.
+        :return: Dict of field (including 'name') -> indices of the channels where it differs; fields that
+                 are equal everywhere are left out.
+        """
+
+        if len(self) != len(other):
+            raise Exception('Cannot compare {} channels with {} channels.'.format(len(self), len(other)))
+
+        differences = {}
+
+        for field, _ in self.fields:
+            indices = numpy.flatnonzero(self.columns[field] != other.columns[field])
+
+            if indices.size:
+                differences[field] = indices
+
+        if self.names == other.names:
+            names = numpy.flatnonzero(self.nameIndex != other.nameIndex)
+        else:
+            # Compare through a merged name table.
+            merged = ChannelColumns.concatenate([self, other]).nameIndex
+            names = numpy.flatnonzero(merged[:len(self)] != merged[len(self):])
+
+        if names.size:
+            differences['name'] = names
+
+        return differences
+
+    def __eq__(self, other):
+        return isinstance(other, ChannelColumns) and len(self) == len(other) and not self.diff(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<ChannelColumns {} channels, {} names>'.format(len(self), len(self.names))
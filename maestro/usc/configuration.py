@@ -1,292 +1,519 @@
+import io
+import re
 import xml.etree.ElementTree as ET
+from decimal import Decimal
 
-from maestro.usc.protocol import uscSerialMode, ChannelMode, HomeMode
+from maestro.usc.protocol import uscSerialMode, uscParameter, ChannelMode, HomeMode
+from maestro.usc.schema import getParameterSpec
 from maestro.usc.settings import UscSettings, ChannelSetting
 
+HEADER = '<!--Pololu Maestro servo controller settings file, http://www.pololu.com/catalog/product/1350-->'
 
-class ConfigurationFile:
-    @staticmethod
-    def load(file):
-        warnings = []
+_indentPattern = re.compile(br'<UscSettings[^>]*>\r?\n([ \t]*)<')
 
-        tree = ET.parse(file)
-        root = tree.getroot()
 
-        settings = UscSettings()
+def _parseBool(text):
+    text = text.lower()
 
-        def getKey(key, warn=True):
-            key = root.find(key)
+    if text == 'false':
+        return False
+    elif text == 'true':
+        return True
+    else:
+        return None
 
-            if key is None and warn:
-                warnings.append('The {} setting was missing.'.format(key))
 
-            return key
+def _formatBool(value):
+    return 'true' if value else 'false'
 
-        def getAttrib(dict, key):
-            if key in dict:
-                return True
-            else:
-                warnings.append('The {} attribute was missing'.format(key))
-                return False
 
-        def parseBool(value):
-            value = value.lower()
+def _parseUnsigned(bits):
+    limit = (1 << bits) - 1
 
-            if value == 'false':
-                return False
-            elif value == 'true':
-                return True
-            else:
-                return None
+    def parse(text):
+        try:
+            value = int(text)
+        except ValueError:
+            return None
+
+        return value if 0 <= value <= limit else None
+
+    return parse
 
-        def parseInt(value, type):
-            try:
-                value = int(value)
-            except ValueError:
-                return None
 
-            if type == 'u8' and 0 <= value <= 255:
-                return value
-            elif type == 'u16' and 0 <= value <= 65535:
-                return value
-            elif type == 'u32' and 0 <= value <= 4294967295:
-                return value
+def _parseSetting(parameter):
+    spec = getParameterSpec(parameter)
 
+    def parse(text):
+        try:
+            value = int(text)
+        except ValueError:
             return None
 
-        assert (root.tag == 'UscSettings')
-
-        if not 'version' in root.attrib:
-            warnings.append('This file has no version number, so it might have been read incorrectly.')
-        elif root.attrib['version'] != '1':
-            warnings.append('Unrecognized settings file version {}.'.format(root.attrib['version']))
-
-        NeverSuspend = getKey('NeverSuspend')
-        SerialMode = getKey('SerialMode')
-        FixedBaudRate = getKey('FixedBaudRate')
-        SerialTimeout = getKey('SerialTimeout')
-        EnableCrc = getKey('EnableCrc')
-        SerialDeviceNumber = getKey('SerialDeviceNumber')
-        SerialMiniSscOffset = getKey('SerialMiniSscOffset')
-
-        Script = getKey('Script')
-        Channels = getKey('Channels')
-
-        ServosAvailable = getKey('ScriptAvailable', warn=False)
-        ServoPeriod = getKey('ServoPeriod', warn=False)
-        EnablePullups = getKey('EnablePullups', warn=False)
-        MiniMaestroServoPeriod = getKey('MiniMaestroServoPeriod', warn=False)
-        ServoMultiplier = getKey('ServoMultiplier', warn=False)
-
-        if Channels is not None:
-            for channel in Channels:
-                cs = ChannelSetting()
-                attrib = channel.attrib
-
-                if getAttrib(attrib, 'name'):
-                    cs.name = attrib['name']
-
-                if getAttrib(attrib, 'mode'):
-                    mode = attrib['mode'].lower()
-
-                    if mode == 'servomultiplied':
-                        cs.mode = ChannelMode.ServoMultiplied
-                    elif mode == 'servo':
-                        cs.mode = ChannelMode.Servo
-                    elif mode == 'input':
-                        cs.mode = ChannelMode.Input
-                    elif mode == 'output':
-                        cs.mode = ChannelMode.Output
-                    else:
-                        warnings.append('Invalid mode {}.'.format(mode))
-
-                if getAttrib(attrib, 'homemode'):
-                    mode = attrib['homemode'].lower()
-
-                    if mode == 'goto':
-                        cs.homeMode = HomeMode.Goto
-                    elif mode == 'off':
-                        cs.homeMode = HomeMode.Off
-                    elif mode == 'ignore':
-                        cs.homeMode = HomeMode.Ignore
-
-                if getAttrib(attrib, 'min'):
-                    value = parseInt(attrib['min'], 'u16')
-
-                    if value is not None:
-                        cs.minimum = value
-                    else:
-                        warnings.append('Error in value of min. Skipping.')
-
-                if getAttrib(attrib, 'max'):
-                    value = parseInt(attrib['max'], 'u16')
-
-                    if value is not None:
-                        cs.maximum = value
-                    else:
-                        warnings.append('Error in value of max. Skipping.')
-
-                if getAttrib(attrib, 'home'):
-                    value = parseInt(attrib['home'], 'u16')
-
-                    if value is not None:
-                        cs.home = value
-                    else:
-                        warnings.append('Error in value of home. Skipping.')
-
-                if getAttrib(attrib, 'speed'):
-                    value = parseInt(attrib['speed'], 'u16')
-
-                    if value is not None:
-                        cs.speed = value
-                    else:
-                        warnings.append('Error in value of speed. Skipping.')
-
-                if getAttrib(attrib, 'acceleration'):
-                    value = parseInt(attrib['acceleration'], 'u8')
-
-                    if value is not None:
-                        cs.acceleration = value
-                    else:
-                        warnings.append('Error in value of acceleration. Skipping.')
-
-                if getAttrib(attrib, 'neutral'):
-                    value = parseInt(attrib['neutral'], 'u16')
-
-                    if value is not None:
-                        cs.neutral = value
-                    else:
-                        warnings.append('Error in value of neutral. Skipping.')
-
-                if getAttrib(attrib, 'range'):
-                    value = parseInt(attrib['range'], 'u16')
-
-                    if value is not None:
-                        cs.range = value
-                    else:
-                        warnings.append('Error in value of range. Skipping.')
-
-                settings.channelSettings.append(cs)
-
-        if Script is not None:
-            if getAttrib(Script.attrib, 'ScriptDone'):
-                value = parseBool(Script.attrib['ScriptDone'])
-
-                if value is not None:
-                    settings.scriptDone = value
-                else:
-                    warnings.append('Error in value of ScriptDone. Skipping.')
+        return value if spec.minimumSetting <= value <= spec.maximumSetting else None
+
+    return parse
+
+
+def _parseEnum(enum, prefix=''):
+    members = dict((member.name[len(prefix):].lower(), member) for member in enum)
+    return lambda text: members.get(text.lower())
+
+
+def _formatEnum(enum, prefix=''):
+    return lambda value: enum(value).name[len(prefix):]
+
+
+def _parseSerialMode(text):
+    # Like the Control Center, anything unrecognised means detecting the baud rate.
+    return _serialModes.get(text.lower(), uscSerialMode.SERIAL_MODE_UART_DETECT_BAUD_RATE)
+
+
+_serialModes = dict((member.name[len('SERIAL_MODE_'):].lower(), member) for member in uscSerialMode)
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _quote(text):
+    return _escape(text).replace('"', '&quot;')
+
+
+class FileLayout:
+    """
+    How a settings file was written: the order of its elements, which period settings sit on <Channels>,
+    comments, indentation, line endings and whatever surrounds the root element. ConfigurationFile.load
+    records it on UscSettings.fileLayout so that save writes an unchanged file back byte for byte.
+    """
+
+    def __init__(self, elements, channelAttributes, prolog=HEADER + '\n', trailer='\n', newline='\n', indent='  ',
+                 periodComment=None, channelComments=True):
+        """
+        :param elements: Tags of the children of <UscSettings>, in order.
+        :param channelAttributes: Settings written as attributes of <Channels>, in order.
+        :param periodComment: (text, period settings) of the <!--Period = ...--> comment; the text is reused
+                              while the period settings are unchanged. True computes it, None leaves it out.
+        """
+
+        self.elements = elements
+        self.channelAttributes = channelAttributes
+        self.prolog = prolog
+        self.trailer = trailer
+        self.newline = newline
+        self.indent = indent
+        self.periodComment = periodComment
+        self.channelComments = channelComments
+
+    @staticmethod
+    def default(settings):
+        """
+        The layout the Maestro Control Center writes for these settings.
+        """
+
+        elements = ['NeverSuspend', 'SerialMode', 'FixedBaudRate', 'SerialTimeout', 'EnableCrc', 'SerialDeviceNumber',
+                    'SerialMiniSscOffset']
+
+        if len(settings) == 6:
+            channelAttributes = ['ServosAvailable', 'ServoPeriod']
+        else:
+            elements.append('EnablePullups')
+            channelAttributes = ['MiniMaestroServoPeriod', 'ServoMultiplier']
+
+        return FileLayout(elements + ['Channels', 'Sequences', 'Script'], channelAttributes, periodComment=True)
+
+
+class _Loader:
+    """
+    Parser target for ConfigurationFile.loads: builds the settings from expat's callbacks as the document
+    streams past, without building a tree.
+    """
+
+    def __init__(self, warnings):
+        self.warnings = warnings
+        self.settings = UscSettings()
+        self.found = set()
+        self.elements = []
+        self.channelAttributes = []
+        self.script = None
+        self.periodComment = None
+        self.channelComments = False
+
+        self._depth = 0
+        self._text = None
+        self._frameText = None
+        self._attrib = None
+        self._frames = None
+        # Channels are usually configured alike, so each distinct set of attributes is parsed once.
+        self._channels = {}
+
+    def _setField(self, name, text):
+        attribute, parse, _ = ConfigurationFile.settingFields[name]
+        value = parse(text)
+        self.found.add(name)
+
+        if value is not None:
+            setattr(self.settings, attribute, value)
+        else:
+            self.warnings.append('Error in value of {}. Skipping.'.format(name))
+
+    def start(self, tag, attrib):
+        self._depth += 1
+        depth = self._depth
+
+        if depth == 1:
+            assert (tag == 'UscSettings')
+
+            if not 'version' in attrib:
+                self.warnings.append('This file has no version number, so it might have been read incorrectly.')
+            elif attrib['version'] != '1':
+                self.warnings.append('Unrecognized settings file version {}.'.format(attrib['version']))
+
+        elif depth == 2:
+            self.elements.append(tag)
+            self._attrib = attrib
+            self._text = []
+
+            if tag == 'Channels':
+                for name, text in attrib.items():
+                    if name in ConfigurationFile.settingFields:
+                        self._setField(name, text)
+                        self.channelAttributes.append(name)
+
+        elif depth == 3 and tag == 'Channel':
+            self._addChannel(attrib)
+
+        elif depth == 3 and tag == 'Sequence':
+            self._attrib = attrib
+            self._frames = []
+
+        elif depth == 4 and tag == 'Frame' and self._frames is not None:
+            self._frames.append(attrib)
+            self._frameText = []
+
+    def _addChannel(self, attrib):
+        key = tuple(attrib.items())
+        parsed = self._channels.get(key)
+
+        if parsed is None:
+            cs = ChannelSetting()
+            problems = []
+            ConfigurationFile._loadAttributes(attrib, ConfigurationFile.channelFields, cs, problems)
+            parsed = self._channels[key] = (cs.__dict__, problems)
+
+        cs = ChannelSetting.__new__(ChannelSetting)
+        cs.__dict__.update(parsed[0])
+        self.warnings.extend(parsed[1])
+        self.settings.channelSettings.append(cs)
+
+    def data(self, text):
+        if self._frameText is not None:
+            self._frameText.append(text)
+        elif self._text is not None:
+            self._text.append(text)
+
+    def end(self, tag):
+        depth = self._depth
+        self._depth -= 1
+
+        if depth == 2:
+            text = ''.join(self._text)
+
+            if tag in ConfigurationFile.settingFields:
+                self._setField(tag, text)
+            elif tag == 'Script':
+                self.script = text
+                ConfigurationFile._loadAttributes(self._attrib, (('ScriptDone', 'scriptDone', _parseBool),),
+                                                  self.settings, self.warnings)
+
+            self._text = None
+
+        elif depth == 3 and tag == 'Sequence':
+            self.settings.sequences.append((self._attrib.get('name', ''), self._frames))
+            self._frames = None
+
+        elif depth == 4 and tag == 'Frame' and self._frames is not None:
+            attrib = self._frames.pop()
+            duration = _parseUnsigned(16)(attrib.get('duration', ''))
+
+            if duration is None:
+                self.warnings.append('Error in value of duration. Skipping.')
+            else:
+                targets = [int(target) for target in ''.join(self._frameText).split()]
+                self._frames.append((attrib.get('name', ''), duration, targets))
+
+            self._frameText = None
+
+    def comment(self, text):
+        if text.startswith('Period = '):
+            self.periodComment = text
+        elif text.startswith('Channel '):
+            self.channelComments = True
+
+    def close(self):
+        return self.settings
+
+
+class ConfigurationFile:
+    # Device settings: XML name -> (UscSettings attribute, parse, format). The Control Center writes the
+    # serial settings as elements of <UscSettings> and the period settings as attributes of <Channels>;
+    # either is accepted for any of them.
+    settingFields = {
+        'NeverSuspend': ('neverSuspend', _parseBool, _formatBool),
+        'SerialMode': ('serialMode', _parseSerialMode, _formatEnum(uscSerialMode, 'SERIAL_MODE_')),
+        'FixedBaudRate': ('fixedBaudRate', _parseUnsigned(32), str),
+        'SerialTimeout': ('serialTimeout', _parseUnsigned(16), str),
+        'EnableCrc': ('enableCrc', _parseBool, _formatBool),
+        'SerialDeviceNumber': ('serialDeviceNumber', _parseUnsigned(8), str),
+        'SerialMiniSscOffset': ('miniSscOffset', _parseUnsigned(8), str),
+        'EnablePullups': ('enablePullups', _parseBool, _formatBool),
+        'ServosAvailable': ('servosAvailable', _parseUnsigned(8), str),
+        'ServoPeriod': ('servoPeriod', _parseUnsigned(8), str),
+        'MiniMaestroServoPeriod': ('miniMaestroServoPeriod', _parseUnsigned(32), str),
+        'ServoMultiplier': ('servoMultiplier', _parseUnsigned(16), str),
+    }
+
+    # Settings whose absence is reported.
+    requiredSettings = ('NeverSuspend', 'SerialMode', 'FixedBaudRate', 'SerialTimeout', 'EnableCrc',
+                        'SerialDeviceNumber', 'SerialMiniSscOffset')
+
+    # Channel attributes in the order they are written: (XML attribute, ChannelSetting field, parse, format).
+    # Numbers are bounded by the schema of the matching servo parameter.
+    channelFields = (
+        ('name', 'name', str, str),
+        ('mode', 'mode', _parseEnum(ChannelMode), _formatEnum(ChannelMode)),
+        ('min', 'minimum', _parseSetting(uscParameter.PARAMETER_SERVO0_MIN), str),
+        ('max', 'maximum', _parseSetting(uscParameter.PARAMETER_SERVO0_MAX), str),
+        ('homemode', 'homeMode', _parseEnum(HomeMode), _formatEnum(HomeMode)),
+        ('home', 'home', _parseSetting(uscParameter.PARAMETER_SERVO0_HOME), str),
+        ('speed', 'speed', _parseSetting(uscParameter.PARAMETER_SERVO0_SPEED), str),
+        ('acceleration', 'acceleration', _parseSetting(uscParameter.PARAMETER_SERVO0_ACCELERATION), str),
+        ('neutral', 'neutral', _parseSetting(uscParameter.PARAMETER_SERVO0_NEUTRAL), str),
+        ('range', 'range', _parseSetting(uscParameter.PARAMETER_SERVO0_RANGE), str),
+    )
+
+    @staticmethod
+    def load(file, warnings=None):
+        """
+        Reads settings saved by the Maestro Control Center.
+        :param file: Filename or file object of the XML settings file.
+        :param warnings: Optional list that problems found while loading are appended to.
+        :return: The loaded UscSettings.
+        """
+
+        if hasattr(file, 'read'):
+            data = file.read()
+        else:
+            with open(file, 'rb') as f:
+                data = f.read()
+
+        return ConfigurationFile.loads(data, warnings)
+
+    @staticmethod
+    def loads(data, warnings=None):
+        """
+        Like load, from the contents of a settings file.
+        """
+
+        if warnings is None:
+            warnings = []
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
 
-            script = Script.text
+        loader = _Loader(warnings)
+        parser = ET.XMLParser(target=loader)
+        parser.feed(data)
+        parser.close()
+        settings = loader.settings
 
+        for name in ConfigurationFile.requiredSettings:
+            if name not in loader.found:
+                warnings.append('The {} setting was missing.'.format(name))
+
+        if loader.script is not None:
             try:
-                settings.setAndCompileScript(script)
+                settings.setAndCompileScript(loader.script)
             except Exception as e:
                 warnings.append('Error compiling script from XML file: {}'.format(e))
                 settings.scriptInconsistent = True
+                settings.script = loader.script
 
-        if NeverSuspend is not None:
-            value = parseBool(NeverSuspend.text)
+        # The recorded layout only has to reproduce files written the way the Control Center writes them.
+        indent = _indentPattern.search(data)
+        end = data.rfind(b'</UscSettings>')
+        periodComment = None
 
-            if value is not None:
-                settings.fixedBaudRate = value
-            else:
-                warnings.append('Error in value of NeverSuspend. Skipping.')
+        if loader.periodComment is not None:
+            periodComment = (loader.periodComment, ConfigurationFile._periodSettings(settings))
 
-        if SerialMode is not None:
-            value = SerialMode.text
+        settings.fileLayout = FileLayout(
+            loader.elements, loader.channelAttributes,
+            prolog=data[:data.find(b'<UscSettings')].decode('utf-8'),
+            trailer=data[end + len(b'</UscSettings>'):].decode('utf-8') if end >= 0 else '',
+            newline='\r\n' if b'\r\n' in data else '\n',
+            indent=indent.group(1).decode('utf-8') if indent is not None else '  ',
+            periodComment=periodComment,
+            channelComments=loader.channelComments)
 
-            if value == 'UART_FIXED_BAUD_RATE':
-                settings.serialMode = uscSerialMode.SERIAL_MODE_UART_FIXED_BAUD_RATE
-            elif value == 'USB_DUAL_PORT':
-                settings.serialMode = uscSerialMode.SERIAL_MODE_USB_DUAL_PORT
-            elif value == 'USB_CHAINED':
-                settings.serialMode = uscSerialMode.SERIAL_MODE_USB_CHAINED
-            else:
-                settings.serialMode = uscSerialMode.SERIAL_MODE_UART_DETECT_BAUD_RATE
+        return settings
 
-        if FixedBaudRate is not None:
-            value = parseInt(FixedBaudRate.text, 'u32')
+    @staticmethod
+    def _loadAttributes(attrib, table, target, warnings):
+        for row in table:
+            name, field, parse = row[:3]
 
-            if value is not None:
-                settings.fixedBaudRate = value
-            else:
-                warnings.append('Error in value of FixedBaudRate. Skipping.')
+            if name not in attrib:
+                warnings.append('The {} attribute was missing'.format(name))
+                continue
 
-        if SerialTimeout is not None:
-            value = parseInt(SerialTimeout.text, 'u16')
+            value = parse(attrib[name])
 
-            if value is not None:
-                settings.serialTimeout = value
+            if value is None:
+                warnings.append('Invalid {} {}.'.format(name, attrib[name]) if name in ('mode', 'homemode')
+                                else 'Error in value of {}. Skipping.'.format(name))
             else:
-                warnings.append('Error in value of SerialTimeout. Skipping.')
+                setattr(target, field, value)
 
-        if EnableCrc is not None:
-            value = parseBool(EnableCrc.text)
+    @staticmethod
+    def _periodSettings(settings):
+        return settings.servosAvailable, settings.servoPeriod, settings.miniMaestroServoPeriod
 
-            if value is not None:
-                settings.enableCrc = value
-            else:
-                warnings.append('Error in value of EnableCrc. Skipping.')
+    @staticmethod
+    def _periodText(settings):
+        if len(settings) == 6:
+            # 256 cycles of the 12 MHz clock per servo slot.
+            us = Decimal(settings.servoPeriod * 256 * settings.servosAvailable) / 12
+        else:
+            us = Decimal(settings.miniMaestroServoPeriod) / 4
 
-        if SerialDeviceNumber is not None:
-            value = parseInt(SerialDeviceNumber.text, 'u8')
+        return 'Period = {} ms'.format(us / 1000)
 
-            if value is not None:
-                settings.serialDeviceNumber = value
-            else:
-                warnings.append('Error in value of SerialDeviceNumber. Skipping.')
+    @staticmethod
+    def iterSave(settings, layout=None):
+        """
+        Yields the settings file piece by piece.
+        :param layout: A FileLayout; defaults to settings.fileLayout, or the Control Center layout.
+        """
 
-        if SerialMiniSscOffset is not None:
-            value = parseInt(SerialMiniSscOffset.text, 'u8')
+        layout = layout or settings.fileLayout or FileLayout.default(settings)
+        fields = ConfigurationFile.settingFields
+        newline = layout.newline
+        indent = layout.indent
+        inner = newline + indent * 2
 
-            if value is not None:
-                settings.miniSscOffset = value
-            else:
-                warnings.append('Error in value of SerialMiniSscOffset. Skipping.')
+        def formatField(name):
+            attribute, _, format = fields[name]
+            return format(getattr(settings, attribute))
 
-        if ServosAvailable is not None:
-            value = parseInt(ServosAvailable.text, 'u8')
+        yield layout.prolog
+        yield '<UscSettings version="1">'
 
-            if value is not None:
-                settings.servosAvailable = value
-            else:
-                warnings.append('Error in value of ServosAvailable. Skipping.')
+        for tag in layout.elements:
+            yield newline + indent
 
-        if ServoPeriod is not None:
-            value = parseInt(ServoPeriod.text, 'u8')
+            if tag in fields:
+                yield '<{0}>{1}</{0}>'.format(tag, _escape(formatField(tag)))
 
-            if value is not None:
-                settings.servoPeriod = value
-            else:
-                warnings.append('Error in value of ServoPeriod. Skipping.')
+            elif tag == 'Channels':
+                yield '<Channels'
 
-        if EnablePullups is not None:
-            value = parseBool(EnablePullups.text)
+                for name in layout.channelAttributes:
+                    yield ' {}="{}"'.format(name, _quote(formatField(name)))
 
-            if value is not None:
-                settings.enablePullups = value
-            else:
-                warnings.append('Error in value of EnablePullups. Skipping.')
+                comment = layout.periodComment
 
-        if MiniMaestroServoPeriod is not None:
-            value = parseInt(MiniMaestroServoPeriod.text, 'u32')
+                if comment is True or (comment is not None
+                                       and comment[1] != ConfigurationFile._periodSettings(settings)):
+                    comment = ConfigurationFile._periodText(settings)
+                elif comment is not None:
+                    comment = comment[0]
 
-            if value is not None:
-                settings.miniMaestroServoPeriod = value
-            else:
-                warnings.append('Error in value of MiniMaestroServoPeriod. Skipping.')
+                if comment is None and not settings.channelSettings:
+                    yield ' />'
+                    continue
 
-        if ServoMultiplier is not None:
-            value = parseInt(ServoMultiplier.text, 'u16')
+                yield '>'
 
-            if value is not None:
-                settings.servoMultiplier = value
-            else:
-                warnings.append('Error in value of ServoMultiplier. Skipping.')
+                if comment is not None:
+                    yield '{}<!--{}-->'.format(inner, comment)
+
+                # Like loading, each distinct channel configuration is formatted once.
+                channels = {}
+
+                for i, cs in enumerate(settings.channelSettings):
+                    if layout.channelComments:
+                        yield '{}<!--Channel {}-->'.format(inner, i)
+
+                    key = tuple(getattr(cs, field) for _, field, _, _ in ConfigurationFile.channelFields)
+                    line = channels.get(key)
+
+                    if line is None:
+                        line = channels[key] = '{}<Channel{} />'.format(inner, ''.join(
+                            ' {}="{}"'.format(name, _quote(format(value)))
+                            for (name, _, _, format), value in zip(ConfigurationFile.channelFields, key)))
+
+                    yield line
+
+                yield newline + indent + '</Channels>'
+
+            elif tag == 'Sequences':
+                if not settings.sequences:
+                    yield '<Sequences />'
+                    continue
+
+                yield '<Sequences>'
+
+                for name, frames in settings.sequences:
+                    if not frames:
+                        yield '{}<Sequence name="{}" />'.format(inner, _quote(name))
+                        continue
+
+                    yield '{}<Sequence name="{}">'.format(inner, _quote(name))
+
+                    for frameName, duration, targets in frames:
+                        yield '{}{}<Frame name="{}" duration="{}"'.format(inner, indent, _quote(frameName), duration)
+                        yield '>{}</Frame>'.format(' '.join(map(str, targets))) if targets else ' />'
+
+                    yield inner + '</Sequence>'
+
+                yield newline + indent + '</Sequences>'
+
+            elif tag == 'Script':
+                yield '<Script ScriptDone="{}"'.format(_formatBool(settings.scriptDone))
+
+                if settings.script:
+                    # The parser turned the file's line endings into '\n'.
+                    yield '>{}</Script>'.format(_escape(settings.script).replace('\n', newline))
+                else:
+                    yield ' />'
+
+        yield newline + '</UscSettings>'
+        yield layout.trailer
+
+    @staticmethod
+    def dumps(settings, layout=None):
+        """
+        :return: The settings file as bytes.
+        """
 
-        return warnings
+        return ''.join(ConfigurationFile.iterSave(settings, layout)).encode('utf-8')
 
     @staticmethod
-    def save(settings, file):
-        raise NotImplementedError
+    def save(settings, file, layout=None):
+        """
+        Writes settings in the Maestro Control Center format. Settings returned by load are written with the
+        layout they were read with, so an unchanged file is reproduced exactly.
+        :param file: Filename or file object; text file objects are given str, others bytes.
+        :param layout: Optional FileLayout overriding settings.fileLayout.
+        """
+
+        if not hasattr(file, 'write'):
+            with open(file, 'wb') as f:
+                ConfigurationFile.save(settings, f, layout)
+            return
+
+        text = isinstance(file, io.TextIOBase)
+
+        for piece in ConfigurationFile.iterSave(settings, layout):
+            file.write(piece if text else piece.encode('utf-8'))
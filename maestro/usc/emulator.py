@@ -0,0 +1,490 @@
+import array
+import struct
+import time
+
+from maestro.bytecode.protocol import Opcode
+from maestro.usc.protocol import uscRequest, uscParameter, uscError, MicroMaestroVariables, MiniMaestroVariables, \
+    ServoStatus
+
+
+class VirtualMaestro:
+    """
+    An in-process stand-in for a Maestro that speaks the same control transfers as the real device.
+    It stores parameters, accepts script writes, runs the bytecode and moves servos towards their
+    targets, so a Usc object can be driven without hardware.
+    """
+
+    productIDs = {6: 0x0089, 12: 0x008a, 18: 0x008b, 24: 0x008c}
+
+    # Instructions executed per millisecond of wall time.
+    instructionsPerMillisecond = 50
+
+    # Upper bound on instructions executed while servicing a single transfer.
+    maxInstructionsPerTransfer = 20000
+
+    def __init__(self, servoCount=24, serialNumber='00000000', firmwareVersion=(1, 4), clock=None):
+        """
+        :param servoCount: Number of channels (6, 12, 18 or 24).
+        :param serialNumber: Serial number reported to the host.
+        :param firmwareVersion: (major, minor) reported in the device descriptor.
+        :param clock: Function returning the current time in seconds. Defaults to time.monotonic.
+        """
+
+        if servoCount not in self.productIDs:
+            raise Exception('Unsupported servo count {}.'.format(servoCount))
+
+        self.servoCount = servoCount
+        self.idVendor = 0x1ffb
+        self.idProduct = self.productIDs[servoCount]
+        self.serial_number = serialNumber
+        self.firmwareVersion = firmwareVersion
+        self.microMaestro = servoCount == 6
+        self.clock = clock if clock is not None else time.monotonic
+
+        self.maxScriptLength = 1024 if self.microMaestro else 8192
+        self.subroutineOffsetBlocks = 64 if self.microMaestro else 512
+        self.stackSize = 32 if self.microMaestro else 126
+        self.callStackSize = 10 if self.microMaestro else 126
+
+        self.script = bytearray((0xFF,) * self.maxScriptLength)
+        self.subroutineTable = bytearray((0xFF,) * 256)
+        self.parameters = bytearray(256)
+        self.transfers = 0
+        self.closed = False
+
+        self._restoreDefaultParameters()
+        self._reinitialize()
+
+    def close(self):
+        self.closed = True
+
+    def _restoreDefaultParameters(self):
+        p = self.parameters
+        p[:] = bytearray(256)
+        p[uscParameter.PARAMETER_INITIALIZED] = 0
+        p[uscParameter.PARAMETER_SERVOS_AVAILABLE] = 6
+        p[uscParameter.PARAMETER_SERVO_PERIOD] = 156
+        p[uscParameter.PARAMETER_SERIAL_MODE] = 2
+        self._writeParameter(uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE, 1249, 2)
+        p[uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER] = 12
+        p[uscParameter.PARAMETER_SCRIPT_DONE] = 1
+
+        if not self.microMaestro:
+            self._writeParameter(uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_L, 80000 & 0xFF, 1)
+            self._writeParameter(uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_HU, 80000 >> 8, 2)
+            p[uscParameter.PARAMETER_ENABLE_PULLUPS] = 1
+
+        for i in range(self.servoCount):
+            base = uscParameter.PARAMETER_SERVO0_HOME + 9 * i
+            self._writeParameter(base, 0, 2)
+            p[base + 2] = 3968 // 64
+            p[base + 3] = 8000 // 64
+            self._writeParameter(base + 4, 6000, 2)
+            p[base + 6] = 1905 // 127
+            p[base + 7] = 0
+            p[base + 8] = 0
+
+    def _readParameter(self, parameter, numBytes):
+        if numBytes == 1:
+            return self.parameters[parameter]
+        return self.parameters[parameter] | (self.parameters[parameter + 1] << 8)
+
+    def _writeParameter(self, parameter, value, numBytes):
+        for i in range(numBytes):
+            self.parameters[parameter + i] = (value >> (8 * i)) & 0xFF
+
+    def _reinitialize(self):
+        if self.parameters[uscParameter.PARAMETER_INITIALIZED] == 0xFF:
+            self._restoreDefaultParameters()
+
+        self.positions = [0] * self.servoCount
+        self.targets = [0] * self.servoCount
+        self.speeds = [0] * self.servoCount
+        self.accelerations = [0] * self.servoCount
+        self.velocities = [0.0] * self.servoCount
+
+        for i in range(self.servoCount):
+            base = uscParameter.PARAMETER_SERVO0_HOME + 9 * i
+            home = self._readParameter(base, 2)
+            if home > 1:
+                self.positions[i] = self.targets[i] = home
+            exponentialSpeed = self.parameters[base + 7]
+            self.speeds[i] = (exponentialSpeed >> 3) << (exponentialSpeed & 7)
+            self.accelerations[i] = self.parameters[base + 8]
+
+        self.errors = 0
+        self.startMs = self.clock() * 1000
+        self.lastMs = 0
+        self.servoMs = 0
+        self.instructionCredit = 0.0
+        self._restartScript(0)
+        self.scriptDone = self.parameters[uscParameter.PARAMETER_SCRIPT_DONE]
+
+    def _restartScript(self, programCounter):
+        self.programCounter = programCounter
+        self.stack = []
+        self.callStack = []
+        self.delayUntil = None
+
+    def _ms(self):
+        return self.clock() * 1000 - self.startMs
+
+    def advance(self):
+        """
+        Brings servo positions and script execution up to the current time.
+        """
+
+        now = self._ms()
+        elapsed = now - self.lastMs
+        self.lastMs = now
+
+        while self.servoMs + 10 <= now:
+            self.servoMs += 10
+            self._servoTick()
+
+        if self.scriptDone:
+            self.instructionCredit = 0.0
+            return
+
+        self.instructionCredit = min(self.instructionCredit + elapsed * self.instructionsPerMillisecond,
+                                     self.maxInstructionsPerTransfer)
+
+        while self.instructionCredit >= 1 and not self.scriptDone:
+            if self.delayUntil is not None:
+                if now < self.delayUntil:
+                    self.instructionCredit = 0.0
+                    break
+                self.delayUntil = None
+                self.programCounter += 1
+            self.instructionCredit -= 1
+            self.step()
+
+    def _servoTick(self):
+        for i in range(self.servoCount):
+            position = self.positions[i]
+            target = self.targets[i]
+
+            if position == target or target == 0:
+                self.velocities[i] = 0.0
+                continue
+
+            distance = abs(target - position)
+            speed = self.speeds[i] if self.speeds[i] else distance
+
+            if self.accelerations[i]:
+                acceleration = self.accelerations[i] / 8.0
+                velocity = min(self.velocities[i] + acceleration, speed, (2 * acceleration * distance) ** 0.5)
+                velocity = max(velocity, min(acceleration, distance))
+            else:
+                velocity = speed
+
+            self.velocities[i] = velocity
+            step = min(distance, int(round(velocity)) or 1)
+            self.positions[i] = position + step if target > position else position - step
+
+    def step(self):
+        """
+        Executes a single script instruction.
+        """
+
+        script = self.script
+        pc = self.programCounter
+
+        if pc >= self.maxScriptLength:
+            return self._fault(uscError.ERROR_SCRIPT_PROGRAM_COUNTER)
+
+        op = script[pc]
+        pc += 1
+
+        try:
+            if op >= 128:
+                entry = 2 * (op - 128)
+                address = self.subroutineTable[entry] | (self.subroutineTable[entry + 1] << 8)
+                if address == 0xFFFF:
+                    return self._fault(uscError.ERROR_SCRIPT_PROGRAM_COUNTER)
+                self._call(pc, address)
+                return
+            elif op == Opcode.QUIT:
+                self.scriptDone = 1
+                return
+            elif op == Opcode.LITERAL:
+                self._push(script[pc] | (script[pc + 1] << 8))
+                pc += 2
+            elif op == Opcode.LITERAL8:
+                self._push(script[pc])
+                pc += 1
+            elif op == Opcode.LITERAL_N:
+                count = script[pc]
+                for i in range(pc + 1, pc + 1 + count, 2):
+                    self._push(script[i] | (script[i + 1] << 8))
+                pc += 1 + count
+            elif op == Opcode.LITERAL8_N:
+                count = script[pc]
+                for i in range(pc + 1, pc + 1 + count):
+                    self._push(script[i])
+                pc += 1 + count
+            elif op == Opcode.RETURN:
+                if not self.callStack:
+                    return self._fault(uscError.ERROR_SCRIPT_CALL_STACK)
+                pc = self.callStack.pop()
+            elif op == Opcode.JUMP:
+                pc = script[pc] | (script[pc + 1] << 8)
+            elif op == Opcode.JUMP_Z:
+                address = script[pc] | (script[pc + 1] << 8)
+                pc = address if self._pop() == 0 else pc + 2
+            elif op == Opcode.CALL:
+                self._call(pc + 2, script[pc] | (script[pc + 1] << 8))
+                return
+            elif op == Opcode.DELAY:
+                self.delayUntil = self._ms() + (self._pop() & 0xFFFF)
+                return
+            elif op == Opcode.GET_MS:
+                self._push(int(self._ms()))
+            elif op == Opcode.DEPTH:
+                self._push(len(self.stack))
+            elif op == Opcode.DROP:
+                self._pop()
+            elif op == Opcode.DUP:
+                self._push(self._peek(0))
+            elif op == Opcode.OVER:
+                self._push(self._peek(1))
+            elif op == Opcode.PICK:
+                self._push(self._peek(self._pop()))
+            elif op == Opcode.SWAP:
+                b, a = self._pop(), self._pop()
+                self._push(b)
+                self._push(a)
+            elif op == Opcode.ROT:
+                c, b, a = self._pop(), self._pop(), self._pop()
+                self._push(b)
+                self._push(c)
+                self._push(a)
+            elif op == Opcode.ROLL:
+                n = self._pop()
+                value = self._peek(n)
+                del self.stack[-1 - n]
+                self._push(value)
+            elif op in _UNARY:
+                self._push(_UNARY[op](self._pop()))
+            elif op in _BINARY:
+                b, a = self._pop(), self._pop()
+                self._push(_BINARY[op](a, b))
+            elif op == Opcode.SERVO or op == Opcode.SERVO_8BIT:
+                channel, value = self._pop(), self._pop()
+                self._setTarget(channel, value & 0xFFFF if op == Opcode.SERVO else 4 * (value & 0xFF) + 3000)
+            elif op == Opcode.SPEED:
+                channel, value = self._pop(), self._pop()
+                self.speeds[channel % self.servoCount] = value & 0xFFFF
+            elif op == Opcode.ACCELERATION:
+                channel, value = self._pop(), self._pop()
+                self.accelerations[channel % self.servoCount] = value & 0xFF
+            elif op == Opcode.GET_POSITION:
+                self._push(self.positions[self._pop() % self.servoCount])
+            elif op == Opcode.GET_MOVING_STATE:
+                self._push(int(any(p != t for p, t in zip(self.positions, self.targets))))
+            elif op == Opcode.LED_ON or op == Opcode.LED_OFF:
+                pass
+            elif op == Opcode.PWM:
+                self._pop()
+                self._pop()
+            elif op == Opcode.PEEK:
+                self._pop()
+                self._push(0)
+            elif op == Opcode.POKE:
+                self._pop()
+                self._pop()
+            elif op == Opcode.SERIAL_SEND_BYTE:
+                self._pop()
+            else:
+                return self._fault(uscError.ERROR_SCRIPT_PROGRAM_COUNTER)
+        except IndexError:
+            return self._fault(uscError.ERROR_SCRIPT_STACK)
+
+        self.programCounter = pc
+
+    def _call(self, returnAddress, address):
+        if len(self.callStack) >= self.callStackSize:
+            return self._fault(uscError.ERROR_SCRIPT_CALL_STACK)
+        self.callStack.append(returnAddress)
+        self.programCounter = address
+
+    def _fault(self, error):
+        self.errors |= 1 << error
+        self.scriptDone = 1
+
+    def _push(self, value):
+        if len(self.stack) >= self.stackSize:
+            raise IndexError
+        value &= 0xFFFF
+        self.stack.append(value - 0x10000 if value & 0x8000 else value)
+
+    def _pop(self):
+        return self.stack.pop()
+
+    def _peek(self, depth):
+        return self.stack[-1 - depth]
+
+    def _setTarget(self, channel, value):
+        if 0 <= channel < self.servoCount:
+            self.targets[channel] = value
+            if self.speeds[channel] == 0 and self.accelerations[channel] == 0:
+                self.positions[channel] = value
+
+    def _packVariables(self):
+        stackPointer = len(self.stack)
+        callStackPointer = len(self.callStack)
+
+        if self.microMaestro:
+            stack = list(self.stack) + [0] * (self.stackSize - stackPointer)
+            callStack = list(self.callStack) + [0] * (self.callStackSize - callStackPointer)
+            return MicroMaestroVariables.struct.pack(stackPointer, callStackPointer, self.errors, self.programCounter,
+                                                     0, 0, 0, *(stack + callStack + [self.scriptDone, 0]))
+
+        return MiniMaestroVariables.struct.pack(stackPointer, callStackPointer, self.errors, self.programCounter,
+                                                self.scriptDone, 0)
+
+    def _packServos(self):
+        packed = bytearray()
+        for i in range(self.servoCount):
+            packed.extend(ServoStatus.struct.pack(self.positions[i], self.targets[i], self.speeds[i],
+                                                  self.accelerations[i]))
+        return packed
+
+    def _descriptor(self):
+        major, minor = self.firmwareVersion
+        bcd = lambda v: ((v // 10) << 4) | (v % 10)
+        return bytearray((18, 1, 0x00, 0x02, 0xEF, 0x02, 0x01, 0x40, 0xFB, 0x1F, self.idProduct & 0xFF,
+                          self.idProduct >> 8, bcd(minor), bcd(major), 1, 2, 5, 1))
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        if self.closed:
+            raise Exception('The device has been closed.')
+
+        self.transfers += 1
+        self.advance()
+
+        if bmRequestType & 0x80:
+            if isinstance(data_or_wLength, int) or data_or_wLength is None:
+                length = data_or_wLength or 0
+                return array.array('B', bytes(self._read(bRequest, wValue, wIndex)[:length]))
+
+            # Like pyusb, read into a caller-supplied array and return the number of bytes read.
+            data = bytes(self._read(bRequest, wValue, wIndex)[:len(data_or_wLength)])
+            data_or_wLength[:len(data)] = array.array('B', data)
+            return len(data)
+
+        data = bytearray(data_or_wLength) if data_or_wLength is not None else bytearray()
+        self._write(bRequest, wValue, wIndex, data)
+        return len(data)
+
+    def _read(self, request, value, index):
+        if request == 6:
+            return self._descriptor()
+        elif request == uscRequest.REQUEST_GET_PARAMETER:
+            return self.parameters[index:index + 2]
+        elif request == uscRequest.REQUEST_GET_VARIABLES:
+            if self.microMaestro:
+                return self._packVariables() + self._packServos()
+            return self._packVariables()
+        elif request == uscRequest.REQUEST_GET_SERVO_SETTINGS:
+            return self._packServos()
+        elif request == uscRequest.REQUEST_GET_STACK:
+            return struct.pack('<%dh' % len(self.stack), *self.stack) + bytes(2 * (self.stackSize - len(self.stack)))
+        elif request == uscRequest.REQUEST_GET_CALL_STACK:
+            return struct.pack('<%dH' % len(self.callStack), *self.callStack) + \
+                   bytes(2 * (self.callStackSize - len(self.callStack)))
+        raise Exception('Unsupported request 0x{:02x}.'.format(int(request)))
+
+    def _write(self, request, value, index, data):
+        if request == uscRequest.REQUEST_SET_PARAMETER:
+            self._writeParameter(index & 0xFF, value, index >> 8)
+        elif request == uscRequest.REQUEST_SET_TARGET:
+            self._setTarget(index, value)
+        elif request == uscRequest.REQUEST_SET_SERVO_VARIABLE:
+            if index & 0x80:
+                self.accelerations[index & 0x7F] = value & 0xFF
+            else:
+                self.speeds[index] = value
+        elif request == uscRequest.REQUEST_CLEAR_ERRORS:
+            self.errors = 0
+        elif request == uscRequest.REQUEST_REINITIALIZE:
+            self._reinitialize()
+        elif request == uscRequest.REQUEST_ERASE_SCRIPT:
+            self.script[:] = bytearray((0xFF,) * self.maxScriptLength)
+            self.subroutineTable[:] = bytearray((0xFF,) * 256)
+        elif request == uscRequest.REQUEST_WRITE_SCRIPT:
+            if index >= self.subroutineOffsetBlocks:
+                offset = (index - self.subroutineOffsetBlocks) * 16
+                self.subroutineTable[offset:offset + len(data)] = data
+            else:
+                self.script[index * 16:index * 16 + len(data)] = data
+        elif request == uscRequest.REQUEST_SET_SCRIPT_DONE:
+            self.scriptDone = value & 1
+            if value == 2:
+                self.scriptDone = 0
+                self.step()
+                self.scriptDone = 1
+        elif request == uscRequest.REQUEST_RESTART_SCRIPT_AT_SUBROUTINE:
+            entry = 2 * (index - 128)
+            self._restartScript(self.subroutineTable[entry] | (self.subroutineTable[entry + 1] << 8))
+            self.scriptDone = 1
+        elif request == uscRequest.REQUEST_RESTART_SCRIPT_AT_SUBROUTINE_WITH_PARAMETER:
+            entry = 2 * (index - 128)
+            self._restartScript(self.subroutineTable[entry] | (self.subroutineTable[entry + 1] << 8))
+            self._push(value)
+            self.scriptDone = 1
+        elif request == uscRequest.REQUEST_RESTART_SCRIPT:
+            self._restartScript(0)
+        elif request in (uscRequest.REQUEST_SET_PWM, uscRequest.REQUEST_START_BOOTLOADER):
+            pass
+        else:
+            raise Exception('Unsupported request 0x{:02x}.'.format(int(request)))
+
+
+def _signed(value):
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def _divide(a, b):
+    if b == 0:
+        return 0
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def _mod(a, b):
+    if b == 0:
+        return 0
+    return a - b * _divide(a, b)
+
+
+_UNARY = {
+    Opcode.BITWISE_NOT: lambda a: ~a,
+    Opcode.LOGICAL_NOT: lambda a: int(a == 0),
+    Opcode.NEGATE: lambda a: -a,
+    Opcode.POSITIVE: lambda a: int(a > 0),
+    Opcode.NEGATIVE: lambda a: int(a < 0),
+    Opcode.NONZERO: lambda a: int(a != 0),
+}
+
+_BINARY = {
+    Opcode.BITWISE_AND: lambda a, b: a & b,
+    Opcode.BITWISE_OR: lambda a, b: a | b,
+    Opcode.BITWISE_XOR: lambda a, b: a ^ b,
+    Opcode.SHIFT_RIGHT: lambda a, b: a >> (b & 15),
+    Opcode.SHIFT_LEFT: lambda a, b: a << (b & 15),
+    Opcode.LOGICAL_AND: lambda a, b: int(a != 0 and b != 0),
+    Opcode.LOGICAL_OR: lambda a, b: int(a != 0 or b != 0),
+    Opcode.PLUS: lambda a, b: a + b,
+    Opcode.MINUS: lambda a, b: a - b,
+    Opcode.TIMES: lambda a, b: _signed(a * b),
+    Opcode.DIVIDE: _divide,
+    Opcode.MOD: _mod,
+    Opcode.EQUALS: lambda a, b: int(a == b),
+    Opcode.NOT_EQUALS: lambda a, b: int(a != b),
+    Opcode.MIN: min,
+    Opcode.MAX: max,
+    Opcode.LESS_THAN: lambda a, b: int(a < b),
+    Opcode.GREATER_THAN: lambda a, b: int(a > b),
+}
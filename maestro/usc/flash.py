@@ -0,0 +1,95 @@
+import time
+
+# Script memory is written in blocks of this many bytes.
+BLOCK_SIZE = 16
+
+ERASED_BLOCK = b'\xff' * BLOCK_SIZE
+
+
+class FlashReport:
+    """
+    What a script upload sent: bytes and transfers actually sent, blocks skipped because they were
+    already erased, and the time it took.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.transfers = 0
+        self.skippedBlocks = 0
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        """
+        Bytes sent per second.
+        """
+
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def add(self, other):
+        self.bytes += other.bytes
+        self.transfers += other.transfers
+        self.skippedBlocks += other.skippedBlocks
+        self.elapsed += other.elapsed
+
+    def __repr__(self):
+        return '<FlashReport {} bytes in {} transfers, {} blocks skipped, {:.3f}s, {:.0f} B/s>'.format(
+            self.bytes, self.transfers, self.skippedBlocks, self.elapsed, self.throughput)
+
+
+def iterBlocks(data, skipErased=False):
+    """
+    Yields (block number, 16-byte memoryview) for data, padding the last block with 0xFF. Blocks that are
+    entirely 0xFF are left out when skipErased is set, since an erased device already holds them.
+    """
+
+    # Any sequence of ints is accepted, as Usc.writeScript always did.
+    data = bytes(data)
+    remainder = len(data) % BLOCK_SIZE
+
+    if remainder:
+        data += b'\xff' * (BLOCK_SIZE - remainder)
+
+    view = memoryview(data)
+
+    for block in range(len(data) // BLOCK_SIZE):
+        chunk = view[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE]
+
+        if skipErased and chunk == ERASED_BLOCK:
+            continue
+
+        yield block, chunk
+
+
+def countBytes(data, skipErased=False):
+    """
+    Returns the number of bytes writeBlocks will send for data.
+    """
+
+    return sum(1 for _ in iterBlocks(data, skipErased)) * BLOCK_SIZE
+
+
+def writeBlocks(write, data, offset=0, skipErased=False, progress=None):
+    """
+    Sends data block by block through write(blockNumber, chunk).
+    :param offset: Added to every block number.
+    :param progress: Optional function called with (bytes sent, bytes to send) after every block.
+    :return: A FlashReport.
+    """
+
+    report = FlashReport()
+    start = time.perf_counter()
+    blocks = list(iterBlocks(data, skipErased))
+    total = len(blocks) * BLOCK_SIZE
+    report.skippedBlocks = (len(data) + BLOCK_SIZE - 1) // BLOCK_SIZE - len(blocks)
+
+    for block, chunk in blocks:
+        write(block + offset, chunk)
+        report.bytes += BLOCK_SIZE
+        report.transfers += 1
+
+        if progress is not None:
+            progress(report.bytes, total)
+
+    report.elapsed = time.perf_counter() - start
+    return report
@@ -1,43 +1,17 @@
+import struct
 import time
 
-import usb
-
+from maestro.bytecode.protocol import Opcode
+from maestro.usc.flash import countBytes, writeBlocks
+from maestro.usc.predictor import MotionPredictor
 from maestro.usc.protocol import *
-from maestro.usc.settings import UscSettings, ChannelSetting
-
-
-class Range:
-    def __init__(self, numBytes, minimumValue, maximumValue):
-        self.bytes = numBytes
-        self.minimumValue = minimumValue
-        self.maximumValue = maximumValue
-
-    def signed(self):
-        return self.minimumValue < 0
-
-    @staticmethod
-    def u16():
-        return Range(2, 0, 0xFFFF)
-
-    @staticmethod
-    def u12():
-        return Range(2, 0, 0x0FFF)
-
-    @staticmethod
-    def u10():
-        return Range(2, 0, 0x03FF)
-
-    @staticmethod
-    def u8():
-        return Range(1, 0, 0xFF)
-
-    @staticmethod
-    def u7():
-        return Range(1, 0, 0x7F)
-
-    @staticmethod
-    def boolean():
-        return Range(1, 0, 1)
+from maestro.usc.schema import Range, ParameterSpec, getParameterSpec, INSTRUCTION_FREQUENCY, \
+    SERVO_PARAMETER_STRIDE, exponentialSpeedToNormalSpeed, normalSpeedToExponentialSpeed, spbrgToBps, bpsToSpbrg
+from maestro.usc.scheduler import RequestScheduler, lane
+from maestro.usc.settings import UscSettings, ChannelSetting, MODE_DEFAULTS
+from maestro.usc.shadow import ShadowRegisters
+from maestro.usc.snapshot import DeviceSnapshot
+from maestro.usc.writebehind import WriteBehindQueue
 
 
 class Usc:
@@ -48,10 +22,13 @@ class Usc:
     productIDArray = [0x0089, 0x008a, 0x008b, 0x008c]
 
     # Instructions are executed at 12 MHZ.
-    INSTRUCTION_FREQUENCY = 12000000
+    INSTRUCTION_FREQUENCY = INSTRUCTION_FREQUENCY
 
     # The number of parameter bytes per servo.
-    servoParameterBytes = 9
+    servoParameterBytes = SERVO_PARAMETER_STRIDE
+
+    # First wait, in seconds, between readiness polls after a reinitialization.
+    reinitializePollInterval = 0.002
 
     # Stack and call sizes.
     MicroMaestroStackSize = 32
@@ -59,16 +36,26 @@ class Usc:
     MiniMaestroStackSize = 126
     MiniMaestroCallStackSize = 126
 
-    def __init__(self, device):
+    def __init__(self, device, shadow=False):
         """
         Create a Usc object. Raises ConnectionError if device is invalid.
-        :param device: A Maestro device found by pyusb. Must be of class 'usb.core.Device'.
+        :param device: A Maestro device found by pyusb, or any object with the same ctrl_transfer interface
+                       such as a VirtualMaestro.
+        :param shadow: Enable the shadow registers (see enableShadow) seeded from the device.
         """
 
-        if type(device) != usb.core.Device:
+        if not hasattr(device, 'ctrl_transfer'):
             raise ConnectionError('Unable to connect to the Maestro.')
 
         self.dev = device
+        self.scheduler = RequestScheduler()
+        self.writeBehind = None
+        self.shadow = None
+        self.predictor = None
+        self.lastFlashReport = None
+        self.lastReinitializeTime = None
+        self.reinitializeTimedOut = False
+        self.tracer = None
 
         self.productID = self.dev.idProduct
 
@@ -92,9 +79,31 @@ class Usc:
         self._privateFirmwareVersionMajor = 0xFF
         self._privateFirmwareVersionMinor = 0xFF
 
+        if shadow:
+            self.enableShadow()
+
+    def reattach(self, device):
+        """
+        Switches to a new handle for the same device, e.g. after it re-enumerated, keeping this object's
+        state. The firmware version is not read again.
+        """
+
+        if device.idProduct != self.productID:
+            raise Exception('Expected product ID {:02x} but the device has {:02x}.'.format(self.productID,
+                                                                                         device.idProduct))
+
+        self.dev = device
+
     def close(self):
+        self.disableWriteBehind()
         self.dev.close()
 
+    def _transfer(self, *args):
+        if self.tracer is not None:
+            return self.tracer.transfer(self.scheduler, self.dev.ctrl_transfer, args)
+
+        return self.scheduler.run(self.dev.ctrl_transfer, *args)
+
     def getProductID(self):
         return self.productID
 
@@ -113,24 +122,11 @@ class Usc:
 
     @staticmethod
     def _exponentialSpeedToNormalSpeed(exponentialSpeed):
-        mantissa = exponentialSpeed >> 3
-        exponent = exponentialSpeed & 7
-        return mantissa * (1 << exponent)
+        return exponentialSpeedToNormalSpeed(exponentialSpeed)
 
     @staticmethod
     def _normalSpeedToExponentialSpeed(normalSpeed):
-        mantissa = normalSpeed
-        exponent = 0
-
-        while True:
-            if mantissa < 32:
-                return exponent + (mantissa << 3)
-
-            if exponent == 7:
-                return 0xFF
-
-            exponent += 1
-            mantissa >>= 1
+        return normalSpeedToExponentialSpeed(normalSpeed)
 
     @staticmethod
     def positionToMicroseconds(position):
@@ -150,17 +146,11 @@ class Usc:
 
     @staticmethod
     def _convertSpbrgToBps(spbrg):
-        if spbrg == 0:
-            return 0
-        else:
-            return int((Usc.INSTRUCTION_FREQUENCY + (spbrg + 1) / 2) / (spbrg + 1))
+        return spbrgToBps(spbrg)
 
     @staticmethod
     def _convertBpsToSpbrg(bps):
-        if bps == 0:
-            return 0
-        else:
-            return int((Usc.INSTRUCTION_FREQUENCY - bps / 2) / bps)
+        return bpsToSpbrg(bps)
 
     @staticmethod
     def _channelToPort(channel):
@@ -188,6 +178,8 @@ class Usc:
 
     @staticmethod
     def getConnectedDevices():
+        import usb.core
+
         return list(usb.core.find(find_all=True, idVendor=Usc.vendorID))
 
     def firmwareVersionMajor(self):
@@ -205,18 +197,21 @@ class Usc:
     def firmwareVersionString(self):
         return '{:d}.{:02d}'.format(self._privateFirmwareVersionMajor, self._privateFirmwareVersionMinor)
 
+    @lane(RequestScheduler.TELEMETRY)
     def getFirmwareVersion(self):
-        buffer = self.dev.ctrl_transfer(0x80, 6, 0x0100, 0x0000, 0x0012)
+        buffer = self._transfer(0x80, 6, 0x0100, 0x0000, 0x0012)
         self._privateFirmwareVersionMinor = (buffer[12] & 0xF) + (buffer[12] >> 4 & 0xF) * 10
         self._privateFirmwareVersionMajor = (buffer[13] & 0xF) + (buffer[13] >> 4 & 0xF) * 10
 
+    @lane(RequestScheduler.CONFIGURATION)
     def eraseScript(self):
         """
         Erases the entire script and subroutine address table from the devices.
         """
 
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_ERASE_SCRIPT, 0, 0)
+        self._transfer(0x40, uscRequest.REQUEST_ERASE_SCRIPT, 0, 0)
 
+    @lane(RequestScheduler.CONTROL)
     def restartScriptAtSubroutine(self, subroutine):
         """
         Stops and resets the script, sets the program counter to the beginning of the
@@ -224,27 +219,52 @@ class Usc:
         so you must use setScriptDone() to start it.
         """
 
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_RESTART_SCRIPT_AT_SUBROUTINE, 0, 0, subroutine)
+        self._transfer(0x40, uscRequest.REQUEST_RESTART_SCRIPT_AT_SUBROUTINE, 0, subroutine)
+
+        if self.shadow is not None:
+            self.shadow.invalidate()
+
+        if self.predictor is not None:
+            self.predictor.invalidate()
 
+    @lane(RequestScheduler.CONTROL)
     def restartScriptAtSubroutineWithParameter(self, subroutine, parameter):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_ERASE_SCRIPT_WITH_PARAMETER, parameter, subroutine)
+        self._transfer(0x40, uscRequest.REQUEST_RESTART_SCRIPT_AT_SUBROUTINE_WITH_PARAMETER, parameter,
+                       subroutine)
 
+        if self.shadow is not None:
+            self.shadow.invalidate()
+
+        if self.predictor is not None:
+            self.predictor.invalidate()
+
+    @lane(RequestScheduler.CONTROL)
     def restartScript(self):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_RESTART_SCRIPT, 0, 0)
+        self._transfer(0x40, uscRequest.REQUEST_RESTART_SCRIPT, 0, 0)
 
-    def writeScript(self, bytecode):
-        for block in range((len(bytecode) + 15) // 16):
-            block_bytes = bytearray((0x00,) * 16)
+        if self.shadow is not None:
+            self.shadow.scriptStarted()
 
-            for j in range(16):
-                if block * 16 + j < len(bytecode):
-                    block_bytes[j] = bytecode[block * 16 + j]
-                else:
-                    block_bytes[j] = 0xFF
+        if self.predictor is not None:
+            self.predictor.invalidate()
+
+    @lane(RequestScheduler.CONFIGURATION)
+    def writeScript(self, bytecode, skipErased=False, progress=None):
+        """
+        Writes bytecode to script memory in 16-byte blocks.
+        :param skipErased: Do not send blocks that are all 0xFF; only valid right after eraseScript.
+        :param progress: Optional function called with (bytes sent, bytes to send) after every block.
+        :return: A FlashReport.
+        """
 
-            self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_WRITE_SCRIPT, 0, block, block_bytes)
+        return writeBlocks(self._writeScriptBlock, bytecode, 0, skipErased, progress)
+
+    @staticmethod
+    def subroutineTable(subroutineAddresses, subroutineCommands):
+        """
+        Returns the 256-byte subroutine address table for a program.
+        """
 
-    def setSubroutines(self, subroutineAddresses, subroutineCommands):
         subroutineData = bytearray((0xFF,) * 256)
 
         for name, value in subroutineAddresses.items():
@@ -256,35 +276,130 @@ class Usc:
             subroutineData[2 * (bytecode - 128)] = value % 256
             subroutineData[2 * (bytecode - 128) + 1] = value >> 8
 
-        for block in range(16):
-            block_bytes = bytearray((0x00,) * 16)
+        return subroutineData
 
-            for j in range(16):
-                block_bytes[j] = subroutineData[block * 16 + j]
+    @lane(RequestScheduler.CONFIGURATION)
+    def setSubroutines(self, subroutineAddresses, subroutineCommands, skipErased=False, progress=None):
+        """
+        Writes the subroutine address table. Takes the same skipErased and progress as writeScript.
+        :return: A FlashReport.
+        """
+
+        return writeBlocks(self._writeScriptBlock, self.subroutineTable(subroutineAddresses, subroutineCommands),
+                           self.subroutineOffsetBlocks, skipErased, progress)
 
-            self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_WRITE_SCRIPT, 0, block + self.subroutineOffsetBlocks,
-                                   block_bytes)
+    def _writeScriptBlock(self, block, data):
+        self._transfer(0x40, uscRequest.REQUEST_WRITE_SCRIPT, 0, block, data)
 
+    @lane(RequestScheduler.CONTROL)
     def setScriptDone(self, value):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_SET_SCRIPT_DONE, value, 0)
+        self._transfer(0x40, uscRequest.REQUEST_SET_SCRIPT_DONE, value, 0)
+
+        if self.shadow is not None:
+            if value == 1:
+                self.shadow.scriptStopped()
+            else:
+                self.shadow.scriptStarted()
+
+        if self.predictor is not None:
+            self.predictor.invalidate()
 
+    @lane(RequestScheduler.CONFIGURATION)
     def startBootloader(self):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_START_BOOTLOADER, 0, 0)
+        self._transfer(0x40, uscRequest.REQUEST_START_BOOTLOADER, 0, 0)
 
+    @lane(RequestScheduler.CONFIGURATION)
     def reinitalize(self):
-        self._reinitialize(50)
+        """
+        :return: The measured downtime in seconds, or None if the device did not come back (see _reinitialize).
+        """
+
+        return self._reinitialize(500)
+
+    def _reinitialize(self, timeout, ready=None):
+        """
+        Reinitializes the device and polls it until the reset has visibly happened (and ready() is true, if
+        given) instead of sleeping for the worst case. Before the reset the speed variable of the last channel
+        is set to a marker that differs from its configured speed; the reset reloads the configured speed, so
+        a read without the marker cannot predate it. If the reset never shows, the channel gets its speed back.
+        :param timeout: Upper bound for the wait in milliseconds.
+        :param ready: Optional function returning True once the device has finished its part.
+        :return: The measured downtime in seconds, also kept in lastReinitializeTime, or None if the device
+                 did not finish within timeout; reinitializeTimedOut tells which.
+        """
+
+        channel = self.servoCount - 1
+        previous = self.getVariables('servos')[channel].speed
+        configured = self._getParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, channel))
+        marker = configured + 1 if configured < 1000 else configured - 1
+        self._writeSpeed(channel, marker)
+
+        start = time.perf_counter()
+        deadline = start + timeout / 1000
+        interval = self.reinitializePollInterval
+        self._transfer(0x40, uscRequest.REQUEST_REINITIALIZE, 0, 0)
+
+        while True:
+            done = self._hasReset(channel, marker) and (ready is None or ready())
+
+            if done:
+                break
+
+            now = time.perf_counter()
+
+            if now >= deadline:
+                break
+
+            # Not reset or not ready yet: back off, but never past the deadline.
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, 10 * self.reinitializePollInterval)
+
+        self.lastReinitializeTime = time.perf_counter() - start
+        self.reinitializeTimedOut = not done
+
+        if self.predictor is not None:
+            self.predictor.invalidate()
+
+        if not done:
+            try:
+                self._writeSpeed(channel, previous)
+            except Exception:
+                pass
+
+            if self.shadow is not None:
+                self.shadow.invalidate()
 
-    def _reinitialize(self, waitTime):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_REINITIALIZE, 0, 0)
+            return None
 
-        if not self.microMaestro:
-            self.getVariables('variables')
+        if self.shadow is not None:
+            self.seedShadow()
 
-        time.sleep(waitTime / 1000)
+        return self.lastReinitializeTime
 
+    def _hasReset(self, channel, marker):
+        try:
+            if self.microMaestro:
+                variables, servos = self._getVariableMicroMaestro()
+            else:
+                # Servos alone while the marker is still there, so a poll costs one transfer.
+                servos = self.getVariables('servos')
+
+                if servos[channel].speed == marker:
+                    return False
+
+                variables = self.getVariables('variables')
+        except Exception:
+            # Transfers can fail or come back short while the device restarts.
+            return False
+
+        return (servos[channel].speed != marker and variables.stackPointer <= self.stackSize()
+                and variables.callStackPointer <= self.callStackSize())
+
+    @lane(RequestScheduler.CONTROL)
     def clearErrors(self):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_CLEAR_ERRORS, 0, 0)
+        self._transfer(0x40, uscRequest.REQUEST_CLEAR_ERRORS, 0, 0)
 
+    @lane(RequestScheduler.TELEMETRY)
     def getVariables(self, out):
         """
         Gets a set of status information for the Maestro.
@@ -314,9 +429,31 @@ class Usc:
         else:
             return self._getVariableMiniMaestro(out)
 
+    def _readInto(self, request, buffer):
+        length = self._transfer(0xC0, request, 0, 0, buffer)
+
+        if length != len(buffer):
+            raise Exception('Short read: {} < {}.'.format(length, len(buffer)))
+
+    @lane(RequestScheduler.TELEMETRY)
+    def snapshot(self, into=None, servos=True, stack=True, callStack=True):
+        """
+        Captures the variables, servos, stack and call stack with as few transfers as possible.
+        :param into: A DeviceSnapshot from an earlier call to reuse its buffers.
+        :param servos: Also read the servos (free on the Micro Maestro).
+        :param stack: Also read the stack, trimmed to stackPointer.
+        :param callStack: Also read the call stack, trimmed to callStackPointer.
+        :return: The DeviceSnapshot.
+        """
+
+        if into is None:
+            into = DeviceSnapshot(self)
+
+        return into.capture(self, servos, stack, callStack)
+
     def _getVariableMicroMaestro(self):
-        packed = self.dev.ctrl_transfer(0xC0, uscRequest.REQUEST_GET_VARIABLES, 0, 0,
-                                        MicroMaestroVariables.struct.size + self.servoCount * ServoStatus.struct.size)
+        packed = self._transfer(0xC0, uscRequest.REQUEST_GET_VARIABLES, 0, 0,
+                                MicroMaestroVariables.struct.size + self.servoCount * ServoStatus.struct.size)
 
         var_packed = packed[0:MicroMaestroVariables.struct.size]
         servo_packed = packed[MicroMaestroVariables.struct.size:]
@@ -331,8 +468,8 @@ class Usc:
 
     def _getVariableMiniMaestro(self, out):
         if out == 'variables':
-            packed = self.dev.ctrl_transfer(0xC0, uscRequest.REQUEST_GET_VARIABLES, 0, 0,
-                                            MiniMaestroVariables.struct.size)
+            packed = self._transfer(0xC0, uscRequest.REQUEST_GET_VARIABLES, 0, 0,
+                                    MiniMaestroVariables.struct.size)
 
             if len(packed) != MiniMaestroVariables.struct.size:
                 raise Exception('Short read: {} < {}.'.format(len(packed), MiniMaestroVariables.struct.size))
@@ -340,8 +477,8 @@ class Usc:
             return MiniMaestroVariables(packed)
 
         elif out == 'servos':
-            packed = self.dev.ctrl_transfer(0xC0, uscRequest.REQUEST_GET_SERVO_SETTINGS, 0, 0,
-                                            self.servoCount * ServoStatus.struct.size)
+            packed = self._transfer(0xC0, uscRequest.REQUEST_GET_SERVO_SETTINGS, 0, 0,
+                                    self.servoCount * ServoStatus.struct.size)
 
             if len(packed) != ServoStatus.struct.size * self.servoCount:
                 raise Exception('Short read: {} < {}.'.format(len(packed), ServoStatus.struct.size))
@@ -353,36 +490,261 @@ class Usc:
             return servos
 
         elif out == 'stack':
-            packed = self.dev.ctrl_transfer(0xC0, uscRequest.REQUEST_GET_STACK, 0, 0, 2 * self.MiniMaestroStackSize)
-            return packed.tolist()
+            packed = self._transfer(0xC0, uscRequest.REQUEST_GET_STACK, 0, 0, 2 * self.MiniMaestroStackSize)
+            return list(struct.unpack_from('<%dh' % (len(packed) // 2), packed))
 
         elif out == 'callStack':
-            packed = self.dev.ctrl_transfer(0xC0, uscRequest.REQUEST_GET_CALL_STACK, 0, 0,
-                                            2 * self.MiniMaestroCallStackSize)
-            return packed.tolist()
+            packed = self._transfer(0xC0, uscRequest.REQUEST_GET_CALL_STACK, 0, 0,
+                                    2 * self.MiniMaestroCallStackSize)
+            return list(struct.unpack_from('<%dH' % (len(packed) // 2), packed))
 
         else:
             raise Exception('Unknown type of desired output {}.'.format(out))
 
+    @lane(RequestScheduler.CONTROL)
     def setTarget(self, servo, value):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_SET_TARGET, value, servo)
+        if self.shadow is not None and not self.shadow.update(ShadowRegisters.TARGET, servo, value):
+            return
+
+        if self.predictor is not None:
+            self.predictor.setTarget(servo, value)
 
+        if self.writeBehind is not None:
+            self.writeBehind.setTarget(servo, value)
+        else:
+            self._writeNow(ShadowRegisters.TARGET, servo, value, self._writeTarget)
+
+    @lane(RequestScheduler.CONTROL)
     def setSpeed(self, servo, value):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_SET_SERVO_VARIABLE, value, servo)
+        if self.shadow is not None and not self.shadow.update(ShadowRegisters.SPEED, servo, value):
+            return
+
+        if self.predictor is not None:
+            self.predictor.setSpeed(servo, value)
 
+        if self.writeBehind is not None:
+            self.writeBehind.setSpeed(servo, value)
+        else:
+            self._writeNow(ShadowRegisters.SPEED, servo, value, self._writeSpeed)
+
+    @lane(RequestScheduler.CONTROL)
     def setAcceleration(self, servo, value):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_SET_SERVO_VARIABLE, value, servo | 0x80)
+        if self.shadow is not None and not self.shadow.update(ShadowRegisters.ACCELERATION, servo, value):
+            return
+
+        if self.predictor is not None:
+            self.predictor.setAcceleration(servo, value)
+
+        if self.writeBehind is not None:
+            self.writeBehind.setAcceleration(servo, value)
+        else:
+            self._writeNow(ShadowRegisters.ACCELERATION, servo, value, self._writeAcceleration)
 
+    @lane(RequestScheduler.CONTROL)
+    def setTargets(self, targets, channels=None):
+        """
+        Sets several targets, e.g. the uint16 array returned by a Calibration.
+        :param targets: Sequence or array of targets in quarter-microseconds.
+        :param channels: Channel of each target; defaults to 0, 1, 2, ...
+        """
+
+        if hasattr(targets, 'tolist'):
+            targets = targets.tolist()
+
+        if channels is None:
+            channels = range(len(targets))
+
+        for servo, value in zip(channels, targets):
+            self.setTarget(servo, value)
+
+    def getCalibration(self, span=180.0):
+        """
+        Returns a Calibration built from the device's channel settings (requires numpy).
+        """
+
+        from maestro.usc.units import Calibration
+
+        return Calibration.fromChannelSettings(self.getUscSettings(), span)
+
+    @lane(RequestScheduler.TELEMETRY)
+    def getTarget(self, servo):
+        return self._getServoVariable(ShadowRegisters.TARGET, servo)
+
+    @lane(RequestScheduler.TELEMETRY)
+    def getSpeed(self, servo):
+        return self._getServoVariable(ShadowRegisters.SPEED, servo)
+
+    @lane(RequestScheduler.TELEMETRY)
+    def getAcceleration(self, servo):
+        return self._getServoVariable(ShadowRegisters.ACCELERATION, servo)
+
+    def _getServoVariable(self, kind, servo):
+        if self.shadow is not None:
+            value = self.shadow.get(kind, servo)
+
+            if value is not None:
+                return value
+
+        status = self.getVariables('servos')[servo]
+        return (status.speed, status.acceleration, status.target)[kind]
+
+    def enableShadow(self, maxAge=None, deadband=0):
+        """
+        Keeps a host-side copy of the last target, speed and acceleration of every channel, seeded from the
+        device. Writes that do not change a value (or move a target by no more than the deadband) are skipped
+        and getTarget/getSpeed/getAcceleration are answered from the copy while it is fresh. The copy is
+        dropped on reinitialize, restoreDefaultConfiguration, loadProgram and while a script runs.
+        :param maxAge: Seconds a shadowed value may be used by getters, or None for no limit.
+        :param deadband: Default target deadband in quarter-microseconds; see ShadowRegisters.setDeadband.
+        """
+
+        self.shadow = ShadowRegisters(self.servoCount, maxAge, deadband)
+        self.seedShadow()
+        return self.shadow
+
+    def disableShadow(self):
+        self.shadow = None
+
+    @lane(RequestScheduler.TELEMETRY)
+    def seedShadow(self):
+        """
+        Re-reads the servo variables and script state into the shadow registers.
+        """
+
+        scriptDone = self.getVariables('variables').scriptDone
+        self.shadow.invalidate()
+        self.shadow.seed(self.getVariables('servos'), scriptDone)
+
+    def enablePredictor(self, fastInterval=0.02, slowInterval=0.25):
+        """
+        Models servo motion from the targets, speeds and accelerations written through this object so that
+        waitUntilSettled can sleep for the predicted time instead of polling. Returns the MotionPredictor.
+        """
+
+        if self.predictor is None:
+            self.predictor = MotionPredictor(self, fastInterval, slowInterval)
+            self.predictor.observe()
+
+        return self.predictor
+
+    def disablePredictor(self):
+        self.predictor = None
+
+    def waitUntilSettled(self, channels=None, timeout=None, tolerance=0):
+        """
+        Waits until the channels reach their targets; see MotionPredictor.waitUntilSettled.
+        """
+
+        self.flush()
+        return self.enablePredictor().waitUntilSettled(channels, timeout, tolerance)
+
+    def _writeNow(self, kind, servo, value, write):
+        try:
+            write(servo, value)
+        except Exception:
+            # The device may not have the value, so an identical retry must not be skipped.
+            self._writeFailed(kind, servo)
+            raise
+
+    def _writeFailed(self, kind, servo):
+        if self.shadow is not None:
+            self.shadow.invalidate(servo, kind)
+
+    def _writeTarget(self, servo, value):
+        self._transfer(0x40, uscRequest.REQUEST_SET_TARGET, value, servo)
+
+    def _writeSpeed(self, servo, value):
+        self._transfer(0x40, uscRequest.REQUEST_SET_SERVO_VARIABLE, value, servo)
+
+    def _writeAcceleration(self, servo, value):
+        self._transfer(0x40, uscRequest.REQUEST_SET_SERVO_VARIABLE, value, servo | 0x80)
+
+    def enableWriteBehind(self, rate=50.0):
+        """
+        Queues setTarget, setSpeed and setAcceleration in memory and writes only the latest value per channel
+        from a background thread, rate times per second. Returns the WriteBehindQueue.
+        """
+
+        if self.writeBehind is None:
+            self.writeBehind = WriteBehindQueue(self, rate)
+
+        return self.writeBehind
+
+    def disableWriteBehind(self, drain=True):
+        """
+        Returns to writing immediately. Queued values are sent first unless drain is False.
+        """
+
+        if self.writeBehind is not None:
+            writeBehind, self.writeBehind = self.writeBehind, None
+            writeBehind.stop(drain)
+
+    def enableTracing(self, capacity=65536, tracer=None):
+        """
+        Records every public method call and control transfer, with its thread, as a span. Returns the
+        Tracer; export it with Tracer.save for chrome://tracing or ui.perfetto.dev.
+        :param capacity: Most spans kept; older ones are dropped.
+        :param tracer: An existing Tracer to share, e.g. between the devices of a fleet.
+        """
+
+        from maestro.usc.tracing import Tracer
+
+        self.tracer = tracer if tracer is not None else Tracer(capacity)
+        return self.tracer
+
+    def disableTracing(self):
+        self.tracer = None
+
+    @lane(RequestScheduler.EMERGENCY)
+    def emergencyStop(self):
+        """
+        Stops the script and turns off the pulses of every channel (target 0) ahead of any queued control,
+        telemetry or configuration transfers. Pending write-behind values are discarded, including the rest
+        of a batch already being written, and shadowed values dropped. An operation already in progress on
+        another thread resumes afterwards.
+        """
+
+        writeBehind = self.writeBehind
+
+        if writeBehind is not None:
+            # The I/O thread cannot write between the discard and the zeros.
+            with writeBehind.fenced():
+                self._stopOutputs()
+        else:
+            self._stopOutputs()
+
+        if self.shadow is not None:
+            self.shadow.scriptStopped()
+
+        if self.predictor is not None:
+            self.predictor.invalidate()
+
+    def _stopOutputs(self):
+        self._transfer(0x40, uscRequest.REQUEST_SET_SCRIPT_DONE, 1, 0)
+
+        for servo in range(self.servoCount):
+            self._writeTarget(servo, 0)
+
+    def flush(self, timeout=None):
+        """
+        Writes any queued write-behind values now and waits for them to reach the device.
+        """
+
+        if self.writeBehind is not None:
+            return self.writeBehind.flush(timeout)
+
+        return True
+
+    @lane(RequestScheduler.CONFIGURATION)
     def setUscSettings(self, settings, newScript):
-        self._setRawParameter(uscParameter.PARAMETER_SERIAL_MODE, settings.serialMode)
-        self._setRawParameter(uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE,
-                              self._convertBpsToSpbrg(settings.fixedBaudRate))
-        self._setRawParameter(uscParameter.PARAMETER_SERIAL_ENABLE_CRC, int(settings.enableCrc))
-        self._setRawParameter(uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND, int(settings.neverSuspend))
-        self._setRawParameter(uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER, settings.serialDeviceNumber)
-        self._setRawParameter(uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET, settings.miniSscOffset)
-        self._setRawParameter(uscParameter.PARAMETER_SERIAL_TIMEOUT, settings.serialTimeout)
-        self._setRawParameter(uscParameter.PARAMETER_SCRIPT_DONE, int(settings.scriptDone))
+        self._setParameter(uscParameter.PARAMETER_SERIAL_MODE, settings.serialMode)
+        self._setParameter(uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE, settings.fixedBaudRate)
+        self._setParameter(uscParameter.PARAMETER_SERIAL_ENABLE_CRC, settings.enableCrc)
+        self._setParameter(uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND, settings.neverSuspend)
+        self._setParameter(uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER, settings.serialDeviceNumber)
+        self._setParameter(uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET, settings.miniSscOffset)
+        self._setParameter(uscParameter.PARAMETER_SERIAL_TIMEOUT, settings.serialTimeout)
+        self._setParameter(uscParameter.PARAMETER_SCRIPT_DONE, settings.scriptDone)
 
         if self.microMaestro:
             self._setRawParameter(uscParameter.PARAMETER_SERVOS_AVAILABLE, settings.servosAvailable)
@@ -403,7 +765,7 @@ class Usc:
             self._setRawParameter(uscParameter.PARAMETER_SERVO_MULTIPLIER, multiplier)
 
         if self.servoCount > 18:
-            self._setRawParameter(uscParameter.PARAMETER_ENABLE_PULLUPS, int(settings.enablePullups))
+            self._setParameter(uscParameter.PARAMETER_ENABLE_PULLUPS, settings.enablePullups)
 
         ioMask = 0
         outputMask = 0
@@ -433,15 +795,14 @@ class Usc:
             else:
                 home = setting.home
 
-            self._setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_HOME, i), home)
-            self._setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MIN, i), int(setting.minimum / 64))
-            self._setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MAX, i), int(setting.maximum / 64))
-            self._setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, i), setting.neutral)
-            self._setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_RANGE, i), int(setting.range / 127))
-            self._setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, i),
-                                  self._normalSpeedToExponentialSpeed(setting.speed))
-            self._setRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_ACCELERATION, i),
-                                  setting.acceleration)
+            self._setParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_HOME, i), home)
+            self._setParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MIN, i), setting.minimum)
+            self._setParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MAX, i), setting.maximum)
+            self._setParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, i), setting.neutral)
+            self._setParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_RANGE, i), setting.range)
+            self._setParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, i), setting.speed)
+            self._setParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_ACCELERATION, i),
+                               setting.acceleration)
 
         if self.microMaestro:
             self._setRawParameter(uscParameter.PARAMETER_IO_MASK_C, ioMask)
@@ -451,38 +812,55 @@ class Usc:
                 self._setRawParameter(uscParameter.PARAMETER_CHANNEL_MODES_0_3 + i, channelModeBytes[i])
 
         if newScript:
-            self.loadProgram(settings.bytecodeProgram, CRC=True)
+            return self.loadProgram(settings.bytecodeProgram, CRC=True)
 
     def _setRawParameter(self, parameter, value):
-        parameterRange = Usc.getRange(parameter)
-        Usc.requireArgumentRange(value, parameterRange.minimumValue, parameterRange.maximumValue, parameter)
-        self._setRawParameterNoChecks(parameter, value, parameterRange.bytes)
+        spec = getParameterSpec(parameter)
+        spec.check(value, parameter)
+        self._setRawParameterNoChecks(parameter, value, spec.bytes)
+
+    def _setParameter(self, parameter, value):
+        """
+        Encodes a value given in setting units according to the parameter schema and writes it.
+        """
+
+        spec = getParameterSpec(parameter)
+        raw = spec.encode(value)
+        spec.check(raw, parameter)
+        self._setRawParameterNoChecks(parameter, raw, spec.bytes)
 
     def _setRawParameterNoChecks(self, parameter, value, numBytes):
         index = (numBytes << 8) + parameter
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_SET_PARAMETER, value, index)
+        self._transfer(0x40, uscRequest.REQUEST_SET_PARAMETER, value, index)
 
     def _getRawParameter(self, parameter):
-        parameterRange = Usc.getRange(parameter)
-        array = self.dev.ctrl_transfer(0xC0, uscRequest.REQUEST_GET_PARAMETER, 0, parameter, parameterRange.bytes)
+        numBytes = getParameterSpec(parameter).bytes
+        array = self._transfer(0xC0, uscRequest.REQUEST_GET_PARAMETER, 0, parameter, numBytes)
 
-        if parameterRange.bytes == 1:
-            return int(struct.unpack('<B', array)[0])
+        if numBytes == 1:
+            return array[0]
         else:
-            return int(struct.unpack('<H', array)[0])
+            return array[0] | (array[1] << 8)
+
+    def _getParameter(self, parameter):
+        """
+        Reads a parameter and decodes it to setting units according to the parameter schema.
+        """
+
+        return getParameterSpec(parameter).decode(self._getRawParameter(parameter))
 
+    @lane(RequestScheduler.CONFIGURATION)
     def getUscSettings(self):
         settings = UscSettings()
 
-        settings.serialMode = self._getRawParameter(uscParameter.PARAMETER_SERIAL_MODE)
-        settings.fixedBaudRate = self._convertSpbrgToBps(
-            self._getRawParameter(uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE))
-        settings.enableCrc = self._getRawParameter(uscParameter.PARAMETER_SERIAL_ENABLE_CRC) != 0
-        settings.neverSuspend = self._getRawParameter(uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND) != 0
-        settings.serialDeviceNumber = self._getRawParameter(uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER)
-        settings.miniSscOffset = self._getRawParameter(uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET)
-        settings.serialTimeout = self._getRawParameter(uscParameter.PARAMETER_SERIAL_TIMEOUT)
-        settings.scriptDone = self._getRawParameter(uscParameter.PARAMETER_SCRIPT_DONE) != 0
+        settings.serialMode = self._getParameter(uscParameter.PARAMETER_SERIAL_MODE)
+        settings.fixedBaudRate = self._getParameter(uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE)
+        settings.enableCrc = self._getParameter(uscParameter.PARAMETER_SERIAL_ENABLE_CRC)
+        settings.neverSuspend = self._getParameter(uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND)
+        settings.serialDeviceNumber = self._getParameter(uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER)
+        settings.miniSscOffset = self._getParameter(uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET)
+        settings.serialTimeout = self._getParameter(uscParameter.PARAMETER_SERIAL_TIMEOUT)
+        settings.scriptDone = self._getParameter(uscParameter.PARAMETER_SCRIPT_DONE)
 
         if self.microMaestro:
             settings.servosAvailable = self._getRawParameter(uscParameter.PARAMETER_SERVOS_AVAILABLE)
@@ -495,7 +873,7 @@ class Usc:
             settings.servoMultiplier = self._getRawParameter(uscParameter.PARAMETER_SERVO_MULTIPLIER) + 1
 
         if self.servoCount > 18:
-            settings.enablePullups = self._getRawParameter(uscParameter.PARAMETER_ENABLE_PULLUPS) != 0
+            settings.enablePullups = self._getParameter(uscParameter.PARAMETER_ENABLE_PULLUPS)
 
         ioMask = 0
         outputMask = 0
@@ -534,13 +912,12 @@ class Usc:
                 setting.homeMode = HomeMode.Goto
                 setting.home = home
 
-            setting.minimum = 64 * self._getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MIN, i))
-            setting.maximum = 64 * self._getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MAX, i))
-            setting.neutral = self._getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, i))
-            setting.range = 127 * self._getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_RANGE, i))
-            setting.speed = self._exponentialSpeedToNormalSpeed(
-                self._getRawParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, i)))
-            setting.acceleration = self._getRawParameter(
+            setting.minimum = self._getParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MIN, i))
+            setting.maximum = self._getParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_MAX, i))
+            setting.neutral = self._getParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_NEUTRAL, i))
+            setting.range = self._getParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_RANGE, i))
+            setting.speed = self._getParameter(self.specifyServo(uscParameter.PARAMETER_SERVO0_SPEED, i))
+            setting.acceleration = self._getParameter(
                 self.specifyServo(uscParameter.PARAMETER_SERVO0_ACCELERATION, i))
 
             settings.channelSettings.append(setting)
@@ -550,12 +927,19 @@ class Usc:
     @staticmethod
     def requireArgumentRange(argumentValue, minimum, maximum, argumentName):
         if argumentValue < minimum or argumentValue > maximum:
-            raise Exception('The %s must be between {} and {} but the value given was {}.'
+            raise Exception('The {} must be between {} and {} but the value given was {}.'
                             .format(argumentName, minimum, maximum, argumentValue))
 
+    @lane(RequestScheduler.CONFIGURATION)
     def restoreDefaultConfiguration(self):
+        """
+        :return: The measured downtime in seconds, or None if the device did not come back (see _reinitialize).
+        """
+
         self._setRawParameterNoChecks(uscParameter.PARAMETER_INITIALIZED, 0xFF, 1)
-        self._reinitialize(1500)
+
+        # The firmware clears PARAMETER_INITIALIZED once it has written the defaults.
+        return self._reinitialize(5000, lambda: self._getRawParameter(uscParameter.PARAMETER_INITIALIZED) != 0xFF)
 
     def fixSettings(self, settings):
         warnings = []
@@ -578,21 +962,8 @@ class Usc:
                 settings.channelSettings.append(cs)
 
         for cs in settings.channelSettings:
-            if cs.mode == ChannelMode.Input:
-                cs.homeMode = HomeMode.Ignore
-                cs.minimum = 0
-                cs.maximum = 1024
-                cs.speed = 0
-                cs.acceleration = 0
-                cs.neutral = 1024
-                cs.range = 1905
-            elif cs.mode == ChannelMode.Output:
-                cs.minimum = 3986
-                cs.maximum = 8000
-                cs.speed = 0
-                cs.acceleration = 0
-                cs.neutral = 6000
-                cs.range = 1905
+            for field, value in MODE_DEFAULTS.get(cs.mode, ()):
+                setattr(cs, field, value)
 
         if settings.serialDeviceNumber >= 128:
             settings.serialDeviceNumber = 12
@@ -602,77 +973,51 @@ class Usc:
 
     @staticmethod
     def getRange(parameterId):
-        if parameterId in [uscParameter.PARAMETER_INITIALIZED,
-                           uscParameter.PARAMETER_SERVOS_AVAILABLE,
-                           uscParameter.PARAMETER_SERVO_PERIOD,
-                           uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_L,
-                           uscParameter.PARAMETER_SERVO_MULTIPLIER,
-                           uscParameter.PARAMETER_CHANNEL_MODES_0_3,
-                           uscParameter.PARAMETER_CHANNEL_MODES_4_7,
-                           uscParameter.PARAMETER_CHANNEL_MODES_8_11,
-                           uscParameter.PARAMETER_CHANNEL_MODES_12_15,
-                           uscParameter.PARAMETER_CHANNEL_MODES_16_19,
-                           uscParameter.PARAMETER_CHANNEL_MODES_20_23,
-                           uscParameter.PARAMETER_ENABLE_PULLUPS]:
-            return Range.u8()
-        elif parameterId in [uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_HU,
-                             uscParameter.PARAMETER_SERIAL_TIMEOUT,
-                             uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE,
-                             uscParameter.PARAMETER_SCRIPT_CRC]:
-            return Range.u16()
-        elif parameterId in [uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND,
-                             uscParameter.PARAMETER_SERIAL_ENABLE_CRC,
-                             uscParameter.PARAMETER_SCRIPT_DONE]:
-            return Range.boolean()
-        elif parameterId == uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER:
-            return Range.u7()
-        elif parameterId == uscParameter.PARAMETER_SERIAL_MODE:
-            return Range(1, 0, 3)
-        elif parameterId == uscParameter.PARAMETER_SERIAL_BAUD_DETECT_TYPE:
-            return Range(1, 0, 1)
-        elif parameterId == uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET:
-            return Range(1, 0, 254)
-        else:
-            servoParameter = ((int(parameterId) - int(uscParameter.PARAMETER_SERVO0_HOME)) % 9) \
-                             + int(uscParameter.PARAMETER_SERVO0_HOME)
-            if servoParameter in [int(uscParameter.PARAMETER_SERVO0_SPEED),
-                                  int(uscParameter.PARAMETER_SERVO0_MAX),
-                                  int(uscParameter.PARAMETER_SERVO0_MIN),
-                                  int(uscParameter.PARAMETER_SERVO0_ACCELERATION)]:
-                return Range.u8()
-            elif servoParameter in [int(uscParameter.PARAMETER_SERVO0_HOME),
-                                    int(uscParameter.PARAMETER_SERVO0_NEUTRAL)]:
-                return Range(2, 0, 32440)
-            elif servoParameter == int(uscParameter.PARAMETER_SERVO0_RANGE):
-                return Range(1, 1, 50)
-            else:
-                raise Exception('Invalid parameterId {}, can not determine the range of this parameter.'
-                                .format(int(parameterId)))
+        return getParameterSpec(parameterId)
 
+    @lane(RequestScheduler.CONTROL)
     def setPWM(self, dutyCycle, period):
-        self.dev.ctrl_transfer(0x40, uscRequest.REQUEST_SET_PWM, dutyCycle, period)
+        self._transfer(0x40, uscRequest.REQUEST_SET_PWM, dutyCycle, period)
 
+    @lane(RequestScheduler.CONTROL)
     def disablePWM(self):
         if self.getProductID() == 0x008a:
             self.setTarget(8, 0)
         else:
             self.setTarget(12, 0)
 
-    def loadProgram(self, program, CRC=False):
+    @lane(RequestScheduler.CONFIGURATION)
+    def loadProgram(self, program, CRC=False, progress=None):
+        """
+        Erases the script memory and writes the program. Blocks left all 0xFF by the erase are not sent.
+        :param progress: Optional function called with (bytes sent, bytes to send) after every block.
+        :return: A FlashReport for the subroutine table and the bytecode together. The time the device took to
+                 come back afterwards is in lastReinitializeTime and reinitializeTimedOut.
+        """
+
         self.setScriptDone(1)
         byteList = program.getByteList()
 
         if len(byteList) > self.maxScriptLength:
-            raise Exception('Script is too long for device ({} bytes).'.format(byteList))
+            raise Exception('Script is too long for device ({} bytes).'.format(len(byteList)))
 
         if len(byteList) < self.maxScriptLength:
             byteList.append(Opcode.QUIT)
 
+        table = self.subroutineTable(program.subroutineAddresses, program.subroutineCommands)
+        tableBytes = countBytes(table, True)
+        total = tableBytes + countBytes(byteList, True)
+
         self.eraseScript()
-        self.setSubroutines(program.subroutineAddresses, program.subroutineCommands)
-        self.writeScript(byteList)
+
+        report = writeBlocks(self._writeScriptBlock, table, self.subroutineOffsetBlocks, True,
+                             progress and (lambda sent, _: progress(sent, total)))
+        report.add(writeBlocks(self._writeScriptBlock, byteList, 0, True,
+                               progress and (lambda sent, _: progress(tableBytes + sent, total))))
 
         if CRC:
             self._setRawParameter(uscParameter.PARAMETER_SCRIPT_CRC, program.getCRC())
 
-        self._reinitialize(100)
+        self._reinitialize(1000)
+        self.lastFlashReport = report
+        return report
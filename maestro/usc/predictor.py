@@ -0,0 +1,246 @@
+import math
+import time
+
+from maestro.usc.schema import exponentialSpeedToNormalSpeed
+
+# The Maestro updates servo positions every 10 ms.
+TICK = 0.010
+
+
+class _ChannelModel:
+    def __init__(self):
+        self.known = False
+        self.time = 0.0
+        self.position = 0
+        self.velocity = 0.0
+        self.target = 0
+        self.speed = 0
+        self.acceleration = 0
+
+
+def _step(position, velocity, target, speed, acceleration):
+    # One 10 ms servo update, in quarter-microseconds. Speed is in 0.25 us / 10 ms, acceleration in
+    # 0.25 us / 10 ms / 80 ms.
+    if position == target or target == 0:
+        return position, 0.0
+
+    distance = abs(target - position)
+    limit = speed if speed else distance
+
+    if acceleration:
+        rate = acceleration / 8.0
+        velocity = min(velocity + rate, limit, math.sqrt(2 * rate * distance))
+        velocity = max(velocity, min(rate, distance))
+    else:
+        velocity = limit
+
+    step = min(distance, int(round(velocity)) or 1)
+    return (position + step if target > position else position - step), velocity
+
+
+class MotionPredictor:
+    """
+    Models every channel's position from the last target, speed and acceleration sent to it, in the
+    device's units, so that callers can tell when a servo will arrive without polling.
+
+    Usc feeds it every setTarget/setSpeed/setAcceleration once enabled with Usc.enablePredictor. Anything
+    that moves servos behind the host's back (a running script, reinitialization) makes the model unknown
+    until the next observation.
+    """
+
+    def __init__(self, usc, fastInterval=0.02, slowInterval=0.25, clock=None):
+        """
+        :param usc: The Usc object to confirm predictions with.
+        :param fastInterval: Polling interval while a channel is predicted to be moving.
+        :param slowInterval: Longest polling interval when the prediction turned out to be wrong.
+        :param clock: Function returning seconds; defaults to time.monotonic.
+        """
+
+        self.usc = usc
+        self.fastInterval = fastInterval
+        self.slowInterval = slowInterval
+        self.clock = clock or time.monotonic
+        self.channels = [_ChannelModel() for _ in range(usc.servoCount)]
+        self.reads = 0
+
+    def invalidate(self, channel=None):
+        for model in (self.channels if channel is None else [self.channels[channel]]):
+            model.known = False
+
+    def observe(self, servos=None, t=None):
+        """
+        Re-anchors the model on measured positions. Reads the servos from the device if none are given.
+        """
+
+        if servos is None:
+            servos = self.usc.getVariables('servos')
+            self.reads += 1
+
+        t = self.clock() if t is None else t
+
+        for model, status in zip(self.channels, servos):
+            unchanged = (model.known and model.target == status.target and model.speed == status.speed
+                         and model.acceleration == status.acceleration)
+            velocity = self._state(model, t)[1] if unchanged else 0.0
+
+            model.known = True
+            model.time = t
+            model.position = status.position
+            model.velocity = velocity if status.position != status.target else 0.0
+            model.target = status.target
+            model.speed = status.speed
+            model.acceleration = status.acceleration
+
+    def _state(self, model, t):
+        ticks = int((t - model.time) / TICK)
+        position, velocity = model.position, model.velocity
+
+        if not model.acceleration and ticks > 0 and position != model.target and model.target != 0:
+            # Constant speed has a closed form.
+            distance = abs(model.target - position)
+            limit = model.speed if model.speed else distance
+            travelled = min(distance, limit * ticks)
+            position += travelled if model.target > position else -travelled
+            return position, (float(limit) if position != model.target else 0.0)
+
+        for _ in range(ticks):
+            if position == model.target:
+                break
+            position, velocity = _step(position, velocity, model.target, model.speed, model.acceleration)
+
+        return position, velocity
+
+    def _rebase(self, channel, t):
+        model = self.channels[channel]
+
+        if model.known:
+            model.position, model.velocity = self._state(model, t)
+
+        model.time = t
+        return model
+
+    def setTarget(self, channel, target, t=None):
+        self._rebase(channel, self.clock() if t is None else t).target = target
+
+    def setSpeed(self, channel, speed, t=None, exponential=False):
+        """
+        :param exponential: The speed is in the exponential encoding used by the speed parameters and
+                            channel settings rather than the normal units of setSpeed.
+        """
+
+        if exponential:
+            speed = exponentialSpeedToNormalSpeed(speed)
+
+        self._rebase(channel, self.clock() if t is None else t).speed = speed
+
+    def setAcceleration(self, channel, acceleration, t=None):
+        self._rebase(channel, self.clock() if t is None else t).acceleration = acceleration
+
+    def estimatedPosition(self, channel, t=None):
+        """
+        Returns the predicted position of a channel at time t (default: now), or None if it is unknown.
+        """
+
+        model = self.channels[channel]
+
+        if not model.known:
+            return None
+
+        return self._state(model, self.clock() if t is None else t)[0]
+
+    def settleTime(self, channel, t=None):
+        """
+        Returns the predicted seconds from t (default: now) until the channel reaches its target, 0.0 if it
+        already has, or None if it is unknown.
+        """
+
+        model = self.channels[channel]
+
+        if not model.known:
+            return None
+
+        t = self.clock() if t is None else t
+        position, velocity = self._state(model, t)
+        target = model.target
+
+        if position == target or target == 0:
+            return 0.0
+
+        if not model.acceleration:
+            limit = model.speed if model.speed else abs(target - position)
+            return math.ceil(abs(target - position) / float(limit)) * TICK
+
+        ticks = 0
+
+        while position != target:
+            position, velocity = _step(position, velocity, target, model.speed, model.acceleration)
+            ticks += 1
+
+        return ticks * TICK
+
+    def _settleTime(self, channels, t=None):
+        # Longest known settle time. A channel invalidated meanwhile (by another thread, say) has none and
+        # is left to the confirming read.
+        times = [self.settleTime(channel, t) for channel in channels]
+        return max([remaining for remaining in times if remaining is not None] or [0.0])
+
+    def isMoving(self, channel, t=None):
+        remaining = self.settleTime(channel, t)
+        return remaining is None or remaining > 0
+
+    def nextPollInterval(self, channels=None):
+        """
+        Returns how long a telemetry loop may wait before its next read: fastInterval while any of the
+        channels is predicted to be moving, slowInterval otherwise.
+        """
+
+        channels = range(len(self.channels)) if channels is None else channels
+        t = self.clock()
+        return self.fastInterval if any(self.isMoving(channel, t) for channel in channels) else self.slowInterval
+
+    def waitUntilSettled(self, channels=None, timeout=None, tolerance=0):
+        """
+        Sleeps for the predicted settle time of the channels, then confirms with one read. If the servos
+        are not there yet the model is re-anchored on that read and the wait repeats, backing off towards
+        slowInterval while predictions keep failing.
+        :param tolerance: Allowed |position - target| in quarter-microseconds.
+        :return: True once settled, False if the timeout expired first.
+        """
+
+        channels = list(range(len(self.channels)) if channels is None else channels)
+        deadline = None if timeout is None else self.clock() + timeout
+        retry = self.fastInterval
+
+        if not all(self.channels[channel].known for channel in channels):
+            self.observe()
+
+        while True:
+            now = self.clock()
+            wait = self._settleTime(channels, now)
+
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - now))
+
+            if wait > 0:
+                time.sleep(wait)
+
+            servos = self.usc.getVariables('servos')
+            self.reads += 1
+            self.observe(servos)
+
+            if all(servos[channel].target == 0 or abs(servos[channel].position - servos[channel].target) <= tolerance
+                   for channel in channels):
+                return True
+
+            if deadline is not None and self.clock() >= deadline:
+                return False
+
+            # The model was wrong (or the servos are still moving under acceleration we could not see):
+            # never spin faster than retry, which grows while the prediction keeps missing.
+            remaining = self._settleTime(channels)
+
+            if remaining < retry:
+                time.sleep(retry if deadline is None else min(retry, max(0.0, deadline - self.clock())))
+                retry = min(retry * 2, self.slowInterval)
+            else:
+                retry = self.fastInterval
@@ -0,0 +1,198 @@
+import bisect
+import time
+
+from maestro.bytecode.protocol import Opcode
+
+
+class ScriptProfiler:
+    """
+    Statistical profiler for scripts running on a Maestro. The program counter and call stack are sampled
+    as fast as the device allows and attributed to instructions, source lines and subroutines of the
+    BytecodeProgram that was loaded onto the device.
+    """
+
+    mainName = '(main)'
+
+    def __init__(self, usc, program, callStacks=True):
+        """
+        :param usc: A connected Usc object running the script.
+        :param program: The BytecodeProgram that was loaded on the device.
+        :param callStacks: Also read the call stack on every sample. On the Mini Maestro this costs an
+                           extra transfer per sample taken inside a subroutine, so disable it for a higher
+                           sample rate. The transfers are not atomic, so a few stacks may be torn on
+                           fast-changing scripts.
+        """
+
+        self.usc = usc
+        self.program = program
+        self.callStacks = callStacks
+        self._snapshot = None
+
+        addresses = program.getInstructionAddresses()
+        self._instructionAddresses = [address for address, _ in addresses]
+        self._instructions = [instruction for _, instruction in addresses]
+
+        subroutines = sorted((address, name) for name, address in program.subroutineAddresses.items())
+        self._subroutineAddresses = [address for address, _ in subroutines]
+        self._subroutineNames = [name for _, name in subroutines]
+
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.stoppedSamples = 0
+        self.elapsed = 0.0
+        self.instructionCounts = {}
+        self.stackCounts = {}
+
+    def instructionAt(self, address):
+        """
+        Returns (start address, instruction) of the instruction containing the given address.
+        """
+
+        index = bisect.bisect_right(self._instructionAddresses, address) - 1
+
+        if index < 0:
+            return None, None
+
+        return self._instructionAddresses[index], self._instructions[index]
+
+    def subroutineAt(self, address):
+        index = bisect.bisect_right(self._subroutineAddresses, address) - 1
+        return self._subroutineNames[index] if index >= 0 else self.mainName
+
+    def sample(self):
+        """
+        Takes a single sample of the program counter (and call stack if enabled).
+        """
+
+        snapshot = self.usc.snapshot(self._snapshot, servos=False, stack=False, callStack=self.callStacks)
+        self._snapshot = snapshot
+        self.samples += 1
+
+        if snapshot.scriptDone:
+            self.stoppedSamples += 1
+            return
+
+        address, _ = self.instructionAt(snapshot.programCounter)
+        self.instructionCounts[address] = self.instructionCounts.get(address, 0) + 1
+
+        if self.callStacks:
+            callers = tuple(self.subroutineAt(returnAddress - 1) for returnAddress in snapshot.callStack)
+            stack = callers + (self.subroutineAt(snapshot.programCounter),)
+        else:
+            stack = (self.subroutineAt(snapshot.programCounter),)
+
+        self.stackCounts[stack] = self.stackCounts.get(stack, 0) + 1
+
+    def run(self, duration, maxSamples=None):
+        """
+        Samples continuously for the given duration.
+        :param duration: Time to sample in seconds.
+        :param maxSamples: Optional upper bound on the number of samples.
+        """
+
+        start = time.perf_counter()
+        end = start + duration
+        taken = 0
+
+        while time.perf_counter() < end and (maxSamples is None or taken < maxSamples):
+            self.sample()
+            taken += 1
+
+        self.elapsed += time.perf_counter() - start
+        return self
+
+    def sampleRate(self):
+        return self.samples / self.elapsed if self.elapsed > 0 else 0.0
+
+    def instructionProfile(self):
+        """
+        Returns a list of (samples, address, instruction) sorted by decreasing sample count.
+        """
+
+        rows = []
+
+        for address, count in self.instructionCounts.items():
+            rows.append((count, address, self.instructionAt(address)[1]))
+
+        return sorted(rows, key=lambda row: (-row[0], row[1]))
+
+    def lineProfile(self):
+        """
+        Returns a list of (samples, line number) sorted by decreasing sample count.
+        """
+
+        counts = {}
+
+        for count, _, instruction in self.instructionProfile():
+            counts[instruction.lineNumber] = counts.get(instruction.lineNumber, 0) + count
+
+        return sorted(((count, line) for line, count in counts.items()), key=lambda row: (-row[0], row[1]))
+
+    def subroutineProfile(self):
+        """
+        Returns a list of (self samples, total samples, name) sorted by decreasing self samples.
+        """
+
+        selfCounts = {}
+        totalCounts = {}
+
+        for stack, count in self.stackCounts.items():
+            selfCounts[stack[-1]] = selfCounts.get(stack[-1], 0) + count
+            for name in set(stack):
+                totalCounts[name] = totalCounts.get(name, 0) + count
+
+        rows = [(selfCounts.get(name, 0), total, name) for name, total in totalCounts.items()]
+        return sorted(rows, key=lambda row: (-row[0], -row[1], row[2]))
+
+    @staticmethod
+    def _instructionName(instruction):
+        if instruction.isCall or instruction.opcode >= 128:
+            return 'CALL {}'.format(instruction.labelName)
+        return Opcode(instruction.opcode).name
+
+    def flatProfile(self):
+        """
+        Returns the flat profile as text.
+        """
+
+        running = self.samples - self.stoppedSamples
+        percent = lambda count: 100.0 * count / running if running else 0.0
+
+        lines = ['Samples: {} ({} while the script was stopped) in {:.3f} s, {:.1f} samples/s'
+                 .format(self.samples, self.stoppedSamples, self.elapsed, self.sampleRate()),
+                 '',
+                 'Subroutines:',
+                 '   Self  Percent    Total  Name']
+
+        for selfCount, total, name in self.subroutineProfile():
+            lines.append('{:7d}  {:6.2f}%  {:7d}  {}'.format(selfCount, percent(selfCount), total, name))
+
+        lines.extend(['', 'Lines:', 'Samples  Percent   Line  Source'])
+
+        for count, line in self.lineProfile():
+            lines.append('{:7d}  {:6.2f}%  {:5d}  {}'.format(count, percent(count), line,
+                                                           self.program.getSourceLine(line).strip()))
+
+        lines.extend(['', 'Instructions:', 'Samples  Percent  Address  Line  Instruction'])
+
+        for count, address, instruction in self.instructionProfile():
+            lines.append('{:7d}  {:6.2f}%  {:04X}     {:4d}  {}'.format(count, percent(count), address,
+                                                                      instruction.lineNumber,
+                                                                      self._instructionName(instruction)))
+
+        return '\n'.join(lines) + '\n'
+
+    def collapsedStacks(self):
+        """
+        Returns the samples in the collapsed stack format ("frame;frame;frame count") accepted by
+        flamegraph.pl, speedscope and similar tools.
+        """
+
+        return ['{} {}'.format(';'.join(stack), count) for stack, count in sorted(self.stackCounts.items())]
+
+    def writeCollapsed(self, filename):
+        with open(filename, 'w') as f:
+            for line in self.collapsedStacks():
+                f.write('%s\n' % line)
@@ -165,7 +165,7 @@ class MaestroVariables:
 
 
 class MicroMaestroVariables:
-    struct = struct.Struct('<BBH3h32h10HBB')
+    struct = struct.Struct('<BBHH3h32h10HBB')
 
     def __init__(self, packed):
         unpacked = self.struct.unpack(packed)
@@ -173,11 +173,12 @@ class MicroMaestroVariables:
         self.stackPointer = unpacked[0]
         self.callStackPointer = unpacked[1]
         self.errors = unpacked[2]
-        self.buffer = unpacked[3:6]
-        self.stack = unpacked[6:38]
-        self.callStack = unpacked[38:48]
-        self.scriptDone = unpacked[48]
-        self.buffer2 = unpacked[49]
+        self.programCounter = unpacked[3]
+        self.buffer = unpacked[4:7]
+        self.stack = unpacked[7:39]
+        self.callStack = unpacked[39:49]
+        self.scriptDone = unpacked[49]
+        self.buffer2 = unpacked[50]
 
 
 class MiniMaestroVariables:
@@ -0,0 +1,165 @@
+import concurrent.futures
+import os
+import queue
+import time
+
+from maestro.usc.bundle import SettingsBundle
+from maestro.usc.configuration import ConfigurationFile
+from maestro.usc.main import Usc
+
+
+class ProvisioningResult:
+    def __init__(self, serialNumber, filename):
+        self.serialNumber = serialNumber
+        self.filename = filename
+        self.warnings = []
+        self.error = None
+        self.parseTime = 0.0
+        self.pushTime = 0.0
+        self.flash = None
+        self.finished = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else 'failed: {}'.format(self.error)
+        return '<ProvisioningResult {} {} parse={:.3f}s push={:.3f}s {}>'.format(
+            self.serialNumber, os.path.basename(self.filename), self.parseTime, self.pushTime, status)
+
+
+def _prepareConfiguration(filename):
+    """
+    Loads and compiles a configuration file. Runs in a worker process, so the settings are returned as a
+    bundle, which is much cheaper to send back than the object graph.
+    """
+
+    start = time.perf_counter()
+    warnings = []
+    settings = ConfigurationFile.load(filename, warnings)
+    return SettingsBundle.dumps(settings), warnings, time.perf_counter() - start
+
+
+class FleetProvisioner:
+    """
+    Provisions many Maestros from Control Center configuration files. Files are loaded and compiled in a
+    process pool, matched to devices by serial number, and pushed to the devices from a bounded thread
+    pool as soon as each one is ready, so the total time approaches that of the slowest device.
+    """
+
+    def __init__(self, devices=None, maxDevices=8, processes=None):
+        """
+        :param devices: Usc objects or raw devices to provision. Defaults to every connected Maestro.
+        :param maxDevices: Number of devices written to concurrently.
+        :param processes: Size of the process pool used for loading and compiling. 0 loads in the calling
+                          process, None uses one process per CPU.
+        """
+
+        if devices is None:
+            devices = Usc.getConnectedDevices()
+
+        self.devices = {}
+
+        for device in devices:
+            usc = device if isinstance(device, Usc) else Usc(device)
+            self.devices[usc.serialNumber] = usc
+
+        self.maxDevices = maxDevices
+        self.processes = processes
+
+    @staticmethod
+    def findConfigurations(directory, extension='.xml'):
+        """
+        Maps serial numbers to configuration files named after them, e.g. 00012345.xml.
+        """
+
+        configurations = {}
+
+        for name in sorted(os.listdir(directory)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() == extension:
+                configurations[stem] = os.path.join(directory, name)
+
+        return configurations
+
+    def _push(self, result, usc, bundle):
+        start = time.perf_counter()
+
+        try:
+            settings = SettingsBundle.loads(bundle, verify=False)
+            result.warnings.extend(usc.fixSettings(settings))
+            result.flash = usc.setUscSettings(settings, newScript=settings.bytecodeProgram is not None)
+        except Exception as e:
+            result.error = e
+
+        result.pushTime = time.perf_counter() - start
+        return result
+
+    def provision(self, configurations):
+        """
+        Provisions every device that has a configuration and yields a ProvisioningResult for each
+        configuration as soon as it is finished.
+        :param configurations: A mapping of serial number to configuration file, or a directory of files
+                               named after serial numbers.
+        """
+
+        if not isinstance(configurations, dict):
+            configurations = self.findConfigurations(configurations)
+
+        results = queue.Queue()
+        pending = 0
+
+        parsePool = concurrent.futures.ProcessPoolExecutor(self.processes) if self.processes != 0 else None
+        pushPool = concurrent.futures.ThreadPoolExecutor(self.maxDevices)
+
+        def pushed(future):
+            results.put(future.result())
+
+        def parsed(result, usc, future):
+            try:
+                bundle, warnings, result.parseTime = future.result()
+            except Exception as e:
+                result.error = e
+                results.put(result)
+                return
+
+            result.warnings.extend(warnings)
+            pushPool.submit(self._push, result, usc, bundle).add_done_callback(pushed)
+
+        try:
+            for serialNumber, filename in configurations.items():
+                result = ProvisioningResult(serialNumber, filename)
+                pending += 1
+
+                usc = self.devices.get(serialNumber)
+
+                if usc is None:
+                    result.error = Exception('No connected device with serial number {}.'.format(serialNumber))
+                    results.put(result)
+                elif parsePool is None:
+                    future = concurrent.futures.Future()
+                    try:
+                        future.set_result(_prepareConfiguration(filename))
+                    except Exception as e:
+                        future.set_exception(e)
+                    parsed(result, usc, future)
+                else:
+                    parsePool.submit(_prepareConfiguration, filename).add_done_callback(
+                        lambda future, result=result, usc=usc: parsed(result, usc, future))
+
+            for _ in range(pending):
+                result = results.get()
+                result.finished = time.time()
+                yield result
+        finally:
+            if parsePool is not None:
+                parsePool.shutdown()
+            pushPool.shutdown()
+
+    def provisionAll(self, configurations):
+        """
+        Like provision, but waits for every device and returns the results as a list.
+        """
+
+        return list(self.provision(configurations))
@@ -0,0 +1,302 @@
+import json
+import os
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Columns that can be recorded, as ServoStatus attribute names.
+COLUMNS = ('position', 'target', 'speed', 'acceleration')
+
+INDEX_DTYPE = [('segment', '<u4'), ('count', '<u4'), ('start', '<f8'), ('end', '<f8')]
+
+FORMAT_VERSION = 1
+
+
+def _requireNumpy():
+    if numpy is None:
+        raise ImportError('The telemetry recorder requires numpy (pip install pymaestro[numpy]).')
+
+
+def encodeDeltaRle(column):
+    """
+    Encodes a (frames, channels) uint16 array channel by channel as differences between consecutive frames,
+    then run-length encodes the differences. Returns a (2, runs) int64 array of values and run lengths.
+    """
+
+    deltas = numpy.diff(column.T.astype(numpy.int32), axis=1, prepend=0).ravel()
+
+    if deltas.size == 0:
+        return numpy.zeros((2, 0), numpy.int64)
+
+    starts = numpy.concatenate(([0], numpy.flatnonzero(deltas[1:] != deltas[:-1]) + 1))
+    runs = numpy.diff(numpy.append(starts, deltas.size))
+    return numpy.stack((deltas[starts], runs)).astype(numpy.int64)
+
+
+def decodeDeltaRle(encoded, frames, channels):
+    deltas = numpy.repeat(encoded[0], encoded[1]).reshape(channels, frames)
+    return numpy.cumsum(deltas, axis=1).T.astype(numpy.uint16)
+
+
+class TelemetryRecorder:
+    """
+    Streams servo status frames to a directory of fixed-size segments. Each segment holds chunkFrames
+    frames as one memory-mapped .npy file per column plus a time column; only the segment being written is
+    mapped, so memory use does not grow with the length of the recording.
+
+    With compression='delta' every full segment is rewritten as per-channel frame differences, run-length
+    encoded, which shrinks slowly changing channels to a few runs. A small append-only index file records
+    the time span of each sealed segment for TelemetryRecording to search.
+
+    Layout:
+        meta.json
+        index.bin                       INDEX_DTYPE records, one per sealed segment
+        000000.time.npy                 float64 timestamps (seconds since the epoch)
+        000000.position.npy             uint16 (chunkFrames, servoCount), or when compressed:
+        000000.position.rle.npy         int64 (2, runs) of delta values and run lengths
+    """
+
+    def __init__(self, directory, servoCount, chunkFrames=4096, compression=None, columns=('position', 'target')):
+        """
+        :param directory: Directory to write to; created if needed. It must not contain a recording yet.
+        :param servoCount: Number of channels per frame.
+        :param chunkFrames: Frames per segment.
+        :param compression: None or 'delta'.
+        :param columns: ServoStatus attributes to record, a subset of COLUMNS.
+        """
+
+        _requireNumpy()
+
+        if compression not in (None, 'delta'):
+            raise Exception('Unknown compression {!r}.'.format(compression))
+
+        for column in columns:
+            if column not in COLUMNS:
+                raise Exception('Unknown column {!r}; choose from {}.'.format(column, ', '.join(COLUMNS)))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if os.path.exists(os.path.join(directory, 'meta.json')):
+            raise Exception('{} already contains a recording.'.format(directory))
+
+        self.directory = directory
+        self.servoCount = servoCount
+        self.chunkFrames = chunkFrames
+        self.compression = compression
+        self.columns = tuple(columns)
+        self.frames = 0
+        self.segments = 0
+
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'servoCount': servoCount, 'chunkFrames': chunkFrames,
+                       'compression': compression, 'columns': self.columns}, f, indent=2)
+
+        self._index = open(os.path.join(directory, 'index.bin'), 'ab')
+        self._times = None
+        self._data = None
+        self._count = 0
+
+    def _path(self, segment, name):
+        return os.path.join(self.directory, '{:06d}.{}.npy'.format(segment, name))
+
+    def _open(self):
+        openMemmap = numpy.lib.format.open_memmap
+
+        self._times = openMemmap(self._path(self.segments, 'time'), 'w+', numpy.float64, (self.chunkFrames,))
+        self._data = [openMemmap(self._path(self.segments, column), 'w+', numpy.uint16,
+                                 (self.chunkFrames, self.servoCount))
+                      for column in self.columns]
+        self._count = 0
+
+    def append(self, servos, timestamp=None):
+        """
+        Records one frame.
+        :param servos: List of ServoStatus, as returned by getVariables('servos').
+        :param timestamp: Seconds since the epoch; defaults to now.
+        """
+
+        if self._times is None:
+            self._open()
+
+        row = self._count
+        self._times[row] = time.time() if timestamp is None else timestamp
+
+        for column, data in zip(self.columns, self._data):
+            data[row] = [getattr(status, column) for status in servos]
+
+        self._count += 1
+        self.frames += 1
+
+        if self._count == self.chunkFrames:
+            self._seal()
+
+    def _seal(self):
+        count = self._count
+        segment = self.segments
+        start = float(self._times[0])
+        end = float(self._times[count - 1])
+
+        self._times.flush()
+
+        for column, data in zip(self.columns, self._data):
+            data.flush()
+
+            if self.compression == 'delta':
+                numpy.save(self._path(segment, column + '.rle'), encodeDeltaRle(data[:count]))
+
+        times, data = self._times, self._data
+        self._times = self._data = None
+        del times, data
+
+        if self.compression == 'delta':
+            for column in self.columns:
+                os.remove(self._path(segment, column))
+
+        self._index.write(numpy.array([(segment, count, start, end)], INDEX_DTYPE).tobytes())
+        self._index.flush()
+        self.segments += 1
+        self._count = 0
+
+    def record(self, usc, duration=None, rate=50.0, stop=None):
+        """
+        Polls usc.getVariables('servos') rate times per second and records every frame.
+        :param duration: Seconds to record, or None to run until stop is set.
+        :param stop: Optional threading.Event that ends the recording.
+        :return: Number of frames recorded.
+        """
+
+        interval = 1.0 / rate
+        deadline = None if duration is None else time.monotonic() + duration
+        nextPoll = time.monotonic()
+        frames = 0
+
+        while (stop is None or not stop.is_set()) and (deadline is None or time.monotonic() < deadline):
+            self.append(usc.getVariables('servos'))
+            frames += 1
+
+            nextPoll += interval
+            delay = nextPoll - time.monotonic()
+
+            if delay > 0:
+                if stop is not None:
+                    stop.wait(delay)
+                else:
+                    time.sleep(delay)
+            else:
+                nextPoll = time.monotonic()
+
+        return frames
+
+    def close(self):
+        """
+        Seals the partially filled segment and closes the index.
+        """
+
+        if self._times is not None and self._count:
+            self._seal()
+
+        self._times = self._data = None
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TelemetryRecording:
+    """
+    Read access to a directory written by TelemetryRecorder. Segments are located through the index and
+    memory-mapped (or decoded, if compressed) one at a time.
+    """
+
+    def __init__(self, directory):
+        _requireNumpy()
+
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+
+        if meta['version'] != FORMAT_VERSION:
+            raise Exception('Unsupported recording version {}.'.format(meta['version']))
+
+        self.directory = directory
+        self.servoCount = meta['servoCount']
+        self.chunkFrames = meta['chunkFrames']
+        self.compression = meta['compression']
+        self.columns = tuple(meta['columns'])
+
+        indexPath = os.path.join(directory, 'index.bin')
+
+        if os.path.getsize(indexPath):
+            self.index = numpy.memmap(indexPath, INDEX_DTYPE, 'r')
+        else:
+            self.index = numpy.zeros(0, INDEX_DTYPE)
+
+    def __len__(self):
+        return int(self.index['count'].sum())
+
+    @property
+    def start(self):
+        return float(self.index['start'][0]) if len(self.index) else None
+
+    @property
+    def end(self):
+        return float(self.index['end'][-1]) if len(self.index) else None
+
+    def _path(self, segment, name):
+        return os.path.join(self.directory, '{:06d}.{}.npy'.format(segment, name))
+
+    def _column(self, entry, column, rows):
+        segment, count = int(entry['segment']), int(entry['count'])
+
+        if self.compression == 'delta':
+            encoded = numpy.load(self._path(segment, column + '.rle'))
+            return decodeDeltaRle(encoded, count, self.servoCount)[rows]
+
+        return numpy.array(numpy.load(self._path(segment, column), mmap_mode='r')[:count][rows])
+
+    def iterSegments(self, start=None, end=None, columns=None):
+        """
+        Yields (times, {column: (frames, servoCount) array}) for each segment overlapping [start, end], trimmed
+        to that range. Only one segment is held in memory at a time.
+        """
+
+        columns = self.columns if columns is None else columns
+        first = 0 if start is None else int(numpy.searchsorted(self.index['end'], start, 'left'))
+        last = len(self.index) if end is None else int(numpy.searchsorted(self.index['start'], end, 'right'))
+
+        for entry in self.index[first:last]:
+            times = numpy.load(self._path(int(entry['segment']), 'time'), mmap_mode='r')[:int(entry['count'])]
+            low = 0 if start is None else int(numpy.searchsorted(times, start, 'left'))
+            high = len(times) if end is None else int(numpy.searchsorted(times, end, 'right'))
+
+            if low >= high:
+                continue
+
+            rows = slice(low, high)
+            yield numpy.array(times[rows]), dict((column, self._column(entry, column, rows)) for column in columns)
+
+    def read(self, start=None, end=None, columns=None):
+        """
+        Returns (times, {column: (frames, servoCount) array}) for all frames with start <= time <= end.
+        """
+
+        columns = self.columns if columns is None else columns
+        times = []
+        data = dict((column, []) for column in columns)
+
+        for segmentTimes, segmentData in self.iterSegments(start, end, columns):
+            times.append(segmentTimes)
+            for column in columns:
+                data[column].append(segmentData[column])
+
+        if not times:
+            return (numpy.zeros(0, numpy.float64),
+                    dict((column, numpy.zeros((0, self.servoCount), numpy.uint16)) for column in columns))
+
+        return numpy.concatenate(times), dict((column, numpy.concatenate(data[column])) for column in columns)
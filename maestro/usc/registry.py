@@ -0,0 +1,292 @@
+import threading
+import time
+
+from maestro.usc.main import Usc
+from maestro.usc.shadow import ShadowRegisters
+
+
+class DeviceRecord:
+    def __init__(self, serialNumber, usc, key):
+        self.serialNumber = serialNumber
+        self.usc = usc
+        self.key = key
+        self.connected = True
+        self.disconnectedAt = None
+        self.reconnects = 0
+        self.recoveryTimes = []
+        self.restoreTimes = []
+        self.snapshot = None
+
+    @property
+    def lastRecoveryTime(self):
+        return self.recoveryTimes[-1] if self.recoveryTimes else None
+
+
+class DeviceRegistry:
+    """
+    Tracks Maestros by serial number across disconnects. Each serial number keeps one Usc object for the
+    life of the registry; when the device comes back (for example after a brown-out) the new USB handle is
+    attached to the same Usc and the last-known speeds, accelerations and targets are written back from
+    the Usc's shadow registers, without a getUscSettings/setUscSettings cycle.
+
+    Changes are picked up by incremental rescans: only devices at a bus address not seen before are opened
+    to read their serial number. If python-libusb1 is installed and libusb supports hotplug, rescans run
+    as soon as a Maestro is plugged in or removed instead of every interval.
+
+    Each reconnect records a recovery time, from the moment the disconnect was noticed to the end of the
+    restore, and a restore time, from the moment the device was seen again to the end of the restore.
+    """
+
+    def __init__(self, finder=None, interval=0.5, hotplug=True, onConnect=None, onDisconnect=None,
+                 onReconnect=None):
+        """
+        :param finder: Function returning the current list of device handles; defaults to
+                       Usc.getConnectedDevices.
+        :param interval: Seconds between rescans in the background thread.
+        :param hotplug: Use libusb hotplug notifications when available.
+        :param onConnect: Called with the DeviceRecord of a new serial number.
+        :param onDisconnect: Called with the DeviceRecord of a device that went away.
+        :param onReconnect: Called with the DeviceRecord once a device has been restored.
+        """
+
+        self.finder = finder or Usc.getConnectedDevices
+        self.interval = interval
+        self.hotplug = hotplug
+        self.onConnect = onConnect
+        self.onDisconnect = onDisconnect
+        self.onReconnect = onReconnect
+        self.records = {}
+        self.scans = 0
+        self.errors = 0
+        self.lastError = None
+
+        self._keys = {}
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._context = None
+        self._hotplugThread = None
+        self._scanInterval = interval
+
+    @staticmethod
+    def deviceKey(device):
+        # The bus address identifies an enumeration of a device without any transfer.
+        bus = getattr(device, 'bus', None)
+        address = getattr(device, 'address', None)
+
+        if bus is None or address is None:
+            return id(device)
+
+        return bus, address
+
+    def __getitem__(self, serialNumber):
+        return self.records[serialNumber].usc
+
+    def __contains__(self, serialNumber):
+        return serialNumber in self.records
+
+    def connected(self):
+        with self._lock:
+            return sorted(serial for serial, record in self.records.items() if record.connected)
+
+    def scan(self):
+        """
+        Rescans the bus once and attaches, detaches and restores devices as needed.
+        :return: (connected, disconnected) lists of serial numbers.
+        """
+
+        with self._lock:
+            self.scans += 1
+            # Other Pololu products share the vendor ID; opening them would fail on every scan.
+            devices = dict((self.deviceKey(device), device) for device in self.finder()
+                           if getattr(device, 'idProduct', None) in Usc.productIDArray)
+            added = []
+            removed = []
+
+            for key in list(self._keys):
+                if key not in devices:
+                    record = self.records[self._keys.pop(key)]
+                    self._detach(record)
+                    removed.append(record.serialNumber)
+
+            for key, device in devices.items():
+                if key in self._keys:
+                    continue
+
+                # A key is only registered once its device has been opened or restored, so a device that
+                # fails (likely just after a brown-out) is retried by the next scan. Others are unaffected.
+                try:
+                    serialNumber = self._attach(key, device)
+                except Exception as e:
+                    self.errors += 1
+                    self.lastError = e
+                    continue
+
+                added.append(serialNumber)
+
+            return added, removed
+
+    def _attach(self, key, device):
+        serialNumber = device.serial_number
+        record = self.records.get(serialNumber)
+
+        if record is None:
+            record = DeviceRecord(serialNumber, Usc(device, shadow=True), key)
+            self.records[serialNumber] = record
+            self._keys[key] = serialNumber
+
+            if self.onConnect is not None:
+                self.onConnect(record)
+        else:
+            if record.connected:
+                # Re-enumerated between two scans without being seen missing.
+                self._keys.pop(record.key, None)
+                self._detach(record)
+
+            self._restore(record, device, key)
+            self._keys[key] = serialNumber
+
+        return serialNumber
+
+    def _detach(self, record):
+        record.connected = False
+        record.disconnectedAt = time.perf_counter()
+        shadow = record.usc.shadow
+
+        if shadow is not None and not shadow.scriptActive:
+            record.snapshot = [list(values) for values in shadow.values]
+        else:
+            record.snapshot = None
+
+        if self.onDisconnect is not None:
+            self.onDisconnect(record)
+
+    def _restore(self, record, device, key):
+        start = time.perf_counter()
+        usc = record.usc
+
+        if usc.dev is not device:
+            self._dispose(usc.dev)
+
+        usc.reattach(device)
+
+        if record.snapshot is not None:
+            # Limits first so that the targets move with them.
+            for kind, write in ((ShadowRegisters.SPEED, usc._writeSpeed),
+                                (ShadowRegisters.ACCELERATION, usc._writeAcceleration),
+                                (ShadowRegisters.TARGET, usc._writeTarget)):
+                for servo, value in enumerate(record.snapshot[kind]):
+                    if value is not None:
+                        write(servo, value)
+
+        if usc.shadow is not None:
+            usc.seedShadow()
+
+        if usc.predictor is not None:
+            usc.predictor.invalidate()
+
+        record.key = key
+        record.connected = True
+        record.reconnects += 1
+        end = time.perf_counter()
+        record.recoveryTimes.append(end - record.disconnectedAt)
+        record.restoreTimes.append(end - start)
+
+        if self.onReconnect is not None:
+            self.onReconnect(record)
+
+    @staticmethod
+    def _dispose(device):
+        # Frees the libusb handle pyusb keeps open for a device that went away. Other handles, such as a
+        # VirtualMaestro, have nothing to free.
+        try:
+            import usb.core
+            import usb.util
+        except ImportError:
+            return
+
+        if isinstance(device, usb.core.Device):
+            try:
+                usb.util.dispose_resources(device)
+            except Exception:
+                pass
+
+    def _startHotplug(self):
+        try:
+            import usb1
+        except ImportError:
+            return False
+
+        context = usb1.USBContext()
+
+        if not context.hasCapability(usb1.CAP_HAS_HOTPLUG):
+            context.close()
+            return False
+
+        def callback(context, device, event):
+            self._wake.set()
+            return False
+
+        context.hotplugRegisterCallback(callback, vendor_id=Usc.vendorID)
+        self._context = context
+        self._hotplugThread = threading.Thread(target=self._runHotplug, name='maestro-hotplug', daemon=True)
+        self._hotplugThread.start()
+        return True
+
+    def _runHotplug(self):
+        while not self._stop.is_set():
+            self._context.handleEventsTimeout(tv=self.interval)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception as e:
+                self.lastError = e
+
+            self._wake.wait(self._scanInterval)
+            self._wake.clear()
+
+    def start(self):
+        """
+        Scans once, then keeps the registry up to date from a background thread.
+        """
+
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._scanInterval = self.interval
+
+        if self.hotplug and self._startHotplug():
+            # Hotplug events trigger scans; the interval only bounds how stale a missed event can be.
+            self._scanInterval = max(self.interval, 5.0)
+
+        self.scan()
+        self._thread = threading.Thread(target=self._run, name='maestro-registry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._hotplugThread is not None:
+            self._hotplugThread.join()
+            self._hotplugThread = None
+
+        if self._context is not None:
+            self._context.close()
+            self._context = None
+
+    def recoveryTimes(self):
+        """
+        Returns serial number -> list of recovery times in seconds.
+        """
+
+        with self._lock:
+            return dict((serial, list(record.recoveryTimes)) for serial, record in self.records.items())
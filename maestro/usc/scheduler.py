@@ -0,0 +1,211 @@
+import collections
+import functools
+import threading
+import time
+
+
+class RequestScheduler:
+    """
+    Serialises USB transfers to one device between threads and hands the bus to the highest priority lane
+    first. Each transfer is scheduled on its own, so an operation made of many transfers (getUscSettings,
+    loadProgram) gives way to more urgent requests between any two of them. Requests in the same lane are
+    served in arrival order.
+
+    So that a busy control loop cannot starve telemetry and configuration forever, a request that has waited
+    longer than agingLimit competes as if it were in the control lane, oldest first. Nothing is ever
+    promoted above the emergency lane.
+
+    The lane of a transfer is that of the outermost public Usc method running in the calling thread.
+    Configuration operations additionally exclude each other, so two of them never interleave.
+    """
+
+    EMERGENCY = 0
+    CONTROL = 1
+    TELEMETRY = 2
+    CONFIGURATION = 3
+
+    laneNames = ('emergency', 'control', 'telemetry', 'configuration')
+
+    def __init__(self, agingLimit=0.1):
+        """
+        :param agingLimit: Seconds after which a waiting request competes at control priority, or None to
+                           never promote requests.
+        """
+
+        self.agingLimit = agingLimit
+        self._condition = threading.Condition()
+        self._busy = False
+        self._queues = [collections.deque() for _ in self.laneNames]
+        self._local = threading.local()
+        self._configuration = threading.RLock()
+
+        self.requests = [0] * len(self.laneNames)
+        self.maxDepth = [0] * len(self.laneNames)
+        self.totalWait = [0.0] * len(self.laneNames)
+        self.maxWait = [0.0] * len(self.laneNames)
+
+    def currentLane(self):
+        lane = getattr(self._local, 'lane', None)
+        return self.CONTROL if lane is None else lane
+
+    def lane(self, lane):
+        """
+        Context manager running the calling thread's transfers in the given lane. Nested calls keep the lane
+        of the outermost one.
+        """
+
+        return _LaneContext(self, lane)
+
+    def run(self, function, *args):
+        """
+        Calls function(*args) once the bus is granted to the current lane.
+        """
+
+        lane = self.currentLane()
+        self._acquire(lane)
+
+        try:
+            return function(*args)
+        finally:
+            self._release()
+
+    def _acquire(self, lane):
+        start = time.perf_counter()
+
+        with self._condition:
+            queue = self._queues[lane]
+            ticket = object()
+            queue.append((start, ticket))
+            self.maxDepth[lane] = max(self.maxDepth[lane], len(queue))
+
+            while True:
+                now = time.perf_counter()
+
+                if not self._busy and self._nextLane(now) == lane and queue[0][1] is ticket:
+                    break
+
+                # Aging changes the winning lane with time alone, without a release to notify anyone, so
+                # wake up again by the next promotion as of the same instant.
+                self._condition.wait(self._nextPromotion(now))
+
+            self._busy = True
+            queue.popleft()
+
+            wait = time.perf_counter() - start
+            self.requests[lane] += 1
+            self.totalWait[lane] += wait
+            self.maxWait[lane] = max(self.maxWait[lane], wait)
+
+    def _nextLane(self, now):
+        # Lane whose oldest request goes next: by priority, with aged requests ranked as control.
+        best = None
+        bestKey = None
+
+        for lane, queue in enumerate(self._queues):
+            if not queue:
+                continue
+
+            start = queue[0][0]
+            rank = lane
+
+            if self.agingLimit is not None and lane > self.CONTROL and now - start > self.agingLimit:
+                rank = self.CONTROL
+
+            if bestKey is None or (rank, start) < bestKey:
+                best = lane
+                bestKey = (rank, start)
+
+        return best
+
+    def _nextPromotion(self, now):
+        # Seconds after now until the oldest request of some lane below control gets promoted, or None.
+        if self.agingLimit is None:
+            return None
+
+        remaining = [queue[0][0] + self.agingLimit - now for lane, queue in enumerate(self._queues)
+                     if lane > self.CONTROL and queue and now - queue[0][0] <= self.agingLimit]
+
+        return min(remaining) + 1e-6 if remaining else None
+
+    def _release(self):
+        with self._condition:
+            self._busy = False
+            self._condition.notify_all()
+
+    def metrics(self):
+        """
+        Returns lane name -> {requests, depth, maxDepth, meanWait, maxWait}. Waits are in seconds.
+        """
+
+        with self._condition:
+            return dict((name, {'requests': self.requests[i],
+                                'depth': len(self._queues[i]),
+                                'maxDepth': self.maxDepth[i],
+                                'meanWait': self.totalWait[i] / self.requests[i] if self.requests[i] else 0.0,
+                                'maxWait': self.maxWait[i]})
+                        for i, name in enumerate(self.laneNames))
+
+    def resetMetrics(self):
+        with self._condition:
+            for i in range(len(self.laneNames)):
+                self.requests[i] = 0
+                self.maxDepth[i] = 0
+                self.totalWait[i] = 0.0
+                self.maxWait[i] = 0.0
+
+
+class _LaneContext:
+    def __init__(self, scheduler, lane):
+        self.scheduler = scheduler
+        self.lane = lane
+        self.outer = False
+
+    def __enter__(self):
+        local = self.scheduler._local
+        self.outer = getattr(local, 'lane', None) is None
+
+        if self.outer:
+            local.lane = self.lane
+
+        if local.lane == RequestScheduler.CONFIGURATION:
+            self.scheduler._configuration.acquire()
+
+    def __exit__(self, *args):
+        local = self.scheduler._local
+
+        if local.lane == RequestScheduler.CONFIGURATION:
+            self.scheduler._configuration.release()
+
+        if self.outer:
+            local.lane = None
+
+
+def lane(priority):
+    """
+    Decorator running a Usc method's transfers in the given RequestScheduler lane, traced as a span when the
+    Usc has a tracer.
+    """
+
+    def decorate(method):
+        name = method.__name__
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            tracer = self.tracer
+
+            if tracer is None:
+                with self.scheduler.lane(priority):
+                    return method(self, *args, **kwargs)
+
+            details = {'serial': self.serialNumber}
+
+            # The span includes waiting to enter the lane; the lane recorded is the one that applies, which
+            # for a nested call is that of the outermost method.
+            with tracer.span(name, 'usc', details):
+                with self.scheduler.lane(priority):
+                    details['lane'] = RequestScheduler.laneNames[self.scheduler.currentLane()]
+                    return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,219 @@
+from maestro.usc.protocol import uscParameter
+
+# Instructions are executed at 12 MHZ.
+INSTRUCTION_FREQUENCY = 12000000
+
+# The number of parameter bytes per servo.
+SERVO_PARAMETER_STRIDE = 9
+
+# The largest number of channels on any Maestro.
+MAX_SERVO_COUNT = 24
+
+
+def exponentialSpeedToNormalSpeed(exponentialSpeed):
+    mantissa = exponentialSpeed >> 3
+    exponent = exponentialSpeed & 7
+    return mantissa * (1 << exponent)
+
+
+def normalSpeedToExponentialSpeed(normalSpeed):
+    mantissa = normalSpeed
+    exponent = 0
+
+    while True:
+        if mantissa < 32:
+            return exponent + (mantissa << 3)
+
+        if exponent == 7:
+            return 0xFF
+
+        exponent += 1
+        mantissa >>= 1
+
+
+def spbrgToBps(spbrg):
+    if spbrg == 0:
+        return 0
+    else:
+        return int((INSTRUCTION_FREQUENCY + (spbrg + 1) / 2) / (spbrg + 1))
+
+
+def bpsToSpbrg(bps):
+    if bps == 0:
+        return 0
+    else:
+        return int((INSTRUCTION_FREQUENCY - bps / 2) / bps)
+
+
+class Range:
+    def __init__(self, numBytes, minimumValue, maximumValue):
+        self.bytes = numBytes
+        self.minimumValue = minimumValue
+        self.maximumValue = maximumValue
+
+    def signed(self):
+        return self.minimumValue < 0
+
+    @staticmethod
+    def u16():
+        return Range(2, 0, 0xFFFF)
+
+    @staticmethod
+    def u12():
+        return Range(2, 0, 0x0FFF)
+
+    @staticmethod
+    def u10():
+        return Range(2, 0, 0x03FF)
+
+    @staticmethod
+    def u8():
+        return Range(1, 0, 0xFF)
+
+    @staticmethod
+    def u7():
+        return Range(1, 0, 0x7F)
+
+    @staticmethod
+    def boolean():
+        return Range(1, 0, 1)
+
+
+class ParameterSpec(Range):
+    """
+    Describes how a device parameter is stored (width and raw bounds) and how raw values map to the
+    units used by UscSettings and ChannelSetting.
+    """
+
+    LINEAR = 'linear'
+    BOOLEAN = 'boolean'
+    EXPONENTIAL_SPEED = 'exponentialSpeed'
+    BAUD_RATE = 'baudRate'
+
+    def __init__(self, numBytes, minimumValue, maximumValue, scale=1, encoding=LINEAR, stride=0):
+        """
+        :param numBytes: Width of the parameter on the device.
+        :param minimumValue: Smallest raw value accepted by the device.
+        :param maximumValue: Largest raw value accepted by the device.
+        :param scale: Setting units per raw unit for linear parameters.
+        :param encoding: One of LINEAR, BOOLEAN, EXPONENTIAL_SPEED or BAUD_RATE.
+        :param stride: Distance between the parameter ids of consecutive channels, 0 for device parameters.
+        """
+
+        Range.__init__(self, numBytes, minimumValue, maximumValue)
+        self.scale = scale
+        self.encoding = encoding
+        self.stride = stride
+
+        # Bounds in setting units, i.e. the values encode() accepts.
+        if encoding == self.EXPONENTIAL_SPEED:
+            self.minimumSetting, self.maximumSetting = 0, 0xFFFF
+        elif encoding == self.BAUD_RATE:
+            self.minimumSetting, self.maximumSetting = 0, INSTRUCTION_FREQUENCY
+        else:
+            self.minimumSetting = minimumValue * scale
+            self.maximumSetting = maximumValue * scale + scale - 1
+
+    def check(self, value, parameter):
+        if value < self.minimumValue or value > self.maximumValue:
+            raise Exception('The {} must be between {} and {} but the value given was {}.'
+                            .format(parameter, self.minimumValue, self.maximumValue, value))
+
+    def encode(self, value):
+        """
+        Converts a setting value to the raw value stored on the device.
+        """
+
+        if self.encoding == self.EXPONENTIAL_SPEED:
+            return normalSpeedToExponentialSpeed(value)
+        elif self.encoding == self.BAUD_RATE:
+            return bpsToSpbrg(value)
+        elif self.encoding == self.BOOLEAN:
+            return int(bool(value))
+        elif self.scale == 1:
+            return int(value)
+        else:
+            return int(value / self.scale)
+
+    def decode(self, raw):
+        """
+        Converts a raw device value to setting units.
+        """
+
+        if self.encoding == self.EXPONENTIAL_SPEED:
+            return exponentialSpeedToNormalSpeed(raw)
+        elif self.encoding == self.BAUD_RATE:
+            return spbrgToBps(raw)
+        elif self.encoding == self.BOOLEAN:
+            return raw != 0
+        else:
+            return raw * self.scale
+
+
+_u8 = ParameterSpec(1, 0, 0xFF)
+_u16 = ParameterSpec(2, 0, 0xFFFF)
+_boolean = ParameterSpec(1, 0, 1, encoding=ParameterSpec.BOOLEAN)
+
+DEVICE_PARAMETERS = {
+    uscParameter.PARAMETER_INITIALIZED: _u8,
+    uscParameter.PARAMETER_SERVOS_AVAILABLE: _u8,
+    uscParameter.PARAMETER_SERVO_PERIOD: _u8,
+    uscParameter.PARAMETER_SERIAL_MODE: ParameterSpec(1, 0, 3),
+    uscParameter.PARAMETER_SERIAL_FIXED_BAUD_RATE: ParameterSpec(2, 0, 0xFFFF, encoding=ParameterSpec.BAUD_RATE),
+    uscParameter.PARAMETER_SERIAL_TIMEOUT: _u16,
+    uscParameter.PARAMETER_SERIAL_ENABLE_CRC: _boolean,
+    uscParameter.PARAMETER_SERIAL_NEVER_SUSPEND: _boolean,
+    uscParameter.PARAMETER_SERIAL_DEVICE_NUMBER: ParameterSpec(1, 0, 0x7F),
+    uscParameter.PARAMETER_SERIAL_BAUD_DETECT_TYPE: ParameterSpec(1, 0, 1),
+    uscParameter.PARAMETER_CHANNEL_MODES_0_3: _u8,
+    uscParameter.PARAMETER_CHANNEL_MODES_4_7: _u8,
+    uscParameter.PARAMETER_CHANNEL_MODES_8_11: _u8,
+    uscParameter.PARAMETER_CHANNEL_MODES_12_15: _u8,
+    uscParameter.PARAMETER_CHANNEL_MODES_16_19: _u8,
+    uscParameter.PARAMETER_CHANNEL_MODES_20_23: _u8,
+    uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_L: _u8,
+    uscParameter.PARAMETER_MINI_MAESTRO_SERVO_PERIOD_HU: _u16,
+    uscParameter.PARAMETER_ENABLE_PULLUPS: _boolean,
+    uscParameter.PARAMETER_SCRIPT_CRC: _u16,
+    uscParameter.PARAMETER_SCRIPT_DONE: _boolean,
+    uscParameter.PARAMETER_SERIAL_MINI_SSC_OFFSET: ParameterSpec(1, 0, 254),
+    uscParameter.PARAMETER_SERVO_MULTIPLIER: _u8,
+}
+
+SERVO_PARAMETERS = {
+    uscParameter.PARAMETER_SERVO0_HOME: ParameterSpec(2, 0, 32440, stride=SERVO_PARAMETER_STRIDE),
+    uscParameter.PARAMETER_SERVO0_MIN: ParameterSpec(1, 0, 0xFF, scale=64, stride=SERVO_PARAMETER_STRIDE),
+    uscParameter.PARAMETER_SERVO0_MAX: ParameterSpec(1, 0, 0xFF, scale=64, stride=SERVO_PARAMETER_STRIDE),
+    uscParameter.PARAMETER_SERVO0_NEUTRAL: ParameterSpec(2, 0, 32440, stride=SERVO_PARAMETER_STRIDE),
+    uscParameter.PARAMETER_SERVO0_RANGE: ParameterSpec(1, 1, 50, scale=127, stride=SERVO_PARAMETER_STRIDE),
+    uscParameter.PARAMETER_SERVO0_SPEED: ParameterSpec(1, 0, 0xFF, encoding=ParameterSpec.EXPONENTIAL_SPEED,
+                                                       stride=SERVO_PARAMETER_STRIDE),
+    uscParameter.PARAMETER_SERVO0_ACCELERATION: ParameterSpec(1, 0, 0xFF, stride=SERVO_PARAMETER_STRIDE),
+}
+
+
+def _buildParameterTable():
+    table = [None] * 256
+
+    for parameter, spec in DEVICE_PARAMETERS.items():
+        table[parameter] = spec
+
+    for parameter, spec in SERVO_PARAMETERS.items():
+        for servo in range(MAX_SERVO_COUNT):
+            table[parameter + servo * spec.stride] = spec
+
+    return tuple(table)
+
+
+# Parameter id -> ParameterSpec, or None for ids that are not the start of a parameter.
+PARAMETER_TABLE = _buildParameterTable()
+
+
+def getParameterSpec(parameterId):
+    spec = PARAMETER_TABLE[parameterId] if 0 <= parameterId < len(PARAMETER_TABLE) else None
+
+    if spec is None:
+        raise Exception('Invalid parameterId {}, can not determine the range of this parameter.'
+                        .format(int(parameterId)))
+
+    return spec
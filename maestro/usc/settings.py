@@ -21,6 +21,10 @@ class UscSettings:
         self.scriptInconsistent = False
         self.script = None
         self.bytecodeProgram = None
+        # Control Center sequences: (name, [(frame name, duration in ms, [targets])]).
+        self.sequences = []
+        # The FileLayout of the settings file these were loaded from, if any.
+        self.fileLayout = None
 
     def __len__(self):
         return len(self.channelSettings)
@@ -32,6 +36,15 @@ class UscSettings:
         self.script = script
 
 
+# Settings that Usc.fixSettings forces for channels in the given modes.
+MODE_DEFAULTS = {
+    ChannelMode.Input: (('homeMode', HomeMode.Ignore), ('minimum', 0), ('maximum', 1024), ('speed', 0),
+                        ('acceleration', 0), ('neutral', 1024), ('range', 1905)),
+    ChannelMode.Output: (('minimum', 3986), ('maximum', 8000), ('speed', 0), ('acceleration', 0),
+                         ('neutral', 6000), ('range', 1905)),
+}
+
+
 class ChannelSetting:
     def __init__(self):
         self.name = ''
@@ -0,0 +1,126 @@
+import threading
+import time
+
+
+class ShadowRegisters:
+    """
+    Host-side copy of the last target, speed and acceleration written to each channel. It is used to skip
+    writes that would not change anything and to answer getters without a transfer.
+
+    Entries are cleared whenever the device may have changed them on its own: after a reinitialize or
+    configuration reset, and while a script is running, and for a single value when writing it failed.
+    All methods may be called from several threads.
+    """
+
+    SPEED = 0
+    ACCELERATION = 1
+    TARGET = 2
+
+    def __init__(self, servoCount, maxAge=None, deadband=0):
+        """
+        :param servoCount: Number of channels.
+        :param maxAge: Seconds an entry is considered fresh for getters, or None for no limit.
+        :param deadband: Target changes smaller than or equal to this (quarter-microseconds) are not written.
+                         Use setDeadband for per-channel values.
+        """
+
+        self.servoCount = servoCount
+        self.maxAge = maxAge
+        self.deadbands = [deadband] * servoCount
+        self.scriptActive = False
+        self.skipped = 0
+        self.written = 0
+        self._lock = threading.RLock()
+        self.invalidate()
+
+    def invalidate(self, channel=None, kind=None):
+        """
+        Forgets every value, those of one channel, or a single (channel, kind) value.
+        """
+
+        with self._lock:
+            if channel is None:
+                self.values = [[None] * self.servoCount for _ in range(3)]
+                self.stamps = [[0.0] * self.servoCount for _ in range(3)]
+            elif 0 <= channel < self.servoCount:
+                for k in range(3) if kind is None else (kind,):
+                    self.values[k][channel] = None
+
+    def setDeadband(self, channel, deadband):
+        self.deadbands[channel] = deadband
+
+    def seed(self, servos, scriptDone=True):
+        """
+        Fills the shadow from a list of ServoStatus read from the device.
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            self.scriptActive = not scriptDone
+
+            for channel, status in enumerate(servos):
+                self.values[self.TARGET][channel] = status.target
+                self.values[self.SPEED][channel] = status.speed
+                self.values[self.ACCELERATION][channel] = status.acceleration
+
+                for kind in range(3):
+                    self.stamps[kind][channel] = now
+
+    def update(self, kind, channel, value):
+        """
+        Records a write and returns whether it needs to be sent to the device. If sending it then fails, the
+        caller must invalidate the value, or an identical retry would be skipped.
+        """
+
+        with self._lock:
+            if self.scriptActive or not 0 <= channel < self.servoCount:
+                self.written += 1
+                return True
+
+            current = self.values[kind][channel]
+
+            if current is not None:
+                if kind == self.TARGET:
+                    unchanged = abs(value - current) <= self.deadbands[channel]
+                else:
+                    unchanged = value == current
+
+                if unchanged:
+                    self.skipped += 1
+                    return False
+
+            self.values[kind][channel] = value
+            self.stamps[kind][channel] = time.monotonic()
+            self.written += 1
+            return True
+
+    def get(self, kind, channel):
+        """
+        Returns the shadowed value, or None if it is unknown or stale.
+        """
+
+        with self._lock:
+            if self.scriptActive:
+                return None
+
+            value = self.values[kind][channel]
+
+            if value is None:
+                return None
+
+            if self.maxAge is not None and time.monotonic() - self.stamps[kind][channel] > self.maxAge:
+                return None
+
+            return value
+
+    def scriptStarted(self):
+        with self._lock:
+            self.scriptActive = True
+            self.invalidate()
+
+    def scriptStopped(self):
+        # The script may have moved any channel while it ran.
+        with self._lock:
+            self.scriptActive = False
+            self.invalidate()
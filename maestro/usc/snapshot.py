@@ -0,0 +1,136 @@
+import array
+import struct
+import sys
+import time
+
+from maestro.usc.protocol import uscRequest, MicroMaestroVariables, MiniMaestroVariables, ServoStatus
+
+_littleEndian = sys.byteorder == 'little'
+
+
+class DeviceSnapshot:
+    """
+    The complete runtime state of a Maestro, captured by Usc.snapshot into receive buffers owned by the
+    snapshot object, so that sampling at a high rate does not allocate per transfer. pyusb only reads into
+    array.array buffers of exactly the requested length, so the trimmed stack reads keep one buffer per
+    length seen.
+
+    stack (int16) and callStack (uint16) are trimmed to the live stackPointer/callStackPointer. On a little
+    endian host they are zero-copy memoryviews over the receive buffers and are overwritten by the next
+    capture; copy them (list(snapshot.stack)) to keep them.
+    """
+
+    def __init__(self, usc):
+        self.microMaestro = usc.microMaestro
+        self.servoCount = usc.servoCount
+        self.timestamp = None
+        self.elapsed = 0.0
+        self.transfers = 0
+
+        self.stackPointer = 0
+        self.callStackPointer = 0
+        self.errors = 0
+        self.programCounter = 0
+        self.scriptDone = 1
+        self.performanceFlags = 0
+
+        self.positions = [0] * self.servoCount
+        self.targets = [0] * self.servoCount
+        self.speeds = [0] * self.servoCount
+        self.accelerations = [0] * self.servoCount
+
+        self.stack = ()
+        self.callStack = ()
+
+        servoBytes = self.servoCount * ServoStatus.struct.size
+
+        if self.microMaestro:
+            self._variables = array.array('B', bytes(MicroMaestroVariables.struct.size + servoBytes))
+            view = memoryview(self._variables)
+            self._servos = view[MicroMaestroVariables.struct.size:]
+            self._stack = view[12:12 + 2 * usc.MicroMaestroStackSize]
+            self._callStack = view[76:76 + 2 * usc.MicroMaestroCallStackSize]
+        else:
+            self._variables = array.array('B', bytes(MiniMaestroVariables.struct.size))
+            self._servos = array.array('B', bytes(servoBytes))
+            self._stack = self._callStack = None
+
+        self._stackBuffers = {}
+        self._callStackBuffers = {}
+
+    @staticmethod
+    def _buffer(buffers, length):
+        buffer = buffers.get(length)
+
+        if buffer is None:
+            buffer = buffers[length] = array.array('B', bytes(length))
+
+        return buffer
+
+    def capture(self, usc, servos=True, stack=True, callStack=True):
+        """
+        Reads the device state. The Micro Maestro returns everything in one transfer; the Mini Maestro needs
+        one for the variables and one each for the servos and the (trimmed, non-empty) stacks.
+        """
+
+        self.timestamp = time.time()
+        start = time.perf_counter()
+        transfers = 1
+
+        if self.microMaestro:
+            usc._readInto(uscRequest.REQUEST_GET_VARIABLES, self._variables)
+            (self.stackPointer, self.callStackPointer, self.errors,
+             self.programCounter) = struct.unpack_from('<BBHH', self._variables)
+            self.scriptDone = self._variables[96]
+            self.performanceFlags = 0
+        else:
+            usc._readInto(uscRequest.REQUEST_GET_VARIABLES, self._variables)
+            (self.stackPointer, self.callStackPointer, self.errors, self.programCounter, self.scriptDone,
+             self.performanceFlags) = MiniMaestroVariables.struct.unpack_from(self._variables)
+
+            if servos:
+                usc._readInto(uscRequest.REQUEST_GET_SERVO_SETTINGS, self._servos)
+                transfers += 1
+
+            if stack:
+                self._stack = self._buffer(self._stackBuffers, 2 * self.stackPointer)
+
+                if self.stackPointer:
+                    usc._readInto(uscRequest.REQUEST_GET_STACK, self._stack)
+                    transfers += 1
+
+            if callStack:
+                self._callStack = self._buffer(self._callStackBuffers, 2 * self.callStackPointer)
+
+                if self.callStackPointer:
+                    usc._readInto(uscRequest.REQUEST_GET_CALL_STACK, self._callStack)
+                    transfers += 1
+
+        if servos:
+            for i, status in enumerate(ServoStatus.struct.iter_unpack(self._servos)):
+                self.positions[i], self.targets[i], self.speeds[i], self.accelerations[i] = status
+
+        if stack:
+            self.stack = self._decode(self._stack, 'h', self.stackPointer)
+
+        if callStack:
+            self.callStack = self._decode(self._callStack, 'H', self.callStackPointer)
+
+        self.transfers = transfers
+        self.elapsed = time.perf_counter() - start
+        return self
+
+    @staticmethod
+    def _decode(buffer, code, count):
+        if _littleEndian:
+            return memoryview(buffer)[:2 * count].cast(code)
+
+        return struct.unpack_from('<%d%s' % (count, code), buffer)
+
+    def servos(self):
+        """
+        Returns the servo state as a list of ServoStatus, like getVariables('servos').
+        """
+
+        return [ServoStatus(bytes(self._servos[i * ServoStatus.struct.size:(i + 1) * ServoStatus.struct.size]))
+                for i in range(self.servoCount)]
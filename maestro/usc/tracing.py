@@ -0,0 +1,173 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from maestro.usc.protocol import uscRequest
+
+_threadId = getattr(threading, 'get_native_id', threading.get_ident)
+
+_requestNames = dict((int(request), request.name[len('REQUEST_'):].lower()) for request in uscRequest)
+
+
+class _Span:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, traceback):
+        if excType is not None:
+            self.args = dict(self.args or (), error=excType.__name__)
+
+        self.tracer.record(self.name, self.category, self.start, time.perf_counter(), self.args)
+
+
+class Tracer:
+    """
+    Records timed spans in a bounded in-memory buffer, for export as a Chrome/Perfetto trace
+    (chrome://tracing or ui.perfetto.dev). Usc.enableTracing attaches one to a device: every public Usc
+    method and every control transfer beneath it becomes a span on the calling thread, and transfers show
+    how long they waited for the bus. Application code can add its own spans (a control tick, say) with
+    span(). When the buffer is full the oldest spans are dropped.
+
+    One Tracer can be shared by several Usc objects and threads.
+    """
+
+    # Bus waits shorter than this, in seconds, are only noted in the transfer's args instead of as a span.
+    minWait = 20e-6
+
+    def __init__(self, capacity=65536):
+        """
+        :param capacity: Most spans kept.
+        """
+
+        self.capacity = capacity
+        self.recorded = 0
+        self._events = collections.deque(maxlen=capacity)
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._epoch = time.perf_counter()
+
+    @property
+    def dropped(self):
+        return max(0, self.recorded - len(self._events))
+
+    def span(self, name, category='app', args=None):
+        """
+        Context manager timing its body as a span on the current thread.
+        """
+
+        return _Span(self, name, category, args)
+
+    def record(self, name, category, start, end, args=None):
+        """
+        Adds a finished span. start and end are time.perf_counter() values.
+        """
+
+        tid = _threadId()
+
+        with self._lock:
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+
+            self._events.append((name, category, start, end, tid, args))
+            self.recorded += 1
+
+    def transfer(self, scheduler, function, args):
+        """
+        Runs function(*args) through the scheduler as a traced control transfer.
+        """
+
+        start = time.perf_counter()
+        granted = []
+
+        def call(*args):
+            granted.append(time.perf_counter())
+            return function(*args)
+
+        lane = scheduler.currentLane()
+        error = None
+
+        try:
+            return scheduler.run(call, *args)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            details = {'request': _requestNames.get(args[1], args[1]), 'value': args[2], 'index': args[3],
+                       'lane': scheduler.laneNames[lane]}
+
+            if granted:
+                details['wait_us'] = round((granted[0] - start) * 1e6, 1)
+
+                if granted[0] - start >= self.minWait:
+                    self.record('bus wait', 'scheduler', start, granted[0])
+
+            if error is not None:
+                details['error'] = error
+
+            self.record('transfer', 'usb', start, end, details)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self.recorded = 0
+
+    def events(self):
+        """
+        Returns the spans as Chrome trace event dicts, oldest first, plus thread name metadata.
+        """
+
+        pid = os.getpid()
+
+        with self._lock:
+            # Parents before their children.
+            spans = sorted(self._events, key=lambda event: (event[2], -event[3]))
+            threads = sorted(self._threads.items())
+
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                  for tid, name in threads]
+
+        for name, category, start, end, tid, args in spans:
+            event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': round((start - self._epoch) * 1e6, 3), 'dur': round((end - start) * 1e6, 3)}
+
+            if args:
+                event['args'] = args
+
+            events.append(event)
+
+        return events
+
+    def chromeTrace(self):
+        """
+        Returns the trace as a JSON-serializable dict in the Chrome trace event format.
+        """
+
+        return {'traceEvents': self.events(), 'displayTimeUnit': 'ms',
+                'otherData': {'recorded': self.recorded, 'dropped': self.dropped}}
+
+    def save(self, file):
+        """
+        Writes the Chrome trace JSON to a filename or text file object.
+        """
+
+        if isinstance(file, str):
+            with open(file, 'w') as f:
+                json.dump(self.chromeTrace(), f)
+        else:
+            json.dump(self.chromeTrace(), file)
+
+    def __len__(self):
+        return len(self._events)
+
+    def __repr__(self):
+        return '<Tracer {} spans, {} dropped>'.format(len(self._events), self.dropped)
@@ -0,0 +1,160 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _requireNumpy():
+    if numpy is None:
+        raise ImportError('Array unit conversion requires numpy (pip install pymaestro[numpy]).')
+
+
+def positionsToMicroseconds(positions):
+    """
+    Array version of Usc.positionToMicroseconds.
+    """
+
+    _requireNumpy()
+    return numpy.asarray(positions, numpy.float64) / 4
+
+
+def microsecondsToPositions(us):
+    """
+    Array version of Usc.microsecondsToPosition, rounded to whole quarter-microseconds and clipped to what a
+    target can hold instead of wrapping around.
+    """
+
+    _requireNumpy()
+    return numpy.clip(numpy.rint(numpy.asarray(us, numpy.float64) * 4), 0, 0xFFFF).astype(numpy.uint16)
+
+
+def periodsToMicroseconds(periods, servosAvailable):
+    _requireNumpy()
+    return numpy.asarray(periods, numpy.float64) * 256 * servosAvailable / 12
+
+
+def microsecondsToPeriods(us, servosAvailable):
+    _requireNumpy()
+    return numpy.rint(numpy.asarray(us, numpy.float64) / 256 * 12 / servosAvailable).astype(numpy.int64)
+
+
+def exponentialSpeedsToNormalSpeeds(speeds):
+    """
+    Array version of Usc._exponentialSpeedToNormalSpeed.
+    """
+
+    _requireNumpy()
+    speeds = numpy.asarray(speeds, numpy.int64)
+    return (speeds >> 3) << (speeds & 7)
+
+
+def normalSpeedsToExponentialSpeeds(speeds):
+    """
+    Array version of Usc._normalSpeedToExponentialSpeed: the smallest exponent that brings the mantissa
+    under 32, or 0xFF if even an exponent of 7 does not.
+    """
+
+    _requireNumpy()
+    speeds = numpy.asarray(speeds, numpy.int64)
+    result = numpy.full(speeds.shape, 0xFF, numpy.int64)
+    done = numpy.zeros(speeds.shape, bool)
+
+    for exponent in range(8):
+        mantissa = speeds >> exponent
+        fits = ~done & (mantissa < 32)
+        result[fits] = exponent + (mantissa[fits] << 3)
+        done |= fits
+
+    return result
+
+
+class Calibration:
+    """
+    Maps engineering units to quarter-microsecond targets for one or more channels, using the same neutral
+    and range as the Maestro's 8-bit commands: neutral - range and neutral + range are the two ends of the
+    span. Targets are clamped to [minimum, maximum].
+
+    All attributes are arrays with one entry per channel (or scalars for a single channel), so a (frames,
+    channels) array of values is converted in a handful of vectorized NumPy operations.
+    """
+
+    def __init__(self, neutral, range, minimum, maximum, span=180.0):
+        """
+        :param neutral: Neutral position in quarter-microseconds.
+        :param range: Distance from neutral to either end of the span, in quarter-microseconds.
+        :param minimum: Smallest allowed target in quarter-microseconds.
+        :param maximum: Largest allowed target in quarter-microseconds.
+        :param span: Degrees the servo turns between neutral - range and neutral + range.
+        """
+
+        _requireNumpy()
+
+        self.neutral = numpy.asarray(neutral, numpy.float64)
+        self.range = numpy.asarray(range, numpy.float64)
+        self.minimum = numpy.asarray(minimum, numpy.float64)
+        self.maximum = numpy.asarray(maximum, numpy.float64)
+        self.span = numpy.asarray(span, numpy.float64)
+
+    @staticmethod
+    def fromChannelSettings(channelSettings, span=180.0):
+        """
+        :param channelSettings: A ChannelSetting, a list of them, or a UscSettings.
+        :param span: Degrees across the span, per channel or for all of them.
+        """
+
+        if hasattr(channelSettings, 'channelSettings'):
+            channelSettings = channelSettings.channelSettings
+
+        if not isinstance(channelSettings, (list, tuple)):
+            setting = channelSettings
+            return Calibration(setting.neutral, setting.range, setting.minimum, setting.maximum, span)
+
+        return Calibration([setting.neutral for setting in channelSettings],
+                           [setting.range for setting in channelSettings],
+                           [setting.minimum for setting in channelSettings],
+                           [setting.maximum for setting in channelSettings], span)
+
+    def __len__(self):
+        return self.neutral.size
+
+    def __getitem__(self, channels):
+        # Calibration for a subset of channels, e.g. calibration[[0, 3, 5]].
+        return Calibration(self.neutral[channels], self.range[channels], self.minimum[channels],
+                           self.maximum[channels], self.span if self.span.ndim == 0 else self.span[channels])
+
+    def clamp(self, positions):
+        """
+        Clamps quarter-microsecond positions to the channel limits and rounds them to uint16 targets.
+        """
+
+        return numpy.rint(numpy.clip(positions, self.minimum, self.maximum)).astype(numpy.uint16)
+
+    def fromNormalized(self, values):
+        """
+        Converts values in [-1, 1] (neutral at 0) to targets.
+        """
+
+        return self.clamp(self.neutral + numpy.asarray(values, numpy.float64) * self.range)
+
+    def fromDegrees(self, degrees):
+        """
+        Converts angles from neutral in degrees to targets.
+        """
+
+        return self.fromNormalized(numpy.asarray(degrees, numpy.float64) * (2.0 / self.span))
+
+    def fromMicroseconds(self, us):
+        """
+        Converts pulse widths in microseconds to targets.
+        """
+
+        return self.clamp(numpy.asarray(us, numpy.float64) * 4)
+
+    def toNormalized(self, positions):
+        return (numpy.asarray(positions, numpy.float64) - self.neutral) / self.range
+
+    def toDegrees(self, positions):
+        return self.toNormalized(positions) * (self.span / 2.0)
+
+    def toMicroseconds(self, positions):
+        return numpy.asarray(positions, numpy.float64) / 4
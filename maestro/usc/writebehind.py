@@ -0,0 +1,187 @@
+import contextlib
+import threading
+import time
+
+
+class WriteBehindQueue:
+    """
+    Coalesces setTarget/setSpeed/setAcceleration calls into a pending frame that a dedicated I/O thread
+    flushes at a fixed rate. Only the latest value per channel and kind is sent, so callers never block on
+    USB and repeated writes between ticks cost nothing on the bus.
+
+    The Maestro's USB control interface takes one value per transfer, so a flush sends one transfer per
+    changed (channel, kind). Speeds and accelerations are sent before targets so that a new target moves
+    with the limits written alongside it.
+    """
+
+    SPEED = 0
+    ACCELERATION = 1
+    TARGET = 2
+
+    def __init__(self, usc, rate=50.0):
+        """
+        :param usc: The Usc object to write to.
+        :param rate: Flushes per second.
+        """
+
+        self.usc = usc
+        self.interval = 1.0 / rate
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.cycles = 0
+        self.errors = 0
+        self.lastError = None
+
+        self._pending = {}
+        self._condition = threading.Condition()
+        # Held by the I/O thread for every write and by fenced(); a batch stops once discard bumps the generation.
+        self._writeLock = threading.Lock()
+        self._generation = 0
+        self._cyclesStarted = 0
+        self._cyclesCompleted = 0
+        self._wake = False
+        self._running = True
+
+        self._thread = threading.Thread(target=self._run, name='maestro-write-behind', daemon=True)
+        self._thread.start()
+
+    def put(self, kind, channel, value):
+        key = (channel, kind)
+
+        with self._condition:
+            if not self._running:
+                raise Exception('The write-behind queue has been stopped.')
+
+            self.submitted += 1
+
+            if key in self._pending:
+                self.coalesced += 1
+
+            self._pending[key] = value
+
+    def setTarget(self, servo, value):
+        self.put(self.TARGET, servo, value)
+
+    def setSpeed(self, servo, value):
+        self.put(self.SPEED, servo, value)
+
+    def setAcceleration(self, servo, value):
+        self.put(self.ACCELERATION, servo, value)
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def discard(self):
+        """
+        Drops everything queued, and whatever the I/O thread has not yet written of the batch it is sending.
+        """
+
+        with self._condition:
+            self._pending.clear()
+            self._generation += 1
+
+    @contextlib.contextmanager
+    def fenced(self):
+        """
+        Discards everything queued and keeps the I/O thread from writing while the block runs, so that
+        nothing taken from the queue earlier can reach the device after the block's own writes.
+        """
+
+        with self._writeLock:
+            self.discard()
+            yield
+
+    def flush(self, timeout=None):
+        """
+        Sends everything queued so far immediately and waits until it has been written.
+        :return: False if the timeout expired first.
+        """
+
+        with self._condition:
+            wanted = self._cyclesStarted + 1
+            self._wake = True
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._cyclesCompleted >= wanted or not self._thread.is_alive(),
+                                            timeout)
+
+    def drain(self, timeout=None):
+        """
+        Waits, at the normal flush rate, until nothing is queued or being written.
+        :return: False if the timeout expired first.
+        """
+
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: (not self._pending and self._cyclesCompleted == self._cyclesStarted)
+                or not self._thread.is_alive(), timeout)
+
+    def stop(self, drain=True):
+        """
+        Stops the I/O thread, flushing what is still queued unless drain is False.
+        """
+
+        with self._condition:
+            if not drain:
+                self._pending.clear()
+            self._running = False
+            self._condition.notify_all()
+
+        self._thread.join()
+
+    def counters(self):
+        with self._condition:
+            return {'submitted': self.submitted, 'coalesced': self.coalesced, 'sent': self.sent,
+                    'cycles': self.cycles, 'pending': len(self._pending), 'errors': self.errors}
+
+    def _run(self):
+        writers = {
+            self.TARGET: self.usc._writeTarget,
+            self.SPEED: self.usc._writeSpeed,
+            self.ACCELERATION: self.usc._writeAcceleration,
+        }
+
+        nextFlush = time.monotonic() + self.interval
+
+        while True:
+            with self._condition:
+                while self._running and not self._wake:
+                    remaining = nextFlush - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                self._wake = False
+                batch = self._pending
+                self._pending = {}
+                self._cyclesStarted += 1
+                generation = self._generation
+                running = self._running
+
+            nextFlush = max(nextFlush + self.interval, time.monotonic())
+            sent = 0
+            errors = 0
+
+            for (channel, kind) in sorted(batch):
+                with self._writeLock:
+                    if self._generation != generation:
+                        break
+
+                    try:
+                        writers[kind](channel, batch[(channel, kind)])
+                        sent += 1
+                    except Exception as e:
+                        errors += 1
+                        self.lastError = e
+                        self.usc._writeFailed(kind, channel)
+
+            with self._condition:
+                self.sent += sent
+                self.errors += errors
+                self.cycles += 1
+                self._cyclesCompleted += 1
+                self._condition.notify_all()
+
+            if not running:
+                return
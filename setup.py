@@ -7,11 +7,19 @@ setup(name='pymaestro',
       author='Lujing Cen',
       author_email='lujingcen@gmail.com',
       license='MIT',
-      packages=['maestro'],
+      packages=['maestro', 'maestro.bytecode', 'maestro.usc'],
       install_requires=[
           'enum34;python_version<"3.4"',
           'pyusb>=1.0.0'
       ],
+      extras_require={
+          'numpy': ['numpy'],
+      },
+      entry_points={
+          'console_scripts': [
+              'maestro-compile = maestro.bytecode.batch:main',
+          ]
+      },
       classifiers=[
           'Development Status :: 3 - Alpha',
           'Intended Audience :: Developers',
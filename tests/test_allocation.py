@@ -0,0 +1,43 @@
+from maestro.bytecode.program import BytecodeProgram
+from maestro.bytecode.protocol import Opcode
+from maestro.bytecode.reader import BytecodeReader
+
+
+def _script(calls, subroutines):
+    return '\n'.join(calls + ['quit'] + ['sub {}\n  return'.format(name) for name in subroutines]) + '\n'
+
+
+def _compile(script, allocation=None, loopWeight=None):
+    return BytecodeReader().read(script, True, allocation, loopWeight)
+
+
+def test_frequency_allocation_gives_short_commands_to_the_most_called():
+    # 128 subroutines that are never called come first, so in definition order the two hot ones need CALL.
+    idle = ['idle{}'.format(i) for i in range(128)]
+    script = _script(['hot1 hot2 hot1 hot2 hot1'], idle + ['hot1', 'hot2'])
+
+    definition = _compile(script)
+    frequency = _compile(script, BytecodeProgram.ALLOCATE_FREQUENCY)
+
+    assert definition.subroutineCommands['HOT1'] == definition.subroutineCommands['HOT2'] == Opcode.CALL
+    assert (frequency.subroutineCommands['HOT1'], frequency.subroutineCommands['HOT2']) == (128, 129)
+    assert definition.callAllocation.bytesSaved == 0 and definition.callAllocation.longCalls == 5
+
+    allocation = frequency.callAllocation
+    assert (allocation.subroutines, allocation.shortCalls, allocation.longCalls) == (130, 5, 0)
+    assert allocation.bytesSaved == 10
+    assert len(definition.getByteList()) - len(frequency.getByteList()) == allocation.bytesSaved
+
+
+def test_loop_weight_favours_calls_in_loops():
+    filler = ['filler{}'.format(i) for i in range(127)]
+    script = _script([' '.join(filler), 'twice twice', 'begin looped repeat'], filler + ['twice', 'looped'])
+
+    flat = _compile(script, BytecodeProgram.ALLOCATE_FREQUENCY)
+    weighted = _compile(script, BytecodeProgram.ALLOCATE_FREQUENCY, loopWeight=10)
+
+    assert flat.subroutineCommands['LOOPED'] == Opcode.CALL
+    assert weighted.subroutineCommands['LOOPED'] == 128 and weighted.subroutineCommands['TWICE'] == 129
+    assert weighted.subroutineCommands['FILLER126'] == Opcode.CALL
+    # Static sizes are the same: one long call site either way.
+    assert len(flat.getByteList()) == len(weighted.getByteList())
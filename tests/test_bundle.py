@@ -0,0 +1,60 @@
+import os
+
+from maestro.usc.bundle import SettingsBundle
+from maestro.usc.main import Usc
+from maestro.usc.protocol import ChannelMode, HomeMode
+from maestro.usc.settings import UscSettings, ChannelSetting
+
+
+def _settings():
+    settings = UscSettings()
+    settings.servosAvailable = 12
+    settings.neverSuspend = True
+    settings.fixedBaudRate = 115200
+
+    for i in range(12):
+        cs = ChannelSetting()
+        cs.name = 'joint {}'.format(i)
+        cs.mode = ChannelMode.Output if i % 3 == 0 else ChannelMode.Servo
+        cs.homeMode = HomeMode.Goto if i % 2 else HomeMode.Off
+        cs.home = 4000 + 100 * i
+        cs.speed = i
+        settings.channelSettings.append(cs)
+
+    settings.setAndCompileScript('begin\n  wave\nrepeat\nsub wave\n  6000 0 servo\n  return\n')
+    settings.sequences = [('wave', [('up', 500, [6000, 7000]), ('down', 250, [])]), ('empty', [])]
+    return settings
+
+
+def _fields(settings):
+    fields = dict(vars(settings))
+    fields['channelSettings'] = [vars(cs) for cs in settings.channelSettings]
+    del fields['bytecodeProgram'], fields['fileLayout']
+    return fields
+
+
+def test_bundle_round_trip(tmp_path):
+    settings = _settings()
+    path = os.path.join(str(tmp_path), 'settings.bundle')
+    SettingsBundle.save(settings, path)
+    loaded = SettingsBundle.load(path)
+
+    assert _fields(loaded) == _fields(settings)
+
+    program, image = settings.bytecodeProgram, loaded.bytecodeProgram
+    assert image.getByteList() == program.getByteList()
+    assert image.getCRC() == program.getCRC()
+    assert image.getSubroutineTable() == Usc.subroutineTable(program.subroutineAddresses, program.subroutineCommands)
+    assert SettingsBundle.dumps(loaded) == SettingsBundle.dumps(settings)
+
+
+def test_corrupt_bundle_is_rejected():
+    data = bytearray(SettingsBundle.dumps(_settings()))
+    data[-1] ^= 0xFF
+
+    try:
+        SettingsBundle.loads(data)
+    except Exception as e:
+        assert 'corrupt' in str(e)
+    else:
+        raise AssertionError('A corrupt bundle should not load.')
@@ -0,0 +1,54 @@
+from maestro.usc.configuration import ConfigurationFile
+
+SETTINGS = '''<?xml version="1.0" encoding="utf-8"?>
+<!--Pololu Maestro servo controller settings file, http://www.pololu.com/catalog/product/1350-->
+<UscSettings version="1">
+  <NeverSuspend>true</NeverSuspend>
+  <SerialMode>USB_DUAL_PORT</SerialMode>
+  <FixedBaudRate>9600</FixedBaudRate>
+  <SerialTimeout>0</SerialTimeout>
+  <EnableCrc>false</EnableCrc>
+  <SerialDeviceNumber>12</SerialDeviceNumber>
+  <SerialMiniSscOffset>0</SerialMiniSscOffset>
+  <EnablePullups>true</EnablePullups>
+  <Channels MiniMaestroServoPeriod="80000" ServoMultiplier="1">
+    <!--Period = 20ms-->
+    <!--Channel 0-->
+    <Channel name="left &amp; right" mode="Servo" min="3968" max="8000" homemode="Goto" home="6000" speed="20" acceleration="3" neutral="6000" range="1905" />
+    <!--Channel 1-->
+    <Channel name="" mode="Output" min="3968" max="8000" homemode="Off" home="3968" speed="0" acceleration="0" neutral="6000" range="1905" />
+  </Channels>
+  <Sequences>
+    <Sequence name="wave">
+      <Frame name="Frame 0" duration="500">6000 4000</Frame>
+      <Frame name="Frame 1" duration="250">7000 4000</Frame>
+    </Sequence>
+  </Sequences>
+  <Script ScriptDone="false">begin
+  500 delay
+repeat
+</Script>
+</UscSettings>'''
+
+
+def test_load_then_dumps_reproduces_the_file():
+    for newline in ('\n', '\r\n'):
+        data = SETTINGS.replace('\n', newline).encode('utf-8')
+        warnings = []
+        settings = ConfigurationFile.loads(data, warnings)
+
+        assert warnings == []
+        assert settings.neverSuspend and settings.fixedBaudRate == 9600
+        assert settings.channelSettings[0].name == 'left & right' and settings.channelSettings[0].speed == 20
+        assert settings.sequences == [('wave', [('Frame 0', 500, [6000, 4000]), ('Frame 1', 250, [7000, 4000])])]
+        assert ConfigurationFile.dumps(settings) == data
+
+
+def test_changed_settings_are_saved():
+    settings = ConfigurationFile.loads(SETTINGS)
+    settings.fixedBaudRate = 115200
+    settings.channelSettings[1].home = 5000
+    reloaded = ConfigurationFile.loads(ConfigurationFile.dumps(settings))
+
+    assert reloaded.fixedBaudRate == 115200 and reloaded.channelSettings[1].home == 5000
+    assert reloaded.script == settings.script
@@ -0,0 +1,13 @@
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.flash import iterBlocks
+from maestro.usc.main import Usc
+
+
+def test_iter_blocks_accepts_int_lists():
+    assert [bytes(chunk) for _, chunk in iterBlocks(list(range(32)))] == [bytes(range(16)), bytes(range(16, 32))]
+
+
+def test_write_script_accepts_int_lists():
+    device = VirtualMaestro(24)
+    Usc(device).writeScript([1] * 16)
+    assert device.script[:16] == bytearray([1] * 16)
@@ -0,0 +1,79 @@
+from maestro.bytecode.inline import SubroutineInliner
+from maestro.bytecode.reader import BytecodeReader
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+
+SCRIPT = '''0
+begin
+  dup 6 less_than
+while
+  dup target over servo
+  1 plus
+repeat
+drop
+7 skip
+quit
+sub target
+  dup 3 less_than if 4000 plus return endif
+  8000 plus
+  return
+sub skip
+  goto done
+  1 plus
+done:
+  return
+sub forever
+  forever
+  return
+'''
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _run(program):
+    clock = Clock()
+    usc = Usc(VirtualMaestro(24, clock=clock))
+    usc.loadProgram(program)
+    usc.setScriptDone(0)
+    clock.now = 1.0
+    variables = usc.getVariables('variables')
+    assert variables.scriptDone and variables.errors == 0
+    return ([servo.target for servo in usc.getVariables('servos')[:6]],
+            usc.getVariables('stack')[:variables.stackPointer])
+
+
+def test_inlined_program_behaves_like_the_original():
+    original = BytecodeReader().read(SCRIPT, True)
+    inlined = BytecodeReader().read(SCRIPT, True, inliner=SubroutineInliner(maxSize=32))
+    report = inlined.inlineReport
+
+    assert report.inlined == {'TARGET': 1, 'SKIP': 1} and sorted(report.removed) == ['SKIP', 'TARGET']
+    assert report.skipped == {'FOREVER': 'is recursive'} and report.cyclesSaved == 4
+    assert report.bytesBefore == len(original.getByteList()) and report.bytesAfter == len(inlined.getByteList())
+    assert [instruction.labelName for instruction in inlined.instructionList if instruction.isCall] == ['FOREVER']
+
+    assert _run(inlined) == _run(original) == ([4000, 4001, 4002, 8003, 8004, 8005], [7])
+
+
+def test_oversized_subroutines_are_not_inlined():
+    report = BytecodeReader().read(SCRIPT, True, inliner=SubroutineInliner(maxSize=3)).inlineReport
+
+    assert report.inlined == {}
+    assert report.skipped['TARGET'] == 'body is 18 bytes, over the limit of 3'
+    assert report.skipped['FOREVER'] == 'is recursive'
+
+
+def test_inlining_stays_within_the_budget():
+    script = '1 target 2 target 3 target quit\n' + SCRIPT[SCRIPT.index('sub target'):SCRIPT.index('sub skip')]
+    unlimited = BytecodeReader().read(script, True, inliner=SubroutineInliner(maxSize=32)).inlineReport
+    limited = BytecodeReader().read(script, True, inliner=SubroutineInliner(maxSize=32, budget=0)).inlineReport
+
+    assert unlimited.inlined == {'TARGET': 3} and unlimited.bytesAdded > 0
+    assert limited.inlined == {} and limited.bytesAdded == 0
+    assert limited.skipped['TARGET'].startswith('would make the script')
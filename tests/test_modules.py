@@ -0,0 +1,64 @@
+import os
+
+from maestro.bytecode.modules import ModuleCompiler
+from maestro.bytecode.reader import BytecodeReader
+
+MAIN = '''#include lib.txt
+begin
+  1000 wiggle
+repeat
+'''
+
+LIBRARY = '''sub wiggle
+  0 servo
+  return
+sub unused
+  1 servo
+  return
+'''
+
+
+def _write(directory, name, text):
+    path = os.path.join(str(directory), name)
+
+    with open(path, 'w') as f:
+        f.write(text)
+
+    return path
+
+
+def test_link_matches_a_single_file_and_drops_unused_subroutines(tmp_path):
+    _write(tmp_path, 'lib.txt', LIBRARY)
+    compiler = ModuleCompiler(True)
+    program = compiler.build(_write(tmp_path, 'main.txt', MAIN))
+    single = BytecodeReader().read(MAIN + LIBRARY.split('sub unused')[0], True)
+
+    assert program.getByteList() == single.getByteList()
+    assert compiler.lastBuild.keptSubroutines == ['WIGGLE']
+    assert compiler.lastBuild.droppedSubroutines == ['UNUSED']
+
+
+def test_link_keeps_subroutines_the_main_code_falls_into(tmp_path):
+    compiler = ModuleCompiler(True)
+    program = compiler.build(_write(tmp_path, 'main.txt', '5 6\nsub fallen\n  plus\n  quit\n'))
+
+    assert compiler.lastBuild.keptSubroutines == ['FALLEN']
+    assert program.getByteList() == BytecodeReader().read('5 6\nsub fallen\n  plus\n  quit\n', True).getByteList()
+
+
+def test_linked_listing_and_source_lines_cover_included_files(tmp_path):
+    library = _write(tmp_path, 'lib.txt', LIBRARY)
+    program = ModuleCompiler(True).build(_write(tmp_path, 'main.txt', MAIN))
+    wiggle = [instruction for instruction in program.instructionList if instruction.filename == library]
+
+    assert wiggle and program.getSourceLine(wiggle[-1].lineNumber, library).strip() == 'return'
+
+    listing = os.path.join(str(tmp_path), 'listing.txt')
+    BytecodeReader.writeListing(program, listing)
+
+    with open(listing) as f:
+        text = f.read()
+
+    assert library + ':' in text
+    assert sum(len(instruction.toByteList()) for instruction in program.instructionList) == \
+        sum(len(line.split(' -- ')[0].split(': ')[1].strip()) // 2 for line in text.splitlines() if ' -- ' in line)
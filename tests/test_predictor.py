@@ -0,0 +1,20 @@
+import time
+
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+from maestro.usc.predictor import MotionPredictor
+
+
+def test_wait_survives_channels_invalidated_meanwhile():
+    usc = Usc(VirtualMaestro(24))
+    usc.setTarget(1, 7000)
+
+    def clock():
+        # As if another thread invalidated channel 0 every time the predictor looks at the clock.
+        predictor.invalidate(0)
+        return time.monotonic()
+
+    predictor = MotionPredictor(usc, clock=clock)
+    predictor.observe()
+
+    assert predictor.waitUntilSettled([0, 1], timeout=1.0)
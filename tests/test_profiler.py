@@ -0,0 +1,35 @@
+import itertools
+
+from maestro.bytecode.reader import BytecodeReader
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+from maestro.usc.profiler import ScriptProfiler
+
+SCRIPT = '''begin
+  work
+repeat
+sub work
+  1 2 plus drop 3 4 plus drop 5 6 plus drop
+  return
+'''
+
+
+def test_profiler_attributes_samples_to_subroutines_and_lines():
+    # One millisecond per transfer, so the script advances by the same amount between samples.
+    ticks = itertools.count(0, 0.001)
+    usc = Usc(VirtualMaestro(24, clock=lambda: next(ticks)))
+    program = BytecodeReader().read(SCRIPT, True)
+    usc.loadProgram(program)
+    usc.setScriptDone(0)
+
+    profiler = ScriptProfiler(usc, program).run(10, maxSamples=500)
+
+    assert profiler.samples == 500 and profiler.stoppedSamples == 0
+    assert sum(profiler.instructionCounts.values()) == 500
+    assert dict((name, total) for _, total, name in profiler.subroutineProfile())['WORK'] > 250
+    assert set(line for _, line in profiler.lineProfile()) <= {1, 2, 3, 5, 6}
+
+    stacks = dict(line.rsplit(' ', 1) for line in profiler.collapsedStacks())
+    assert sum(int(count) for count in stacks.values()) == 500
+    assert '(main);WORK' in stacks
+    assert 'Subroutines:' in profiler.flatProfile()
@@ -0,0 +1,81 @@
+import pytest
+
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.registry import DeviceRegistry
+
+
+class FlakyVirtualMaestro(VirtualMaestro):
+    def __init__(self, failures=0, *args, **kwargs):
+        VirtualMaestro.__init__(self, *args, **kwargs)
+        self.failures = failures
+
+    def ctrl_transfer(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('Pipe error.')
+
+        return VirtualMaestro.ctrl_transfer(self, *args, **kwargs)
+
+
+def test_failed_restore_is_retried():
+    devices = [FlakyVirtualMaestro(0, 24, '00000001')]
+    registry = DeviceRegistry(finder=lambda: list(devices), hotplug=False)
+    assert registry.scan() == (['00000001'], [])
+    registry['00000001'].setTarget(0, 6000)
+
+    devices[:] = []
+    assert registry.scan() == ([], ['00000001'])
+
+    devices[:] = [FlakyVirtualMaestro(1, 24, '00000001')]
+    assert registry.scan() == ([], [])
+    assert registry.errors == 1
+
+    assert registry.scan() == (['00000001'], [])
+    assert registry.connected() == ['00000001']
+    assert registry['00000001'].getVariables('servos')[0].target == 6000
+
+
+def test_one_bad_device_does_not_abort_the_scan():
+    devices = [FlakyVirtualMaestro(1, 24, '00000001'), FlakyVirtualMaestro(0, 24, '00000002')]
+    registry = DeviceRegistry(finder=lambda: list(devices), hotplug=False)
+    assert registry.scan() == (['00000002'], [])
+    assert sorted(registry.scan()[0]) == ['00000001']
+
+
+class OtherPololuDevice(VirtualMaestro):
+    def __init__(self, *args, **kwargs):
+        VirtualMaestro.__init__(self, *args, **kwargs)
+        self.idProduct = 0x0101
+
+
+def test_other_products_are_not_opened():
+    devices = [OtherPololuDevice(24, '00000003'), FlakyVirtualMaestro(0, 24, '00000001')]
+    registry = DeviceRegistry(finder=lambda: list(devices), hotplug=False)
+
+    assert registry.scan() == (['00000001'], [])
+    assert registry.errors == 0 and devices[0].transfers == 0
+
+
+def test_the_old_usb_handle_is_disposed_on_reconnect(monkeypatch):
+    pytest.importorskip('usb.util')
+    import usb.core
+    import usb.util
+
+    class UsbVirtualMaestro(VirtualMaestro):
+        pass
+
+    # Stands in for a pyusb device, so its handle is disposed like a real one.
+    disposed = []
+    monkeypatch.setattr(usb.core, 'Device', UsbVirtualMaestro)
+    monkeypatch.setattr(usb.util, 'dispose_resources', disposed.append)
+
+    old = UsbVirtualMaestro(24, '00000001')
+    devices = [old]
+    registry = DeviceRegistry(finder=lambda: list(devices), hotplug=False)
+    registry.scan()
+
+    devices[:] = [FlakyVirtualMaestro(0, 24, '00000001')]
+    registry.scan()
+
+    assert disposed == [old]
+    assert registry['00000001'].dev is devices[0]
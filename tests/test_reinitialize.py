@@ -0,0 +1,55 @@
+import time
+
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+from maestro.usc.protocol import uscRequest
+
+
+class SlowResetVirtualMaestro(VirtualMaestro):
+    """
+    Only carries out a reinitialization once delay seconds have passed, or never if delay is None.
+    """
+
+    def __init__(self, delay, *args, **kwargs):
+        VirtualMaestro.__init__(self, *args, **kwargs)
+        self.delay = delay
+        self.resetAt = None
+
+    def ctrl_transfer(self, bmRequestType, bRequest, *args, **kwargs):
+        if bRequest == uscRequest.REQUEST_REINITIALIZE:
+            self.resetAt = None if self.delay is None else time.perf_counter() + self.delay
+            return None
+
+        if self.resetAt is not None and time.perf_counter() >= self.resetAt:
+            self.resetAt = None
+            self._reinitialize()
+
+        return VirtualMaestro.ctrl_transfer(self, bmRequestType, bRequest, *args, **kwargs)
+
+
+def test_reinitialize_waits_for_the_reset():
+    usc = Usc(SlowResetVirtualMaestro(0.01, 24))
+    assert usc.reinitalize() >= 0.01
+
+
+def test_reinitialize_reports_when_the_device_never_resets():
+    usc = Usc(SlowResetVirtualMaestro(None, 24))
+    usc.setSpeed(23, 40)
+
+    assert usc.reinitalize() is None
+    assert usc.reinitializeTimedOut
+    assert usc.getVariables('servos')[23].speed == 40
+
+
+def test_reinitialize_polls_with_one_transfer():
+    device = SlowResetVirtualMaestro(0.05, 24)
+    usc = Usc(device)
+    polls = []
+    hasReset = usc._hasReset
+    usc._hasReset = lambda *args: polls.append(args) or hasReset(*args)
+    before = device.transfers
+    usc.reinitalize()
+
+    assert not usc.reinitializeTimedOut and len(polls) > 1
+    # The speed and parameter reads and the marker, one transfer per poll and the variables once reset.
+    assert device.transfers - before == 3 + len(polls) + 1
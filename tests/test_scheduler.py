@@ -0,0 +1,28 @@
+import threading
+
+from maestro.usc.scheduler import RequestScheduler
+
+
+def test_aging_never_stalls_the_bus():
+    # Aging promotes telemetry over control with time alone; every request must still be granted.
+    for _ in range(20):
+        scheduler = RequestScheduler(agingLimit=0.0005)
+        done = []
+
+        def worker(lane):
+            with scheduler.lane(lane):
+                for _ in range(200):
+                    scheduler.run(sum, range(2000))
+
+            done.append(lane)
+
+        threads = [threading.Thread(target=worker, args=(lane,), daemon=True)
+                   for lane in (RequestScheduler.CONTROL, RequestScheduler.TELEMETRY, RequestScheduler.TELEMETRY)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join(5)
+
+        assert len(done) == 3, 'The bus stalled.'
@@ -0,0 +1,86 @@
+from maestro.bytecode.sequence import Frame, SequenceCompiler, compileSequence, play
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _targets(usc, count):
+    return [servo.target for servo in usc.getVariables('servos')[:count]]
+
+
+def _device(program):
+    clock = Clock()
+    usc = Usc(VirtualMaestro(24, clock=clock))
+    usc.loadProgram(program)
+    return usc, clock
+
+
+def test_sequence_plays_its_frames_in_time():
+    # Frames over eight channels from 0 (loop body), three from 10 (unrolled) and a repeated channel set.
+    frames = [Frame([4000 + 100 * i for i in range(8)], 100),
+              Frame(dict((10 + i, 5000 + i) for i in range(3)), 200),
+              Frame([6000] * 8, 100),
+              Frame([7000] * 8, 40000)]
+    program = compileSequence('wave', frames)
+    usc, clock = _device(program)
+    play(usc, program, 'wave')
+
+    seen = {}
+
+    # The emulator runs the script when it is polled, so poll every millisecond and look mid-frame.
+    for step in range(500):
+        clock.now = step * 0.001
+        targets = _targets(usc, 13)
+
+        if step in (50, 200, 350, 450):
+            seen[step] = targets
+
+    loop = [4000 + 100 * i for i in range(8)]
+    assert seen == {50: loop + [0] * 5,
+                    200: loop + [0, 0, 5000, 5001, 5002],
+                    350: [6000] * 8 + [0, 0, 5000, 5001, 5002],
+                    450: [7000] * 8 + [0, 0, 5000, 5001, 5002]}
+    assert not usc.getVariables('variables').scriptDone
+
+    # The 40 s frame is split into two delays; each starts when the emulator is next polled.
+    for now in (20.0, 33.5):
+        clock.now = now
+        assert not usc.getVariables('variables').scriptDone
+
+    clock.now = 41.0
+    assert usc.getVariables('variables').scriptDone
+
+
+def test_sequence_repeats_count_times():
+    frames = [Frame({0: 4000}, 10), Frame({0: 8000}, 10)]
+    program = compileSequence('blink', frames, count=3)
+    usc, clock = _device(program)
+    play(usc, program, 'blink')
+    seen = []
+
+    for step in range(1, 80):
+        clock.now = step * 0.001
+        seen.append(_targets(usc, 1)[0])
+
+    assert [target for index, target in enumerate(seen) if index == 0 or seen[index - 1] != target] == \
+        [4000, 8000] * 3
+    assert usc.getVariables('variables').scriptDone
+
+
+def test_sequences_that_do_not_fit_are_rejected():
+    compiler = SequenceCompiler(False)
+    compiler.addSequence('long', [Frame([4000 + i] * 6, 10) for i in range(300)])
+
+    try:
+        compiler.compile()
+    except Exception as e:
+        assert 'more than the 1024 bytes' in str(e)
+    else:
+        raise AssertionError('The sequence should not fit on a Micro Maestro.')
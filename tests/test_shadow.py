@@ -0,0 +1,31 @@
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+
+
+class FlakyVirtualMaestro(VirtualMaestro):
+    def __init__(self, *args, **kwargs):
+        VirtualMaestro.__init__(self, *args, **kwargs)
+        self.failures = 0
+
+    def ctrl_transfer(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('Pipe error.')
+
+        return VirtualMaestro.ctrl_transfer(self, *args, **kwargs)
+
+
+def test_failed_write_is_not_shadowed():
+    device = FlakyVirtualMaestro(24)
+    usc = Usc(device, shadow=True)
+    device.failures = 1
+
+    try:
+        usc.setTarget(0, 6000)
+    except IOError:
+        pass
+    else:
+        raise AssertionError('The write should have failed.')
+
+    usc.setTarget(0, 6000)
+    assert usc.getVariables('servos')[0].target == 6000
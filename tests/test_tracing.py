@@ -0,0 +1,14 @@
+from maestro.bytecode.reader import BytecodeReader
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+
+
+def test_nested_spans_record_the_lane_that_applies():
+    usc = Usc(VirtualMaestro(24))
+    tracer = usc.enableTracing()
+    usc.loadProgram(BytecodeReader().read('1 2 plus quit', True))
+    usc.setScriptDone(1)
+
+    lanes = [(event['name'], event['args']['lane']) for event in tracer.events()
+             if event['name'] == 'setScriptDone']
+    assert lanes == [('setScriptDone', 'configuration'), ('setScriptDone', 'control')]
@@ -0,0 +1,13 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from maestro.usc.units import microsecondsToPositions, positionsToMicroseconds
+
+
+def test_microseconds_to_positions_clips_instead_of_wrapping():
+    positions = microsecondsToPositions([-5, 0, 1500.1, 16383.75, 20000])
+
+    assert positions.dtype == numpy.uint16
+    assert positions.tolist() == [0, 0, 6000, 65535, 65535]
+    assert positionsToMicroseconds(positions[2:3]).tolist() == [1500.0]
@@ -0,0 +1,33 @@
+import threading
+import time
+
+from maestro.usc.emulator import VirtualMaestro
+from maestro.usc.main import Usc
+
+
+class LatentVirtualMaestro(VirtualMaestro):
+    def __init__(self, latency, *args, **kwargs):
+        VirtualMaestro.__init__(self, *args, **kwargs)
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    def ctrl_transfer(self, *args, **kwargs):
+        with self.lock:
+            time.sleep(self.latency)
+            return VirtualMaestro.ctrl_transfer(self, *args, **kwargs)
+
+
+def test_emergency_stop_fences_batch_in_flight():
+    usc = Usc(LatentVirtualMaestro(0.005, 24))
+    usc.enableWriteBehind(rate=1000)
+
+    for servo in range(24):
+        usc.setTarget(servo, 6000)
+
+    # Let the I/O thread take the batch and start writing it.
+    time.sleep(0.02)
+    usc.emergencyStop()
+    usc.flush()
+
+    assert [servo.target for servo in usc.getVariables('servos')] == [0] * 24
+    usc.disableWriteBehind()